@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@package cgsn_parsers.batch
+@file cgsn_parsers/batch.py
+@author Christopher Wingard
+@brief Parses all of the raw log files from a deployment in a pool of worker
+    processes, writing the results to the same output layout used by the
+    harvester scripts in utilities/harvesters.
+'''
+import argparse
+import functools
+import glob
+import importlib
+import multiprocessing
+import os
+import re
+import traceback
+
+from cgsn_parsers.parsers.common import run_parser
+from cgsn_parsers.parsers.metrics import metrics_filename
+from cgsn_parsers.parsers.registry import detect, sniff_switch
+
+# Default raw and parsed data directories used by the harvester scripts
+RAW = '/webdata/cgsn/data/raw'
+PARSED = '/webdata/cgsn/data/proc'
+
+# Instrument directory names (less any trailing number) that do not match the
+# name of the parser or the output directory.
+INSTRUMENTS = {
+    'adcps': 'adcp',
+    'adcpt': 'adcp',
+    'hyd': 'hydgn',
+    'superv': 'superv_dcl'
+}
+
+# File name extensions for the output formats
+EXTENSIONS = {'json': '.json', 'netcdf': '.nc'}
+
+# Parsers that are available to the batch driver
+PARSERS = [
+    'adcp', 'ctdbp', 'dosta', 'fdchp', 'flort', 'gps', 'hydgn', 'metbk', 'mopak',
+    'nutnr', 'optaa', 'pco2a', 'pco2w', 'phsen', 'presf', 'pwrsys', 'spkir',
+    'superv_cpm', 'superv_dcl', 'vel3d', 'velpt', 'wavss', 'zplsc'
+]
+
+
+def _platform(logger):
+    '''
+    Return the name of the mooring section (buoy, nsif or mfn) a data logger is
+    installed on, matching the choices made in the individual harvester scripts.
+    '''
+    if logger in ['cpm1', 'dcl11', 'dcl12', 'dcl17']:
+        return 'buoy'
+
+    if logger in ['cpm2', 'dcl16', 'dcl26', 'dcl27']:
+        return 'nsif'
+
+    return 'mfn'
+
+
+def _switch(parser, logger):
+    '''
+    Return the integer switch the harvester scripts pass to those parsers
+    requiring one (the CTDBP type, NUTNR spectra flag and VEL3D sample rate),
+    used if the switch cannot be detected from the file contents.
+    '''
+    if parser == 'ctdbp':
+        return {'dcl17': 3, 'dcl27': 1}.get(logger, 2)
+
+    if parser == 'nutnr':
+        return 1
+
+    if parser == 'vel3d':
+        return 8
+
+    return None
+
+
+def _in_range(filename, start, stop):
+    '''
+    Check if the date (YYYYMMDD) at the start of a log file name falls within
+    the requested range. Either end of the range may be left open.
+    '''
+    date = filename[:8]
+    if not date.isdigit():
+        return False
+
+    if start and date < start:
+        return False
+
+    if stop and date > stop:
+        return False
+
+    return True
+
+
+def find_files(raw, parsed, platform, deploy, start=None, stop=None, fmt='json', compress=False):
+    '''
+    Discover the instrument log files for a platform and deployment, returning
+    a list of jobs (file size, parser name, input file, output file and switch)
+    sorted with the largest files first so the pool is not left waiting on a
+    single large file at the end of the run. If compress is set, the JSON
+    output files are named (and written) as gzip files.
+    '''
+    extension = EXTENSIONS[fmt]
+    if compress and fmt == 'json':
+        extension += '.gz'
+
+    base = os.path.join(raw, platform, deploy, 'cg_data')
+    dirs = []
+
+    # the CPM logged data (GPS, power system and CPM supervisor files)
+    for name in ['gps', 'pwrsys']:
+        dirs.append((name, 'cpm1', os.path.join(base, name)))
+
+    dirs.append(('superv_cpm', 'cpm1', os.path.join(base, 'superv')))
+    for path in sorted(glob.glob(os.path.join(base, 'cpm[0-9]*', 'superv'))):
+        dirs.append(('superv_cpm', os.path.basename(os.path.dirname(path)), path))
+
+    # the instrument data logged by the DCLs
+    for path in sorted(glob.glob(os.path.join(base, 'dcl[0-9]*', '*'))):
+        name = re.sub(r'\d+$', '', os.path.basename(path))
+        dirs.append((INSTRUMENTS.get(name, name), os.path.basename(os.path.dirname(path)), path))
+
+    jobs = []
+    for parser, logger, path in dirs:
+        if parser not in PARSERS or not os.path.isdir(path):
+            continue
+
+        # set the output directory, with the supervisor files separated by logger
+        outdir = os.path.join(parsed, platform, deploy, _platform(logger), parser)
+        if parser.startswith('superv'):
+            outdir = os.path.join(parsed, platform, deploy, _platform(logger), 'superv', logger)
+
+        for infile in glob.glob(os.path.join(path, '*.log')):
+            filename = os.path.basename(infile)
+            size = os.path.getsize(infile)
+            if size == 0 or not _in_range(filename, start, stop):
+                continue
+
+            switch = sniff_switch(parser, infile)
+            if switch is None:
+                switch = _switch(parser, logger)
+
+            outfile = os.path.join(outdir, filename[:-4] + extension)
+            jobs.append((size, parser, infile, outfile, switch))
+
+    jobs.sort(key=lambda job: (-job[0], job[2]))
+    return jobs
+
+
+def list_files(files, parsed, fmt='json', compress=False):
+    '''
+    Create the jobs for an arbitrary list of log files, using the registry to
+    select the parser and switch for each file. The output files are written
+    to a directory per parser under the parsed data directory. Files that do
+    not match any of the parsers are returned separately.
+    '''
+    extension = EXTENSIONS[fmt]
+    if compress and fmt == 'json':
+        extension += '.gz'
+
+    jobs = []
+    unknown = []
+    for infile in files:
+        infile = os.path.abspath(infile)
+        size = os.path.getsize(infile)
+        if size == 0:
+            continue
+
+        try:
+            parser, switch = detect(infile)
+        except ValueError:
+            unknown.append(infile)
+            continue
+
+        filename = os.path.basename(infile)
+        outfile = os.path.join(parsed, parser, filename[:-4] + extension)
+        jobs.append((size, parser, infile, outfile, switch))
+
+    jobs.sort(key=lambda job: (-job[0], job[2]))
+    return jobs, unknown
+
+
+def parse_file(job, cache=None, fmt='json', append=False, metrics=None):
+    '''
+    Parse a single log file and write the results to a JSON (or NetCDF) file,
+    using the results in the cache directory if set and the file has not
+    changed since it was last parsed (or, with append set, parsing just the
+    data added since the last run). If set, the run metrics are saved to the
+    list of metrics files (see run_parser). Returns the input file name and any
+    error message. Errors are caught and reported rather than raised so a
+    single bad file does not stop the rest of the pool.
+    '''
+    size, parser, infile, outfile, switch = job
+    try:
+        module = importlib.import_module('cgsn_parsers.parsers.parse_' + parser)
+        if switch is None:
+            data = module.Parser(infile)
+        else:
+            data = module.Parser(infile, switch)
+
+        outdir = os.path.dirname(outfile)
+        if not os.path.isdir(outdir):
+            try:
+                os.makedirs(outdir)
+            except OSError:
+                # another worker may have created the directory already
+                if not os.path.isdir(outdir):
+                    raise
+
+        run_parser(data, outfile, argparse.Namespace(switch=switch, cache=cache, format=fmt,
+                                                      append=append, metrics=metrics))
+
+    except Exception:
+        return infile, traceback.format_exc()
+
+    return infile, None
+
+
+def _parse_job(job, cache=None, fmt='json', metrics=False):
+    '''
+    Parse a single log file in one of the worker processes, saving the run
+    metrics as JSON next to the output file if set.
+    '''
+    return parse_file(job, cache, fmt, metrics=[metrics_filename(job[3])] if metrics else None)
+
+
+def run(jobs, workers=None, cache=None, fmt='json', metrics=False):
+    '''
+    Fan the jobs out over a pool of worker processes (one per CPU by default),
+    returning a list of the input files that failed along with their errors.
+    If metrics is set, the metrics for each file are saved as JSON next to the
+    output file (see metrics_filename).
+    '''
+    if not workers:
+        workers = multiprocessing.cpu_count()
+
+    worker = functools.partial(_parse_job, cache=cache, fmt=fmt, metrics=metrics)
+    failed = []
+    if workers == 1:
+        results = map(worker, jobs)
+    else:
+        pool = multiprocessing.Pool(processes=workers)
+        try:
+            # the jobs are handed out one at a time, so the largest files start first
+            results = list(pool.imap_unordered(worker, jobs, chunksize=1))
+        finally:
+            pool.close()
+            pool.join()
+
+    for infile, error in results:
+        if error:
+            failed.append((infile, error))
+
+    return failed
+
+
+def inputs():
+    '''
+    Sets the input arguments for the batch driver: the platform and deployment
+    names, an optional date range (YYYYMMDD, inclusive), the raw and parsed
+    data directories, the number of worker processes, an optional cache
+    directory, the output format, whether to compress the JSON files and
+    whether to save the metrics for each file.
+    Alternatively, a list of log files can be given in place of the platform
+    and deployment names.
+    '''
+    parser = argparse.ArgumentParser(description='''Parse all of the DCL
+                                     formatted log files from a deployment''',
+                                     epilog='''Parses the deployment''')
+
+    parser.add_argument("files", nargs="*")
+    parser.add_argument("-p", "--platform", dest="platform", type=str, default=None)
+    parser.add_argument("-d", "--deployment", dest="deploy", type=str, default=None)
+    parser.add_argument("-b", "--begin", dest="start", type=str, default=None)
+    parser.add_argument("-e", "--end", dest="stop", type=str, default=None)
+    parser.add_argument("-r", "--raw", dest="raw", type=str, default=RAW)
+    parser.add_argument("-o", "--parsed", dest="parsed", type=str, default=PARSED)
+    parser.add_argument("-n", "--workers", dest="workers", type=int, default=None)
+    parser.add_argument("-c", "--cache", dest="cache", type=str, default=None)
+    parser.add_argument("-f", "--format", dest="format", type=str, default="json",
+                        choices=["json", "netcdf"])
+    parser.add_argument("-z", "--gzip", dest="compress", action="store_true")
+    parser.add_argument("-m", "--metrics", dest="metrics", action="store_true")
+
+    args = parser.parse_args()
+    if not args.files and not (args.platform and args.deploy):
+        parser.error('either the platform and deployment or a list of files is required')
+
+    return args
+
+
+if __name__ == '__main__':
+    # load the input arguments
+    args = inputs()
+
+    if args.files:
+        # parse the listed files, detecting the parser to use for each
+        jobs, unknown = list_files(args.files, os.path.abspath(args.parsed), args.format,
+                                   args.compress)
+        for infile in unknown:
+            print("Unable to find a parser for %s" % infile)
+    else:
+        # find the log files, using the same case conventions as the harvesters
+        jobs = find_files(os.path.abspath(args.raw), os.path.abspath(args.parsed),
+                          args.platform.lower(), args.deploy.upper(), args.start,
+                          args.stop, args.format, args.compress)
+
+    failed = run(jobs, args.workers, args.cache, args.format, args.metrics)
+
+    print("Parsed %d of %d files" % (len(jobs) - len(failed), len(jobs)))
+    for infile, error in failed:
+        print("Failed to parse %s\n%s" % (infile, error))
@@ -0,0 +1,464 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@package cgsn_parsers.benchmarks.generators
+@file cgsn_parsers/benchmarks/generators.py
+@author Christopher Wingard
+@brief Generates synthetic raw data files, in the formats logged by the DCLs
+    and CPMs, for benchmarking the parsers.
+'''
+import binascii
+import os
+import random
+import struct
+import time
+
+# Start time (2017-01-01 00:00:00 UTC) used for the synthetic data files
+START = 1483228800
+
+# Names of the synthetic data files (the OPTAA, MOPAK and VEL3D parsers use the
+# date and time in the file name), keyed on the parser used to read them
+FILENAMES = {
+    'adcp': '20170101.adcps.log',
+    'ctdbp': '20170101.ctdbp1.log',
+    'dosta': '20170101.dosta.log',
+    'fdchp': '20170101.fdchp.log',
+    'flort': '20170101.flort.log',
+    'gps': '20170101.gps.log',
+    'hydgn': '20170101.hyd1.log',
+    'metbk': '20170101.metbk.log',
+    'mopak': '20170101_000000.mopak.log',
+    'nutnr': '20170101.nutnr.log',
+    'optaa': '20170101_000000.optaa1.log',
+    'pco2a': '20170101.pco2a.log',
+    'pco2w': '20170101.pco2w.log',
+    'phsen': '20170101.phsen1.log',
+    'presf': '20170101.presf.log',
+    'pwrsys': '20170101.pwrsys.log',
+    'spkir': '20170101.spkir.log',
+    'superv_cpm': '20170101.superv.log',
+    'superv_dcl': '20170101.superv.log',
+    'vel3d': '20170101_000000.vel3d.log',
+    'velpt': '20170101.velpt1.log',
+    'wavss': '20170101.wavss.log',
+    'zplsc': '20170101.zplsc.log'
+}
+
+# Switch values used to parse the synthetic data files
+SWITCHES = {'ctdbp': 2, 'nutnr': 1, 'vel3d': 8}
+
+
+def _dcl(epts):
+    '''
+    Format an epoch time as a DCL timestamp (YYYY/MM/DD HH:MM:SS.sss).
+    '''
+    return '%s.%03d' % (time.strftime('%Y/%m/%d %H:%M:%S', time.gmtime(epts)),
+                        int(round(epts * 1000)) % 1000)
+
+
+def _chatter(epts, name):
+    '''
+    A DCL status line, of the kind mixed in with the instrument data.
+    '''
+    return '%s [%s:DLOGP1]:Instrument Started [Power On]\n' % (_dcl(epts), name)
+
+
+def _ascii(rnd, name, step, record):
+    '''
+    Generate DCL timestamped lines of ASCII data, built by the record function,
+    with a status line in place of every 50th record.
+    '''
+    epts = START
+    count = 0
+    while True:
+        epts += step * rnd.uniform(0.99, 1.01)
+        count += 1
+        if count % 50 == 0:
+            yield _chatter(epts, name)
+        else:
+            yield '%s %s\r\n' % (_dcl(epts), record(rnd, epts))
+
+
+def _floats(rnd, n, low=-100., high=100., fmt='%.4f'):
+    return [fmt % rnd.uniform(low, high) for i in range(n)]
+
+
+def _hex(rnd, n):
+    return ''.join(rnd.choice('0123456789ABCDEF') for i in range(n))
+
+
+def _bytes(rnd, n):
+    return str(bytearray(rnd.getrandbits(8) for i in range(n)))
+
+
+def _ctdbp(rnd, epts):
+    ctd = '%8.4f, %8.5f, %8.3f' % (rnd.uniform(5, 15), rnd.uniform(3, 4), rnd.uniform(0, 100))
+    return ' %s, %8.3f, %s' % (ctd, rnd.uniform(150, 300),
+                               time.strftime('%d %b %Y %H:%M:%S', time.gmtime(epts)))
+
+
+def _dosta(rnd, epts):
+    return '4831\t125\t' + '\t'.join(_floats(rnd, 10, 0, 400, '%.3f'))
+
+
+def _fdchp(rnd, epts):
+    values = _floats(rnd, 66, -10, 10)
+    values[2] = '%06X' % rnd.randint(0, 0xffffff)
+    return 'FLUXDATA ' + ','.join(values)
+
+
+def _flort(rnd, epts):
+    counts = [rnd.randint(0, 4130) for i in range(3)]
+    return '%s\t700\t%d\t695\t%d\t460\t%d\t%d' % (
+        time.strftime('%m/%d/%y\t%H:%M:%S', time.gmtime(epts)),
+        counts[0], counts[1], counts[2], rnd.randint(500, 600))
+
+
+def _gps(rnd, epts):
+    return 'GPS %.5f %.5f %.2f %.2f 1 %d %.1f %.1f %s %s %.4f N %.4f W' % (
+        rnd.uniform(44, 45), rnd.uniform(-125, -124), rnd.uniform(0, 1), rnd.uniform(0, 360),
+        rnd.randint(4, 12), rnd.uniform(0.5, 2), rnd.uniform(0, 20),
+        time.strftime('%d%m%y', time.gmtime(epts)), time.strftime('%H%M%S', time.gmtime(epts)),
+        rnd.uniform(4400, 4460), rnd.uniform(12400, 12460))
+
+
+def _hydgn(rnd, epts):
+    value = rnd.uniform(0, 1)
+    return '*%.2f %.2f %%' % (value, value)
+
+
+def _metbk(rnd, epts):
+    return ' '.join(_floats(rnd, 12, 0, 1000, '%.3f'))
+
+
+def _nutnr(rnd, epts):
+    hours = (epts % 86400) / 3600.
+    values = ['2017001', '%.5f' % hours] + _floats(rnd, 5, 0, 30, '%.2f')
+    values += _floats(rnd, 3, 5, 25, '%.2f') + [str(rnd.randint(0, 99999))]
+    values += _floats(rnd, 8, 0, 30, '%.2f')
+    values += [str(rnd.randint(100, 60000)) for i in range(256)]
+    return 'SATNLF0425,' + ','.join(values)
+
+
+def _pco2a(rnd, epts):
+    return '#%s, M, %d, %d, %.2f, %.2f, %.2f, %.2f, %d, %.1f, %.1f, %s' % (
+        time.strftime('%Y/%m/%d %H:%M:%S', time.gmtime(epts)), rnd.randint(30000, 40000),
+        rnd.randint(30000, 45000), rnd.uniform(350, 450), rnd.uniform(35, 45),
+        rnd.uniform(0, 20), rnd.uniform(5, 25), rnd.randint(990, 1030), rnd.uniform(35, 45),
+        rnd.uniform(35, 45), rnd.choice('AW'))
+
+
+def _presf(rnd, epts):
+    return 'tide: start time = %s, p = %.4f, pt = %.3f, t = %.4f' % (
+        time.strftime('%d %b %Y %H:%M:%S', time.gmtime(epts)), rnd.uniform(14, 100),
+        rnd.uniform(5, 20), rnd.uniform(5, 20))
+
+
+def _pwrsys(rnd, epts):
+    f = lambda: '%.2f' % rnd.uniform(0, 30)
+    b = lambda: str(rnd.randint(0, 1))
+    fields = ['PwrSys psc:', f(), f(), f(), '%04x' % rnd.randint(0, 0xffff),
+              '%08x' % rnd.randint(0, 0xffffffff), '%08x' % rnd.randint(0, 0xffffffff)]
+    for name in ['pv1', 'pv2', 'pv3', 'pv4', 'wt1', 'wt2', 'fc1', 'fc2']:
+        fields += [name, b(), f(), f()]
+    for name in ['bt1', 'bt2', 'bt3', 'bt4']:
+        fields += [name, f(), f(), f()]
+    fields += ['ext', f(), f(), 'int', f(), f(), f(), 'fcl', f()]
+    fields += ['swg', b(), f(), f(), 'cvt', b(), f(), f(), b(), f()]
+    fields += ['%08x' % rnd.randint(0, 0xffffffff), 'No_FC_Data', '%04x' % rnd.randint(0, 0xffff)]
+    return ' '.join(fields)
+
+
+def _superv_cpm(rnd, epts):
+    f = lambda: '%.2f' % rnd.uniform(0, 30)
+    i = lambda: str(rnd.randint(0, 100))
+    fields = ['superv cpm:', f(), f(), f(), f(), '%08x' % rnd.randint(0, 0xffffffff),
+              't', f(), f(), 'h', f(), 'p', f(), 'gf', '%x' % rnd.randint(0, 15), f(), f(), f(), f(),
+              'ld', '%x' % rnd.randint(0, 15), i(), i(), 'hb', '0', i(), i(), 'wake', '%02d' % rnd.randint(0, 99),
+              'ir', '1', f(), f(), '0', 'fwwf', '1', f(), f(), '0', 'gps', '1', 'sbd', '1', '0', 'pps', '1',
+              'dcl', '%02x' % rnd.randint(0, 255), 'wtc', f(), 'wpc', i(), 'esw', '1', 'dsl', '1',
+              '%04x' % rnd.randint(0, 0xffff)]
+    return ' '.join(fields)
+
+
+def _superv_dcl(rnd, epts):
+    f = lambda: '%.2f' % rnd.uniform(0, 30)
+    i = lambda: str(rnd.randint(0, 100))
+    fields = ['superv dcl:', f(), f(), '%08x' % rnd.randint(0, 0xffffffff),
+              't', f(), f(), f(), f(), f(), 'h', f(), 'p', f(),
+              'gf', '%x' % rnd.randint(0, 15), f(), f(), f(), 'ld', '%x' % rnd.randint(0, 15), i(), i()]
+    for port in range(1, 9):
+        fields += ['p%d' % port, '1', f(), f(), str(rnd.randint(0, 4))]
+    fields += ['hb', '0', i(), i(), 'wake', i(), 'wtc', i(), 'wpc', i(),
+               'pwr', '1', '2', '1', f(), f(), f(), f(), f(), f(), '%04x' % rnd.randint(0, 0xffff)]
+    return ' '.join(fields)
+
+
+def _wavss(rnd, epts):
+    return '$TSPWA,%s,%s,05781,buoyID,,,%d,%s*4A' % (
+        time.strftime('%Y%m%d', time.gmtime(epts)), time.strftime('%H%M%S', time.gmtime(epts)),
+        rnd.randint(50, 200), ','.join(_floats(rnd, 13, 0, 20, '%.2f')))
+
+
+def _zplsc(rnd, epts):
+    nbins = [rnd.randint(80, 120) for i in range(4)]
+    values = ['55070', '1', str(rnd.randint(0, 9999)), '4'] + [str(n) for n in nbins]
+    values += [str(rnd.randint(0, 100)) for i in range(4)]
+    values += [time.strftime('%y%m%d%H%M%S', time.gmtime(epts))]
+    values += _floats(rnd, 2, -5, 5, '%.1f') + ['%.1f' % rnd.uniform(10, 15), '%.1f' % rnd.uniform(5, 20),
+                                                '0', '0']
+    for n, freq in zip(nbins, [38, 125, 200, 455]):
+        values += [str(freq)] + [str(rnd.randint(0, 65535)) for i in range(n)] + ['0']
+    return '@D%s!@P,%s!' % (time.strftime('%Y%m%d%H%M%S', time.gmtime(epts)), ','.join(values[:-1]))
+
+
+def _spkir(rnd):
+    '''
+    Generate the SPKIR records, an ASCII header followed by a binary packet.
+    '''
+    epts = START
+    timer = 0.
+    count = 0
+    while True:
+        epts += 1.
+        timer += 1.
+        count += 1
+        if count % 50 == 0:
+            yield _chatter(epts, 'spkir')
+            continue
+
+        # the sample delay is kept small so the packet does not start with a digit
+        packet = struct.pack('<h7I3HBB', rnd.randint(0, 40), *([rnd.randint(0, 2 ** 31) for i in range(7)] +
+                                                                [rnd.randint(0, 65535) for i in range(3)] +
+                                                                [count % 256, 0]))
+        yield '%s SATDI70241%010.2f%s\r\n' % (_dcl(epts), timer, packet)
+
+
+def _sami(rnd, step, record):
+    '''
+    Generate the SAMI (PCO2W and PHSEN) hex records, split over several DCL
+    timestamped lines as they are logged.
+    '''
+    epts = START
+    while True:
+        epts += step
+        for i, line in enumerate(record(rnd)):
+            yield '%s %s\n' % (_dcl(epts + i), line)
+        yield _chatter(epts + 30, 'sami')
+
+
+def _pco2w(rnd):
+    return ['*%s11%s' % (_hex(rnd, 4), _hex(rnd, 60)), '*%s04%s' % (_hex(rnd, 4), _hex(rnd, 74))]
+
+
+def _phsen(rnd):
+    record = '*%s0A%s' % (_hex(rnd, 4), _hex(rnd, 458))
+    return [record[:200], record[200:400], record[400:]]
+
+
+def _adcp(rnd, ncells=30):
+    '''
+    Generate the ASCIIHEX encoded PD0 ensembles (fixed and variable leaders,
+    velocity, correlation, echo intensity and percent good data).
+    '''
+    fixed_format = '<H2BH4B3H4BH4B2h2B2H4BHQH2BIB'
+    variable_format = '<2H10B3H2hHh18BH2I9B'
+    epts = START
+    ensemble = 0
+    while True:
+        epts += 60.
+        ensemble += 1
+        fixed = struct.pack(fixed_format, 0, 50, 40, 0xCA, 0, 7, 4, ncells, 60, 400, 176, 1, 64, 9, 0,
+                            2000, 0, 1, 50, 0x17, 0, 0, 0x7d, 0x3d, 880, 451, 1, 5, 50, 0, 68, 0, 1, 0,
+                            0, 12345, 20)
+        variable = struct.pack(variable_format, 128, ensemble % 65536, 17, 1, 1, 0, 0, 0, 0, 0, 0, 0,
+                               1500, rnd.randint(0, 500), rnd.randint(0, 35999), rnd.randint(-500, 500),
+                               rnd.randint(-500, 500), 35, rnd.randint(0, 3000), 0, 59, 99, 1, 2, 3,
+                               100, 150, 120, 80, 80, 90, 120, 130, 0xff, 0x55, 0xaa, 0x0f, 0, 123456,
+                               100, 0, 20, 17, 1, 1, 0, 0, 0, 0)
+        velocity = struct.pack('<H', 0x0100) + struct.pack('<%dh' % (4 * ncells),
+                                                           *[rnd.randint(-2000, 2000) for i in range(4 * ncells)])
+        blocks = [fixed, variable, velocity]
+        for data_id in (0x0200, 0x0300, 0x0400):
+            blocks.append(struct.pack('<H', data_id) + _bytes(rnd, 4 * ncells))
+
+        # build the header, with the offsets to each of the data types
+        size = 6 + 2 * len(blocks)
+        offsets = []
+        for block in blocks:
+            offsets.append(size)
+            size += len(block)
+
+        header = struct.pack('<2BH2B', 0x7f, 0x7f, size, 0, len(blocks))
+        header += struct.pack('<%dH' % len(blocks), *offsets)
+        data = header + ''.join(blocks)
+        data += struct.pack('<H', sum(bytearray(data)) & 0xffff)
+        yield '%s %s\r\n' % (_dcl(epts), binascii.hexlify(data).upper())
+        if ensemble % 50 == 0:
+            yield _chatter(epts + 1, 'adcps')
+
+
+def _optaa(rnd, nwave=83):
+    '''
+    Generate the OPTAA (WET Labs AC-S) binary packets, following the ASCII
+    header the instrument prints when it starts.
+    '''
+    yield 'P3 2.11\r\nACS Meter\r\nStarting data collection\r\n'
+    length = 32 + 8 * nwave
+    elapsed = 1000
+    while True:
+        elapsed += 250
+        header = struct.pack('>4sH3B3s7HIBB', '\xff\x00\xff\x00', length, 5, 0, 1, '\x00\x00\x8a',
+                             *([rnd.randint(0, 65535) for i in range(7)] + [elapsed, 1, nwave]))
+        data = header + struct.pack('>%dH' % (4 * nwave), *[rnd.randint(0, 65535) for i in range(4 * nwave)])
+        yield data + struct.pack('>H', sum(bytearray(data)) & 0xffff) + '\x00'
+
+
+def _mopak(rnd):
+    '''
+    Generate the MOPAK (3DM-GX3-25) 0xCB binary packets.
+    '''
+    timer = 0
+    while True:
+        timer += 6250
+        data = struct.pack('>B9fI', 0xCB, *([rnd.uniform(-5, 5) for i in range(9)] + [timer]))
+        yield data + struct.pack('>H', sum(bytearray(data)) & 0xffff)
+
+
+def _bcd(value):
+    return ((value // 10) << 4) | (value % 10)
+
+
+def _nortek(data):
+    '''
+    Add the Nortek checksum to a packet.
+    '''
+    check = 46476 + sum(struct.unpack('<%dH' % (len(data) // 2), data))
+    return data + struct.pack('<H', check % 65536)
+
+
+def _nortek_time(epts):
+    t = time.gmtime(epts)
+    return [_bcd(t.tm_min), _bcd(t.tm_sec), _bcd(t.tm_mday), _bcd(t.tm_hour),
+            _bcd(t.tm_year % 100), _bcd(t.tm_mon)]
+
+
+def _vel3d(rnd, rate=8):
+    '''
+    Generate the VEL3D (Nortek Vector) header, system (once a second) and
+    velocity packets.
+    '''
+    epts = START
+    yield _nortek(struct.pack('<2BH6BH4B4B20s', 0xa5, 0x12, 21, *(_nortek_time(epts) +
+                              [600, 1, 2, 3, 0, 4, 5, 6, 0, '\x00' * 20])))
+    count = 0
+    while True:
+        epts += 1
+        yield _nortek(struct.pack('<2BH6B2H4h2bH', 0xa5, 0x11, 14, *(_nortek_time(epts) +
+                                  [rnd.randint(100, 200), rnd.randint(14000, 15000),
+                                   rnd.randint(0, 3600), rnd.randint(-900, 900),
+                                   rnd.randint(-900, 900), rnd.randint(-500, 3000), 0, 1, 0])))
+        for i in range(rate):
+            count += 1
+            yield _nortek(struct.pack('<6B2H3h6B', 0xa5, 0x10, 0, count % 256, 3, 0,
+                                      rnd.randint(0, 65535), 0,
+                                      *([rnd.randint(-3000, 3000) for j in range(3)] +
+                                        [rnd.randint(0, 255) for j in range(6)])))
+
+
+def _velpt(rnd):
+    '''
+    Generate the VELPT (Nortek Aquadopp) velocity packets, with a diagnostics
+    header and set of diagnostics packets every 60 records.
+    '''
+    def packet(sync, epts):
+        return _nortek(struct.pack('<2BH6B2h2H3hBbHh3h3Bb', 0xa5, sync, 21, *(_nortek_time(epts) +
+                                   [0, 0, rnd.randint(100, 200), rnd.randint(14000, 15000),
+                                    rnd.randint(0, 3600), rnd.randint(-900, 900),
+                                    rnd.randint(-900, 900), 1, -12, rnd.randint(0, 65535),
+                                    rnd.randint(-500, 3000)] +
+                                   [rnd.randint(-3000, 3000) for i in range(3)] + [10, 20, 30, 0])))
+
+    epts = START
+    count = 0
+    while True:
+        epts += 60
+        count += 1
+        yield packet(0x01, epts)
+        if count % 60 == 0:
+            yield _nortek(struct.pack('<2B3H4B4H4H6b', 0xa5, 0x06, 18, 4, 1,
+                                      *([1, 2, 3, 4] + [5, 6, 7, 8] + [9, 10, 11, 12] + [0] * 6)))
+            for i in range(4):
+                yield packet(0x80, epts + i)
+
+
+def records(name, seed=0, **options):
+    '''
+    Return an iterator over the synthetic records (as strings) for a parser,
+    reproducible for a given seed. Any options are passed on to the functions
+    generating the binary formats (e.g. rate for the VEL3D sampling rate, or
+    ncells for the number of ADCP depth cells).
+    '''
+    rnd = random.Random(seed)
+    if name in ASCII:
+        step, record = ASCII[name]
+        return _ascii(rnd, name, step, record)
+    if name == 'pco2w':
+        return _sami(rnd, 3600, _pco2w)
+    if name == 'phsen':
+        return _sami(rnd, 900, _phsen)
+    return BINARY[name](rnd, **options)
+
+
+# DCL timestamped ASCII formats, with the sample interval (seconds) and the
+# function used to build the records
+ASCII = {
+    'ctdbp': (10, _ctdbp),
+    'dosta': (60, _dosta),
+    'fdchp': (1200, _fdchp),
+    'flort': (60, _flort),
+    'gps': (60, _gps),
+    'hydgn': (60, _hydgn),
+    'metbk': (60, _metbk),
+    'nutnr': (1, _nutnr),
+    'pco2a': (60, _pco2a),
+    'presf': (900, _presf),
+    'pwrsys': (60, _pwrsys),
+    'superv_cpm': (60, _superv_cpm),
+    'superv_dcl': (60, _superv_dcl),
+    'wavss': (3600, _wavss),
+    'zplsc': (900, _zplsc)
+}
+
+# Binary (or mixed) formats
+BINARY = {
+    'adcp': _adcp,
+    'mopak': _mopak,
+    'optaa': _optaa,
+    'spkir': _spkir,
+    'vel3d': _vel3d,
+    'velpt': _velpt
+}
+
+
+def generate(name, outdir, size=10 * 1024 ** 2, seed=0):
+    '''
+    Write a synthetic raw data file of about the given size (in bytes) for a
+    parser to the output directory, returning the file name. The files are
+    reproducible for a given seed.
+    '''
+    filename = os.path.join(outdir, FILENAMES[name])
+    if name == 'superv_dcl':
+        filename = os.path.join(outdir, 'dcl11', FILENAMES[name])
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+
+    total = 0
+    with open(filename, 'wb') as f:
+        for record in records(name, seed):
+            f.write(record)
+            total += len(record)
+            if total >= size:
+                break
+
+    return filename
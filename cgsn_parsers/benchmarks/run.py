@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@package cgsn_parsers.benchmarks.run
+@file cgsn_parsers/benchmarks/run.py
+@author Christopher Wingard
+@brief Times the parsers and processors against synthetic raw data files,
+    reporting the throughput (records/s and MB/s) and peak memory use, and
+    saving the results as JSON for comparisons between commits.
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from cgsn_parsers.benchmarks.generators import FILENAMES, SWITCHES, generate
+from cgsn_parsers.parsers.common import write_data
+from cgsn_parsers.parsers.registry import create_parser
+
+# Processors timed, along with the parser providing their input data
+PROCESSORS = {
+    'proc_optaa.apply_dev': 'optaa',
+    'proc_optaa.apply_tscorr': 'optaa',
+    'proc_optaa.apply_scatcorr': 'optaa',
+    'proc_pco2w': 'pco2w',
+    'proc_phsen': 'phsen'
+}
+
+
+def _peak_rss():
+    '''
+    Return the peak resident set size of the current process in MB.
+    '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / 1024. ** 2    # reported in bytes on OS X ...
+    return peak / 1024.             # ... and KB on Linux
+
+
+def _quiet():
+    '''
+    Discard the messages the parsers print for bad packets, so they neither
+    clutter the report nor add to the timing.
+    '''
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+    sys.stdout = open(os.devnull, 'w')
+
+
+def _records(data):
+    '''
+    Return the largest number of records held in any column of the parsed data.
+    '''
+    rows = 0
+    for value in data.values():
+        if isinstance(value, dict):
+            rows = max(rows, _records(value))
+        else:
+            rows = max(rows, len(value))
+
+    return rows
+
+
+def _time_parser(name, infile):
+    '''
+    Load and parse a file, returning the time taken for each step, the number
+    of records and the peak memory used.
+    '''
+    _quiet()
+    base = _peak_rss()
+    start = time.time()
+    parser = create_parser(infile, name, SWITCHES.get(name))
+    parser.load_mmap()
+    loaded = time.time()
+    parser.parse_data()
+    parsed = time.time()
+
+    return {
+        'load': loaded - start,
+        'parse': parsed - loaded,
+        'records': _records(parser.data),
+        'base_rss': base,
+        'peak_rss': _peak_rss()
+    }
+
+
+def _optaa_coeffs(nwave, nbins=35):
+    '''
+    Create a synthetic set of AC-S calibration coefficients.
+    '''
+    return {
+        'pressure_coeff': np.zeros(2),
+        'a_offsets': np.linspace(0.5, 1.5, nwave),
+        'c_offsets': np.linspace(0.5, 1.5, nwave),
+        'a_wavelengths': np.linspace(400., 750., nwave),
+        'c_wavelengths': np.linspace(401., 751., nwave),
+        'temp_bins': np.linspace(0., 35., nbins),
+        'ta_array': np.random.RandomState(0).uniform(-0.01, 0.01, (nwave, nbins)),
+        'tc_array': np.random.RandomState(1).uniform(-0.01, 0.01, (nwave, nbins)),
+        'temp_calibration': 20.0
+    }
+
+
+def _time_processor(name, infile, workdir):
+    '''
+    Run a processor on the parsed synthetic data, returning the time taken, the
+    number of records and the peak memory used. The time spent parsing the raw
+    data file beforehand is not included.
+    '''
+    import importlib
+    _quiet()
+
+    module, function = (name.split('.') + [None])[:2]
+    module = importlib.import_module('cgsn_parsers.process.' + module)
+    parser = create_parser(infile, PROCESSORS[name])
+    parser.load_mmap()
+    parser.parse_data()
+    records = _records(parser.data)
+
+    base = _peak_rss()
+    if function:
+        # the OPTAA processing steps, each run after the steps before it
+        data = parser.data
+        coeffs = _optaa_coeffs(len(data.a_reference_raw[0]))
+        steps = ['apply_dev', 'apply_tscorr', 'apply_scatcorr']
+        for step in steps[:steps.index(function)]:
+            data = getattr(module, step)(data, coeffs)
+
+        start = time.time()
+        if function == 'apply_scatcorr':
+            module.apply_scatcorr(data)
+        else:
+            getattr(module, function)(data, coeffs)
+        elapsed = time.time() - start
+    else:
+        # the PCO2W and PHSEN processors are scripts, reading and writing JSON files
+        jsonfile = os.path.join(workdir, os.path.basename(infile)[:-4] + '.json')
+        write_data(parser, jsonfile)
+        argv = ['-i', jsonfile, '-o', jsonfile[:-5] + '.proc.json']
+        if name == 'proc_pco2w':
+            coeffs = module.Calibrations(os.path.join(workdir, 'pco2w.coeffs'))
+            coeffs.coeffs = {'calt': 0.0115, 'cala': 0.0459, 'calb': 0.6257, 'calc': -1.5406}
+            coeffs.save_coeffs()
+            argv += ['-c', coeffs.coeff_file, '-d', os.path.join(workdir, 'pco2w.blanks')]
+
+        sys.argv = [name] + argv
+        start = time.time()
+        module.main()
+        elapsed = time.time() - start
+
+    return {
+        'process': elapsed,
+        'records': records,
+        'base_rss': base,
+        'peak_rss': _peak_rss()
+    }
+
+
+def _call(function, *args):
+    '''
+    Run a function in a new process (so the memory use of one benchmark does
+    not carry over to the next), returning its results or the error raised.
+    '''
+    pool = multiprocessing.Pool(processes=1, maxtasksperchild=1)
+    try:
+        return pool.apply(function, args)
+    except ImportError as e:
+        return {'skipped': str(e)}
+    except Exception as e:
+        return {'error': '%s: %s' % (e.__class__.__name__, e)}
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _best(runs, key):
+    '''
+    Combine repeated runs, keeping the fastest time and the largest peak memory.
+    '''
+    for run in runs:
+        if key not in run:
+            return run
+
+    result = min(runs, key=lambda run: run[key])
+    result['peak_rss'] = max(run['peak_rss'] for run in runs)
+    return result
+
+
+def _commit():
+    '''
+    Return the git commit of the working tree, if available.
+    '''
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(names=None, size=10 * 1024 ** 2, repeat=3, workdir=None):
+    '''
+    Generate the synthetic data files and time the parsers and processors (all
+    of them, or those named), returning a dictionary of the results. Each run
+    is in a new process, with the fastest of the repeated runs reported.
+    '''
+    names = names or sorted(FILENAMES.keys()) + sorted(PROCESSORS.keys())
+    tmpdir = tempfile.mkdtemp(dir=workdir)
+    results = {}
+    files = {}
+    try:
+        for name in names:
+            source = PROCESSORS.get(name, name)
+            if source not in files:
+                files[source] = generate(source, tmpdir, size)
+
+            infile = files[source]
+            nbytes = os.path.getsize(infile)
+            if name in PROCESSORS:
+                result = _best([_call(_time_processor, name, infile, tmpdir) for i in range(repeat)], 'process')
+                elapsed = result.get('process')
+            else:
+                result = _best([_call(_time_parser, name, infile) for i in range(repeat)], 'parse')
+                elapsed = result.get('parse')
+
+            if elapsed is not None:
+                result['bytes'] = nbytes
+                result['records_per_second'] = result['records'] / max(elapsed, 1e-9)
+                result['mb_per_second'] = nbytes / 1024. ** 2 / max(elapsed, 1e-9)
+
+            results[name] = result
+    finally:
+        shutil.rmtree(tmpdir)
+
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'size': size,
+        'repeat': repeat,
+        'results': results
+    }
+
+
+def report(results, baseline=None):
+    '''
+    Print a table of the results, along with the speedup relative to a set of
+    baseline results if given.
+    '''
+    if baseline and baseline['size'] != results['size']:
+        print("Note, the baseline used %.1f MB files (vs %.1f MB)" % (baseline['size'] / 1024. ** 2,
+                                                                   results['size'] / 1024. ** 2))
+
+    print("%-26s %10s %12s %9s %9s %8s" % ('name', 'records', 'records/s', 'MB/s', 'RSS MB', 'speedup'))
+    for name in sorted(results['results'].keys()):
+        result = results['results'][name]
+        if 'records_per_second' not in result:
+            print("%-26s %s" % (name, result.get('skipped') or result.get('error')))
+            continue
+
+        speedup = ''
+        if baseline and 'records_per_second' in baseline['results'].get(name, {}):
+            old = baseline['results'][name]['records_per_second']
+            speedup = '%.2fx' % (result['records_per_second'] / max(old, 1e-9))
+
+        print("%-26s %10d %12.0f %9.2f %9.1f %8s" % (name, result['records'], result['records_per_second'],
+                                                     result['mb_per_second'], result['peak_rss'], speedup))
+
+
+def inputs():
+    '''
+    Sets the input arguments for the benchmarks: the parsers and processors to
+    time (all by default), the size of the synthetic data files (in MB), the
+    number of repeated runs, the JSON file to save the results to and a JSON
+    file of earlier results to compare against.
+    '''
+    parser = argparse.ArgumentParser(description='''Benchmark the parsers and
+                                     processors using synthetic data files''',
+                                     epilog='''Times the parsers''')
+
+    parser.add_argument("names", nargs="*")
+    parser.add_argument("-s", "--size", dest="size", type=float, default=10.0)
+    parser.add_argument("-r", "--repeat", dest="repeat", type=int, default=3)
+    parser.add_argument("-o", "--outfile", dest="outfile", type=str, default=None)
+    parser.add_argument("-c", "--compare", dest="compare", type=str, default=None)
+    parser.add_argument("-w", "--workdir", dest="workdir", type=str, default=None)
+
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in FILENAMES and name not in PROCESSORS:
+            parser.error('unknown parser or processor %s' % name)
+
+    return args
+
+
+if __name__ == '__main__':
+    # load the input arguments
+    args = inputs()
+
+    # run the benchmarks, saving and reporting the results
+    results = run_benchmarks(args.names, int(args.size * 1024 ** 2), args.repeat, args.workdir)
+    if args.outfile:
+        with open(args.outfile, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+
+    report(results, baseline)
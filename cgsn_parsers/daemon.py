@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@package cgsn_parsers.daemon
+@file cgsn_parsers/daemon.py
+@author Christopher Wingard
+@brief Long-lived parser service, accepting jobs over a Unix domain socket so
+    the harvester scripts avoid the cost of starting python and importing
+    NumPy and the parsers for every file. Also provides the thin client used
+    to submit the jobs.
+'''
+import argparse
+import errno
+import json
+import os
+import socket
+import sys
+import time
+
+# Default path of the Unix domain socket the daemon listens on
+SOCKET = '/tmp/cgsn_parsers.sock'
+
+# Packages with the modules loaded when the daemon starts
+PACKAGES = ['cgsn_parsers.parsers', 'cgsn_parsers.process']
+
+
+def submit(request, path=SOCKET, timeout=None):
+    '''
+    Send a job to the daemon and wait for the result. The request is a
+    dictionary with the input and output file names and optionally the parser
+    name (detected from the file if not set) and the switch, append, cache,
+    format and metrics settings used by the individual parsers. Returns a dictionary with
+    the status ('ok' or 'error'), any error message and the time (in seconds)
+    spent parsing the file and in total.
+    '''
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.settimeout(timeout)
+        client.connect(path)
+        client.sendall(json.dumps(request) + '\n')
+        response = client.makefile('r').readline()
+    finally:
+        client.close()
+
+    if not response:
+        raise IOError('No response from the parser daemon at %s' % path)
+
+    return json.loads(response)
+
+
+def preload():
+    '''
+    Import all of the modules in the parsers and process packages, so they are
+    shared by the worker processes rather than imported for every job. Returns
+    a list of the modules that could not be imported (e.g. processing modules
+    with optional dependencies that are not installed) and the reasons why.
+    '''
+    import importlib
+    import pkgutil
+
+    failed = []
+    for name in PACKAGES:
+        package = importlib.import_module(name)
+        for loader, module, ispkg in pkgutil.iter_modules(package.__path__):
+            try:
+                importlib.import_module('%s.%s' % (name, module))
+            except Exception as e:
+                failed.append(('%s.%s' % (name, module), str(e)))
+
+    return failed
+
+
+def _run_job(request):
+    '''
+    Parse a single file in one of the worker processes, returning the status
+    of the job and the time taken.
+    '''
+    from cgsn_parsers.batch import parse_file
+    from cgsn_parsers.parsers.registry import SWITCHES, detect, sniff_switch
+
+    start = time.time()
+    parser, switch = request.get('parser'), request.get('switch')
+    if parser is None:
+        # use the registry to select the parser (and switch) for the file
+        try:
+            parser, detected = detect(request['infile'])
+        except ValueError as e:
+            return {'status': 'error', 'error': str(e), 'elapsed': time.time() - start}
+        if switch is None:
+            switch = detected
+    elif switch is None:
+        # detect the switch for the named parser, falling back to the value used
+        # by the harvester scripts (e.g. for an empty or partial file)
+        try:
+            switch = sniff_switch(parser, request['infile'])
+        except IOError:
+            switch = None   # reported when the file is parsed
+        if switch is None:
+            switch = SWITCHES.get(parser)
+
+    job = (0, parser, request['infile'], request['outfile'], switch)
+    infile, error = parse_file(job, request.get('cache'), request.get('format', 'json'),
+                               request.get('append', False), request.get('metrics'))
+
+    return {
+        'status': 'error' if error else 'ok',
+        'error': error,
+        'elapsed': time.time() - start
+    }
+
+
+def _check(request):
+    '''
+    Confirm a job request has the required fields and names a known parser.
+    '''
+    from cgsn_parsers.batch import PARSERS
+
+    if not isinstance(request, dict):
+        raise ValueError('The job request must be a JSON object')
+
+    for field in ['infile', 'outfile']:
+        if field not in request:
+            raise ValueError('The job request is missing the %s field' % field)
+
+    if request.get('parser') is not None and request['parser'] not in PARSERS:
+        raise ValueError('Unknown parser %s' % request['parser'])
+
+    if request.get('format', 'json') not in ['json', 'netcdf']:
+        raise ValueError('Unknown output format %s' % request['format'])
+
+
+def _remove_stale(path):
+    '''
+    Remove a socket left behind by an earlier run of the daemon, raising an
+    IOError if another daemon is still listening on it.
+    '''
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except socket.error as e:
+        if e.errno == errno.ENOENT:
+            return
+        if e.errno != errno.ECONNREFUSED:
+            raise
+        os.remove(path)
+    else:
+        raise IOError('A parser daemon is already listening on %s' % path)
+    finally:
+        probe.close()
+
+
+def make_server(path=SOCKET, workers=None):
+    '''
+    Load the parsers, start the pool of worker processes (one per CPU by
+    default) and bind the server to the Unix domain socket, replacing any
+    socket left behind by an earlier run (but not one another daemon is still
+    listening on). Each connection is handled in a
+    separate thread, with the jobs sent on to the worker pool. Returns the
+    server and the list of modules that failed to load.
+    '''
+    import multiprocessing
+    import SocketServer
+
+    # load the modules before the pool is started, so the workers inherit them
+    failed = preload()
+
+    class Handler(SocketServer.StreamRequestHandler):
+        '''
+        Read job requests, one JSON object per line, and write the result of
+        each job back to the client as a single line of JSON.
+        '''
+        def handle(self):
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    break
+
+                start = time.time()
+                try:
+                    request = json.loads(line)
+                    _check(request)
+                    response = self.server.pool.apply(_run_job, (request,))
+                except Exception as e:
+                    response = {'status': 'error', 'error': str(e), 'elapsed': 0.0}
+
+                response['total'] = time.time() - start
+                self.wfile.write(json.dumps(response) + '\n')
+                self.wfile.flush()
+
+    class Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+        daemon_threads = True
+
+        def server_bind(self):
+            SocketServer.UnixStreamServer.server_bind(self)
+            self.inode = os.stat(self.server_address).st_ino
+
+        def server_close(self):
+            SocketServer.UnixStreamServer.server_close(self)
+            self.pool.terminate()
+            self.pool.join()
+            # only remove the socket if it has not since been replaced by
+            # another daemon
+            try:
+                if os.stat(self.server_address).st_ino == self.inode:
+                    os.remove(self.server_address)
+            except OSError:
+                pass
+
+    _remove_stale(path)
+
+    pool = multiprocessing.Pool(processes=workers or multiprocessing.cpu_count())
+    try:
+        server = Server(path, Handler)
+    except Exception:
+        pool.terminate()
+        raise
+
+    server.pool = pool
+    return server, failed
+
+
+def serve(path=SOCKET, workers=None):
+    '''
+    Run the daemon until it is interrupted or sent a SIGTERM.
+    '''
+    import signal
+
+    server, failed = make_server(path, workers)
+    for module, error in failed:
+        print("Unable to load %s: %s" % (module, error))
+
+    # exit cleanly (closing the pool and removing the socket) on a SIGTERM
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def inputs():
+    '''
+    Sets the input arguments for the daemon (serve) and the client (submit).
+    The client takes the same arguments as the individual parsers, plus the
+    name of the parser to use (detected from the file if not set).
+    '''
+    parser = argparse.ArgumentParser(description='''Parse the DCL formatted log
+                                     files via a long-lived parser service''',
+                                     epilog='''Parses the files''')
+    parser.add_argument("-S", "--socket", dest="socket", type=str, default=SOCKET)
+    commands = parser.add_subparsers(dest="command")
+
+    server = commands.add_parser("serve")
+    server.add_argument("-n", "--workers", dest="workers", type=int, default=None)
+
+    client = commands.add_parser("submit")
+    client.add_argument("-p", "--parser", dest="parser", type=str, default=None)
+    client.add_argument("-i", "--infile", dest="infile", type=str, required=True)
+    client.add_argument("-o", "--outfile", dest="outfile", type=str, required=True)
+    client.add_argument("-s", "--switch", dest="switch", type=int, default=None)
+    client.add_argument("-a", "--append", dest="append", action="store_true")
+    client.add_argument("-c", "--cache", dest="cache", type=str, default=None)
+    client.add_argument("-f", "--format", dest="format", type=str, default="json",
+                        choices=["json", "netcdf"])
+    client.add_argument("-m", "--metrics", dest="metrics", type=str, action="append", default=None)
+
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == '__main__':
+    # load the input arguments
+    args = inputs()
+
+    if args.command == 'serve':
+        serve(args.socket, args.workers)
+    else:
+        # submit the job, using absolute paths as the daemon has its own working directory
+        request = {
+            'parser': args.parser,
+            'infile': os.path.abspath(args.infile),
+            'outfile': os.path.abspath(args.outfile),
+            'switch': args.switch,
+            'append': args.append,
+            'cache': os.path.abspath(args.cache) if args.cache else None,
+            'format': args.format,
+            'metrics': [os.path.abspath(m) for m in args.metrics] if args.metrics else None
+        }
+        result = submit(request, args.socket)
+        if result['status'] != 'ok':
+            sys.stderr.write("Failed to parse %s\n%s\n" % (request['infile'], result['error']))
+            sys.exit(1)
@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+from cgsn_parsers.parsers.registry import create_parser, detect, get_parser
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@package cgsn_parsers.parsers.cache
+@file cgsn_parsers/parsers/cache.py
+@author Christopher Wingard
+@brief Content addressed cache of the parsed data files, used to skip parsing
+    raw data files that have not changed since they were last parsed.
+'''
+import glob
+import hashlib
+import os
+import shutil
+import sys
+
+# Default upper limit on the size of the cache directory (in bytes), with the
+# least recently used entries removed once it is exceeded
+CACHE_SIZE = 10 * 1024 ** 3
+
+# Size of the blocks read when hashing the raw data files
+HASH_BLOCK = 1024 * 1024
+
+# Cache of the hashes of the parser source code, keyed on the package directory
+_VERSIONS = {}
+
+
+def _source_hash(package):
+    '''
+    Return the SHA1 hash of the python source files (using the .py files rather
+    than any compiled versions of them) in a package directory.
+    '''
+    if package not in _VERSIONS:
+        sha1 = hashlib.sha1()
+        for filename in sorted(glob.glob(os.path.join(package, '*.py'))):
+            with open(filename, 'rb') as f:
+                sha1.update(os.path.basename(filename) + '\0' + f.read())
+        _VERSIONS[package] = sha1.hexdigest()
+
+    return _VERSIONS[package]
+
+
+def _write(filename, text):
+    '''
+    Write to a temporary file and rename it, so other processes sharing the
+    cache never see a partially written file.
+    '''
+    tmpfile = '%s.%d.tmp' % (filename, os.getpid())
+    with open(tmpfile, 'w') as f:
+        f.write(text)
+    os.rename(tmpfile, filename)
+
+
+class ParseCache(object):
+    '''
+    A directory of parsed data files, keyed on the contents of the raw data
+    file, the parser (name and version), the switch value used to parse it and
+    the output format. The parser version is a hash of the source code of all
+    of the modules in the parsers package (the parsers and the common, checksum,
+    NetCDF and other modules they use), so any change to them invalidates the
+    cached results.
+
+    Hashing the raw data file is skipped if its size and modification time
+    match those recorded when it was last hashed.
+    '''
+    def __init__(self, path, max_size=CACHE_SIZE):
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        for name in ['data', 'stat']:
+            try:
+                os.makedirs(os.path.join(self.path, name))
+            except OSError:
+                if not os.path.isdir(os.path.join(self.path, name)):
+                    raise
+
+    def hash_file(self, infile):
+        '''
+        Return the SHA1 hash of the raw data file contents, reusing the hash
+        recorded for the file if its size and modification time are unchanged.
+        '''
+        infile = os.path.abspath(infile)
+        info = os.stat(infile)
+        stamp = '%d %r' % (info.st_size, info.st_mtime)
+        statfile = os.path.join(self.path, 'stat', hashlib.sha1(infile).hexdigest())
+        if os.path.exists(statfile):
+            with open(statfile, 'r') as f:
+                saved, digest = f.read().rsplit(' ', 1)
+            if saved == stamp:
+                return digest
+
+        sha1 = hashlib.sha1()
+        with open(infile, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK), b''):
+                sha1.update(block)
+
+        digest = sha1.hexdigest()
+        _write(statfile, '%s %s' % (stamp, digest))
+        return digest
+
+    def key(self, parser, switch=0, fmt='json'):
+        '''
+        Return the cache key for the raw data file to be parsed by the Parser
+        object, using the given switch value and output format.
+        '''
+        module = sys.modules[parser.__class__.__module__].__file__
+        name = os.path.splitext(os.path.basename(module))[0]
+        version = _source_hash(os.path.dirname(os.path.abspath(__file__)))
+
+        key = '\0'.join([name, version, str(switch), fmt, self.hash_file(parser.infile)])
+        return hashlib.sha1(key).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.path, 'data', key)
+
+    def fetch(self, key, outfile):
+        '''
+        Copy the cached output for the key to the output file, returning True
+        if it was found.
+        '''
+        entry = self._entry(key)
+        try:
+            shutil.copyfile(entry, outfile)
+            os.utime(entry, None)   # mark the entry as recently used
+        except (IOError, OSError):
+            return False
+
+        return True
+
+    def store(self, key, outfile):
+        '''
+        Add a copy of the output file to the cache under the key, then remove
+        the least recently used entries if the cache has grown too large.
+        '''
+        entry = self._entry(key)
+        tmpfile = '%s.%d.tmp' % (entry, os.getpid())
+        shutil.copyfile(outfile, tmpfile)
+        os.rename(tmpfile, entry)
+        self.evict()
+
+    def evict(self):
+        '''
+        Remove the least recently used entries until the total size of the
+        cached files is under the limit.
+        '''
+        entries = []
+        total = 0
+        datadir = os.path.join(self.path, 'data')
+        for name in os.listdir(datadir):
+            if name.endswith('.tmp'):
+                continue
+            try:
+                info = os.stat(os.path.join(datadir, name))
+            except OSError:
+                continue    # removed by another process
+            entries.append((info.st_mtime, info.st_size, name))
+            total += info.st_size
+
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(datadir, name))
+            except OSError:
+                pass
+            total -= size
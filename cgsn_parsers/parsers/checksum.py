@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@package cgsn_parsers.parsers.checksum
+@file cgsn_parsers/parsers/checksum.py
+@author Christopher Wingard
+@brief Checksums for the binary (and ASCIIHEX) instrument data packets,
+    validating all of the packets found in a data file at once.
+
+The instruments use one of two checksums, both reduced to 16 bits: the sum of
+the bytes in the packet (Teledyne RDI PD0, WET Labs AC-S and Microstrain
+3DM-GX3), or the sum of the little-endian 16-bit words in the packet added to
+a base value (Nortek Vector and Aquadopp). In both cases the checksum is
+stored as an unsigned short directly after the bytes summed.
+
+Rather than summing each packet in turn, the functions below work from the
+cumulative sums of the bytes in the whole buffer, so the sum for any packet
+is the difference of two values. The cumulative sums are kept as unsigned 16
+bit integers, letting them wrap around, as only the sums modulo 65536 are
+needed. The packets that pass can then be copied out of the buffer in one
+step with gather_packets.
+'''
+import numpy as np
+
+from numpy.lib.stride_tricks import as_strided
+
+# Base value of the Nortek checksums (0xb58c), given in the Nortek System
+# Integrator Manual
+NORTEK_BASE = 46476
+
+
+def as_bytes(raw):
+    '''
+    Return a raw data buffer (a string or memory mapped file) as an array of
+    unsigned bytes, without copying the data.
+    '''
+    if isinstance(raw, np.ndarray):
+        return raw.reshape(-1).view(np.uint8)
+    if not len(raw):
+        return np.zeros(0, dtype=np.uint8)
+    return np.frombuffer(raw, dtype=np.uint8)
+
+
+def _cumsum(buf):
+    '''
+    Cumulative sums (modulo 65536) of the bytes in buf, with a leading zero so
+    the sum of buf[a:b] is csum[b] - csum[a].
+    '''
+    csum = np.zeros(len(buf) + 1, dtype=np.uint16)
+    np.cumsum(buf, dtype=np.uint16, out=csum[1:])
+    return csum
+
+
+def _packets(buf, starts, length, extra=2):
+    '''
+    Return the starts and lengths of the packets as arrays, along with a mask
+    of the packets that fit in the buffer (including the extra bytes of the
+    checksum following them). The starts of the packets that do not fit are
+    set to zero, so they can be used without indexing past the end of the
+    buffer.
+    '''
+    starts = np.asarray(starts, dtype=np.int64).reshape(-1)
+    length = np.broadcast_to(np.asarray(length, dtype=np.int64), starts.shape)
+    inside = (starts >= 0) & (length >= 0) & (starts + length + extra <= len(buf))
+    return np.where(inside, starts, 0), np.where(inside, length, 0), inside
+
+
+def gather_packets(raw, starts, length):
+    '''
+    Return a copy of the fixed length packets at the starting offsets in the
+    buffer as a 2D array of bytes, one row per packet. The rows are taken from
+    a strided view of the buffer (each row starting one byte after the last),
+    rather than by indexing every byte, so no index array the size of the
+    packets is created.
+    '''
+    buf = as_bytes(raw)
+    starts = np.asarray(starts, dtype=np.int64).reshape(-1)
+    if not len(starts):
+        return np.zeros((0, length), dtype=np.uint8)
+    if starts.min() < 0 or starts.max() + length > len(buf):
+        raise ValueError('Packets must start and end within the buffer')
+
+    rows = as_strided(buf, shape=(len(buf) - length + 1, length), strides=(buf.strides[0], buf.strides[0]))
+    return rows[starts]
+
+
+def stored_checksums(raw, offsets, byteorder='<'):
+    '''
+    Return the unsigned shorts at the offsets in the buffer, in the given byte
+    order ('<' little-endian, '>' big-endian).
+    '''
+    buf = as_bytes(raw)
+    offsets = np.asarray(offsets, dtype=np.int64).reshape(-1)
+    first = buf[offsets].astype(np.uint16)
+    second = buf[offsets + 1].astype(np.uint16)
+    if byteorder == '>':
+        return (first << 8) | second
+    return first | (second << 8)
+
+
+def byte_sums(raw, starts, length):
+    '''
+    Return the sums (modulo 65536) of the bytes in each of the packets, given
+    their starting offsets in the buffer and their length (a single value for
+    fixed length packets, or one per packet).
+    '''
+    buf = as_bytes(raw)
+    starts, length, inside = _packets(buf, starts, length, extra=0)
+    csum = _cumsum(buf)
+    return csum[starts + length] - csum[starts]
+
+
+def word_sums(raw, starts, length, base=0):
+    '''
+    Return the sums (modulo 65536) of the little-endian unsigned shorts in each
+    of the packets, plus the base value, given their starting offsets in the
+    buffer and their length in bytes (a single value or one per packet).
+
+    The low bytes of the words in a packet are the bytes with the same parity
+    (odd or even offset) as the start of the packet, and the high bytes those
+    with the other parity. Summing the even and odd bytes of the buffer
+    separately gives both for any packet, wherever it starts.
+    '''
+    buf = as_bytes(raw)
+    starts, length, inside = _packets(buf, starts, length, extra=0)
+    length = length - length % 2
+    even = _cumsum(buf[0::2])
+    odd = _cumsum(buf[1::2])
+
+    def _sum(first, stop, parity):
+        # sum of the bytes in buf[first:stop] at offsets of the given parity
+        return np.where(parity == 0, even[(stop + 1) // 2] - even[(first + 1) // 2],
+                        odd[stop // 2] - odd[first // 2])
+
+    stop = starts + length
+    low = _sum(starts, stop, starts % 2)
+    high = _sum(np.minimum(starts + 1, stop), stop, (starts + 1) % 2)
+    return (low + (high << 8) + np.uint16(base % 65536)).astype(np.uint16)
+
+
+def check_byte_sums(raw, starts, length, byteorder='<'):
+    '''
+    Return a boolean mask of the packets with a valid byte sum checksum, where
+    the checksum is the sum of the first length bytes of the packet, stored in
+    the 2 bytes following them. Packets running past the end of the buffer are
+    marked as invalid.
+    '''
+    buf = as_bytes(raw)
+    starts, length, inside = _packets(buf, starts, length)
+    valid = byte_sums(buf, starts, length) == stored_checksums(buf, starts + length, byteorder)
+    return valid & inside
+
+
+def check_word_sums(raw, starts, length, base=NORTEK_BASE):
+    '''
+    Return a boolean mask of the packets with a valid word sum checksum (by
+    default, the Nortek checksum), where the checksum is the sum of the words
+    in the first length bytes of the packet plus the base value, stored in the
+    2 bytes following them (little-endian). Packets running past the end of
+    the buffer are marked as invalid.
+    '''
+    buf = as_bytes(raw)
+    starts, length, inside = _packets(buf, starts, length)
+    valid = word_sums(buf, starts, length, base) == stored_checksums(buf, starts + length)
+    return valid & inside
@@ -7,13 +7,27 @@
 @brief Provides common base classes, definitions and other utlities for all parsers.
 '''
 import argparse
+import base64
 import datetime
+import gzip
+import json
+import mmap
+import numpy as np
+import os
 import re
+import string
+import sys
+import time
 
 from munch import Munch as Bunch
 from calendar import timegm
 from pytz import timezone
 
+from cgsn_parsers.parsers.cache import ParseCache
+from cgsn_parsers.parsers.metrics import Metrics, NullMetrics
+from cgsn_parsers.parsers.netcdf import write_netcdf
+from cgsn_parsers.parsers.summary import IntervalStats, summary_filename
+
 # Regex strings for use with the majority of parsers
 DCL_TIMESTAMP = r'(\d{4}/\d{2}/\d{2}\s\d{2}:\d{2}:\d{2}.\d{3})'
 LOGFILENAME_TIMESTAMP = (r'(\d{8}_\d{6})' + '\.' + '.+' + '\.' + 'log')
@@ -23,27 +37,348 @@ STRING = r'(\S+)'
 INTEGER = r'([+-]?[0-9]+)'
 NEWLINE = r'(?:\r\n|\n)?'
 
+# Length of the DCL timestamp string (e.g. 2016/12/19 00:00:05.084)
+DCL_TIMESTAMP_LENGTH = 23
+
+# Missing values in the METBK data, written as NaN, Na or N
+_NAN_REGEX = re.compile(r'N[aN]*$')
+
+# Regexes used to check the values converted in bulk by parse_fields (written
+# one per line) match the FLOAT, FLTNAN (with the missing values as written)
+# and INTEGER patterns used by the parser regexes
+_FLOAT_COLUMN = re.compile(r'^[^\S\n]*[+-]?\d+.\d+[Ee]?[+-]?\d*$', re.MULTILINE)
+_FLTNAN_COLUMN = re.compile(r'^[^\S\n]*(?:[+-]?\d+.\d+[Ee]?[+-]?\d*|N[aN]*)$', re.MULTILINE)
+_INTEGER_COLUMN = re.compile(r'^[^\S\n]*[+-]?[0-9]+$', re.MULTILINE)
+
+# Cache of the epoch timestamps for the start of each day (keyed on the date as
+# an integer, YYYYMMDD) found in the DCL timestamps, used so repeated dates do
+# not have to be re-parsed.
+_EPOCH_DAYS = {}
+
+# Positions of the digits, and of the separators with their allowed values, in
+# the DCL date and time strings (YYYY/MM/DD HH:MM:SS.sss)
+_DCL_DIGITS = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18, 20, 21, 22]
+_DCL_SEPARATORS = [(4, [ord('/')]), (7, [ord('/')]), (10, [ord(' '), ord('\t')]),
+                   (13, [ord(':')]), (16, [ord(':')]), (19, [ord('.')])]
+
+# Size of the blocks (in bytes) read from the data files when parsing the files
+# in batches
+BATCH_SIZE = 4 * 1024 * 1024
+
+# Size of the blocks (in bytes) of the data object split into lines at a time,
+# and converted in bulk, by parse_fields
+LINE_BLOCK = 1024 * 1024
+
+# Smallest block of records split in two when looking for the records that
+# failed the checks in a block converted by parse_fields
+MIN_BLOCK = 16
+
+# Number of values converted into Python objects at a time when streaming the
+# parsed data to a JSON file
+JSON_CHUNK = 65536
+
+# Suffix added to the output file name for the checkpoint file used to record
+# the progress of the incremental (append mode) parsing of a growing log file
+CHECKPOINT_SUFFIX = '.ckpt'
+
+# Marks the end of the matches in the instrumented version of iter_matches
+_END = object()
+
+# Cache of the line-anchored versions of the parser regexes used to scan whole
+# buffers, keyed on the original compiled regex.
+_LINE_REGEX = {}
+
+
+class ColumnBuffer(object):
+    '''
+    A growable, typed NumPy buffer used to hold the values of a single parsed
+    parameter. Values are appended record-by-record (or in blocks via extend)
+    into a pre-allocated array that doubles in size as needed, avoiding the
+    overhead of storing every value as a boxed Python object.
+
+    Per-record vectors (e.g. spectra, beams or bins) are stored as rows of a
+    2D array, with the shape of the rows set from the first record. If a later
+    record does not match that shape, the column falls back to a plain list.
+    '''
+    def __init__(self, dtype, capacity=1024):
+        self.dtype = np.dtype(dtype)
+        self.shape = None
+        self._capacity = capacity
+        self._data = None
+        self._size = 0
+        self._ragged = None
+
+    def _allocate(self, shape, size):
+        '''
+        Set the shape of the records and (re)allocate the buffer so it can
+        hold at least size records.
+        '''
+        capacity = max(self._capacity, size)
+        if self._data is not None:
+            capacity = max(capacity, 2 * len(self._data))
+
+        data = np.empty((capacity,) + shape, dtype=self.dtype)
+        if self._data is not None:
+            data[:self._size] = self._data[:self._size]
+
+        self.shape = shape
+        self._data = data
+
+    def _to_ragged(self):
+        '''
+        Convert the buffer into a list when the records differ in shape.
+        '''
+        self._ragged = self.tolist()
+        self._data = None
+
+    def append(self, value):
+        '''
+        Append a single record to the column.
+        '''
+        if self._ragged is not None:
+            self._ragged.append(value)
+            return
+
+        shape = np.shape(value)
+        if self._data is None:
+            self._allocate(shape, 1)
+        elif shape != self.shape:
+            self._to_ragged()
+            self._ragged.append(value)
+            return
+        elif self._size == len(self._data):
+            self._allocate(shape, self._size + 1)
+
+        self._data[self._size] = value
+        self._size += 1
+
+    def extend(self, values):
+        '''
+        Append a block of records to the column.
+        '''
+        if self._ragged is not None:
+            self._ragged.extend(values)
+            return
+
+        try:
+            values = np.asarray(values, dtype=self.dtype)
+        except (TypeError, ValueError):
+            # the records differ in shape
+            self._to_ragged()
+            self._ragged.extend(values)
+            return
+
+        if values.shape[0] == 0:
+            return
+
+        shape = values.shape[1:]
+        if self._data is not None and shape != self.shape:
+            self._to_ragged()
+            self._ragged.extend(values.tolist())
+            return
+
+        size = self._size + values.shape[0]
+        if self._data is None or size > len(self._data):
+            self._allocate(shape, size)
+
+        self._data[self._size:size] = values
+        self._size = size
+
+    @property
+    def values(self):
+        '''
+        The records held in the column, as an array (or a list if the records
+        differ in shape).
+        '''
+        if self._ragged is not None:
+            return self._ragged
+        if self._data is None:
+            return np.zeros(0, dtype=self.dtype)
+        return self._data[:self._size]
+
+    def finalize(self):
+        '''
+        Return the records as a NumPy array, trimmed to the number of records.
+        '''
+        if self._ragged is not None:
+            return np.array(self._ragged, dtype=object)
+        return self.values.copy()
+
+    def tolist(self):
+        '''
+        Return the records as (nested) lists of Python objects.
+        '''
+        if self._ragged is not None:
+            return [v.tolist() if isinstance(v, np.ndarray) else v for v in self._ragged]
+        return self.values.tolist()
+
+    def __len__(self):
+        if self._ragged is not None:
+            return len(self._ragged)
+        return self._size
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __setitem__(self, index, value):
+        self.values[index] = value
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __array__(self, dtype=None):
+        return np.asarray(self.values, dtype=dtype)
+
+    def __repr__(self):
+        return 'ColumnBuffer(%r)' % (self.values,)
+
+
+def _json_default(obj):
+    '''
+    Convert the NumPy arrays, scalars and column buffers held in a ColumnStore
+    into Python objects for serialization to JSON.
+    '''
+    if isinstance(obj, (ColumnBuffer, np.ndarray, np.generic)):
+        return obj.tolist()
+    raise TypeError('%r is not JSON serializable' % (obj,))
+
+
+def _encode(value):
+    '''
+    Serialize a value to JSON, as done by ColumnStore.toJSON.
+    '''
+    return json.dumps(value, default=_json_default)
+
+
+def _write_column(value, fid):
+    '''
+    Write a column of the parsed data to an open file as a JSON array,
+    converting the records into Python objects in chunks of JSON_CHUNK values.
+    '''
+    if isinstance(value, ColumnBuffer):
+        value = value.values
+
+    if len(value) == 0:
+        fid.write('[]')
+        return
+
+    rows = max(1, JSON_CHUNK // max(1, np.size(value[0])))
+    fid.write('[')
+    for start in range(0, len(value), rows):
+        if start:
+            fid.write(', ')
+        chunk = value[start:start + rows]
+        if isinstance(chunk, np.ndarray):
+            chunk = chunk.tolist()
+        fid.write(_encode(chunk)[1:-1])
+    fid.write(']')
+
+
+def write_json(data, fid):
+    '''
+    Write the parsed data (a Bunch or ColumnStore) to an open file as JSON,
+    one column (or chunk of a column) at a time, rather than serializing all
+    of the data into a single string first. The output is identical to that of
+    the toJSON method.
+    '''
+    fid.write('{')
+    for i, (name, value) in enumerate(data.items()):
+        if i:
+            fid.write(', ')
+        fid.write(_encode(name) + ': ')
+        if isinstance(value, dict):
+            write_json(value, fid)
+        elif isinstance(value, (ColumnBuffer, np.ndarray, list)):
+            _write_column(value, fid)
+        else:
+            fid.write(_encode(value))
+    fid.write('}')
+
+
+class ColumnStore(Bunch):
+    '''
+    A Bunch class object holding the parsed parameters as columns, either as
+    typed ColumnBuffers (for the parameters with a declared dtype) or as plain
+    lists. The toJSON and toDict methods convert the columns back to Python
+    objects, so the output matches that of a Bunch of lists.
+    '''
+    def add_columns(self, names, dtypes=None):
+        '''
+        Add the named parameters to the store, using a ColumnBuffer for those
+        with a dtype set in the dtypes dictionary.
+        '''
+        dtypes = dtypes or {}
+        for name in names:
+            if name in dtypes:
+                self[name] = ColumnBuffer(dtypes[name])
+            else:
+                self[name] = []
+
+    def finalize(self):
+        '''
+        Replace the ColumnBuffers (including those in any nested stores) with
+        NumPy arrays trimmed to the number of records.
+        '''
+        for name, value in self.items():
+            if isinstance(value, ColumnBuffer):
+                self[name] = value.finalize()
+            elif isinstance(value, ColumnStore):
+                value.finalize()
+
+        return self
+
+    def extend(self, other):
+        '''
+        Append the records held in another store with the same parameters
+        (e.g. the next batch of parsed data) to this one.
+        '''
+        for name, value in other.items():
+            self[name].extend(value)
+
+    def toDict(self):
+        '''
+        Recursively convert the store into a dictionary of Python objects.
+        '''
+        data = {}
+        for name, value in self.items():
+            if isinstance(value, Bunch):
+                data[name] = value.toDict()
+            elif isinstance(value, (ColumnBuffer, np.ndarray)):
+                data[name] = value.tolist()
+            else:
+                data[name] = value
+
+        return data
+
+    def toJSON(self, **options):
+        '''
+        Serialize the store to JSON, accepting the same keyword options as
+        json.dumps.
+        '''
+        options.setdefault('default', _json_default)
+        return json.dumps(self, **options)
+
 
 class ParameterNames(object):
     '''
     Base class used to initialize the Bunch class dictionary object for holding
     parsed parameters. The class must be initialized with the parameter names
-    when called by the individual parsers.
+    when called by the individual parsers, and optionally a dictionary of the
+    dtypes for the parameters to hold in typed column buffers.
     '''
     # Initialize Parameter names with time as the only default parameter
-    def __init__(self, parameters=[]):
+    def __init__(self, parameters=[], dtypes=None):
         self.parameters = ['time'] + parameters
+        self.dtypes = dtypes
 
     # Create the initial dictionary object.
     def create_dict(self):
         '''
-        Create a Bunch class object to store the parameter names for the data
-        files.
+        Create a ColumnStore (Bunch) class object to store the parameter names
+        for the data files.
         '''
-        bunch = Bunch()
-
-        for name in self.parameters:
-            bunch[name] = []
+        bunch = ColumnStore()
+        bunch.add_columns(self.parameters, self.dtypes)
 
         return bunch
 
@@ -53,22 +388,40 @@ class ParserCommon(object):
     A Parser class that begins the process of extracting data records from the
     DCL log files.
 
-    An initialize method is used to initialize the Parser object, with two
+    An initialize method is used to initialize the Parser object, with three
     methods provided to read the data files in as buffered objects (using
-    either readlines, if the file is ascii, or read if the file is a
-    pure binary file).
+    either readlines, if the file is ascii, read if the file is a pure binary
+    file, or a read-only memory map of the file, for either).
     '''
-    def initialize(self, infile, parameters):
+    # names of any attributes used by a parser to carry information from one
+    # batch of data to the next (saved with the checkpoints used in append mode)
+    _state = []
+
+    # counters and timings for the run, only collected if set to a Metrics
+    # object (see run_parser)
+    metrics = NullMetrics()
+
+    # a literal string found in every record line after the DCL timestamp, if
+    # there is one, used by iter_matches to skip the lines without it (e.g. the
+    # DCL status messages) before trying the full regex
+    _signature = None
+
+    # names of the parameters summarized over time intervals (mean, standard
+    # deviation, minimum and maximum), if a summary interval is set (see
+    # run_parser)
+    _summary = []
+
+    def initialize(self, infile, parameters, dtypes=None):
         '''
         Initialize the Parser object with the input file and path and the data
-        parameters
+        parameters (and optionally the dtypes of those parameters)
         '''
         # set the infile name and path
         self.infile = infile
 
         # initialize the data dictionary using the names defined above
-        data = ParameterNames(parameters)
-        self.data = data.create_dict()
+        self._parameter_names = ParameterNames(parameters, dtypes)
+        self.data = self._parameter_names.create_dict()
         self.raw = None
 
     def load_ascii(self):
@@ -79,6 +432,9 @@ class ParserCommon(object):
         with open(self.infile, 'rb') as fid:
             self.raw = fid.readlines()
 
+        if self.metrics.enabled:
+            self.metrics.count('bytes', sum(len(line) for line in self.raw))
+
     def load_binary(self):
         '''
         Create a buffered data object by opening the data file and reading in
@@ -87,6 +443,745 @@ class ParserCommon(object):
         with open(self.infile, 'rb') as fid:
             self.raw = fid.read()
 
+        self.metrics.count('bytes', len(self.raw))
+
+    def load_mmap(self):
+        '''
+        Create a read-only, memory mapped buffer of the data file contents,
+        rather than reading the file into memory. The buffer can be used in
+        place of either the readlines (via iter_matches) or read results.
+        '''
+        with open(self.infile, 'rb') as fid:
+            try:
+                self.raw = mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty files cannot be mapped
+                self.raw = ''
+
+        self.metrics.count('bytes', len(self.raw))
+
+    def iter_matches(self, regex):
+        '''
+        Iterate through the record lines in the data object that match the
+        regex (from the start of the line). If the data was loaded with
+        readlines, each line is matched in turn, otherwise the whole buffer is
+        scanned.
+        '''
+        if self.metrics.enabled:
+            for match in self._iter_matches_metrics(regex):
+                yield match
+            return
+
+        if self._signature:
+            for match in self._prefilter(regex):
+                if match:
+                    yield match
+        elif isinstance(self.raw, list):
+            for line in self.raw:
+                match = regex.match(line)
+                if match:
+                    yield match
+        else:
+            for match in scan_buffer(regex, self.raw):
+                yield match
+
+    def _prefilter(self, regex):
+        '''
+        Return an iterator over the results of matching the regex against the
+        lines containing the signature (None for the lines that do not match).
+        '''
+        if isinstance(self.raw, list):
+            return (regex.match(line) for line in self.raw
+                    if line.find(self._signature, DCL_TIMESTAMP_LENGTH) != -1)
+
+        return scan_signature(regex, self.raw, self._signature)
+
+    def _iter_matches_metrics(self, regex):
+        '''
+        Version of iter_matches that counts the lines scanned, matched and
+        rejected (by the signature prefilter or the regex), and times the scan
+        for the records.
+        '''
+        if isinstance(self.raw, list):
+            scanned = len(self.raw)
+        else:
+            scanned = _count_lines(self.raw)
+
+        # the number of lines the regex is tried against is only known when
+        # the results are returned for every line tried, not just the matches
+        tried = None
+        if self._signature:
+            matches = self._prefilter(regex)
+            tried = 0
+        elif isinstance(self.raw, list):
+            matches = (regex.match(line) for line in self.raw)
+        else:
+            matches = scan_buffer(regex, self.raw)
+
+        matched = 0
+        try:
+            while True:
+                start = time.time()
+                match = next(matches, _END)
+                self.metrics.add_time('scan', time.time() - start)
+                if match is _END:
+                    break
+                if tried is not None:
+                    tried += 1
+                if match:
+                    matched += 1
+                    yield match
+        finally:
+            if tried is None:
+                tried = scanned
+            self.metrics.count('scanned', scanned)
+            self.metrics.count('matched', matched)
+            self.metrics.count('rejected_prefilter', scanned - tried)
+            self.metrics.count('rejected_regex', tried - matched)
+
+    def iter_lines(self):
+        '''
+        Iterate through the data object in blocks of lines (with the line
+        endings removed), returning each block as a list along with a flag set
+        if the last line in the block is missing its line ending (only ever
+        the case for the last line in the data).
+        '''
+        if isinstance(self.raw, list):
+            lines = [line[:-1] if line.endswith(b'\n') else line for line in self.raw]
+            yield lines, bool(self.raw) and not self.raw[-1].endswith(b'\n')
+            return
+
+        buf = self.raw
+        pos = 0
+        while pos < len(buf):
+            end = buf.find(b'\n', min(pos + LINE_BLOCK, len(buf)) - 1)
+            if end == -1:
+                yield buf[pos:].split(b'\n'), True
+                return
+
+            yield buf[pos:end].split(b'\n'), False
+            pos = end + 1
+
+    def parse_fields(self, regex, split, fields, build, timestamp='dcl_date_time_string', clean=None):
+        '''
+        Parse records made up of the DCL timestamp followed by a fixed set of
+        fields (e.g. delimited numbers), converting the values a column at a
+        time rather than record by record.
+
+        The split function is called with the rest of each line after the DCL
+        timestamp, returning the values of the fields as a list of strings (or
+        None if the line does not have the expected form). The fields are a
+        list of (name, convert) pairs, one per value, where convert is one of
+        the column converters (float_column, int_column, etc), and the values
+        are added to the named parameters (or checked and discarded if the
+        name is None). The DCL timestamps are added to the timestamp parameter.
+
+        A block of records is converted in one go, with the block checked as a
+        whole: the lines must have well formed DCL timestamps, and the values
+        must match the patterns used by the regex (checked in a single pass
+        over each column) and convert. A block failing the checks is split in
+        two and each half tried again, down to blocks of MIN_BLOCK records.
+        The lines the split function rejects, and the records in the blocks still failing the
+        checks, are instead matched against the regex (after calling the clean
+        function on the line, if set) and added to the data with the build
+        function, as done by the parsers without the bulk conversion.
+        '''
+        signature = self._signature
+        counts = {'scanned': 0, 'matched': 0, 'rejected_prefilter': 0}
+        block = []
+        rows = []
+        start = time.time()
+        converting = [0.]
+
+        def match(line):
+            # the slow path, using the regex and build function
+            if clean:
+                line = clean(line)
+            m = regex.match(line)
+            if m:
+                build(m)
+                counts['matched'] += 1
+
+        def convert(lines, values):
+            # convert a block of records, splitting the block in two and
+            # trying again if the checks fail, until the bad records are
+            # found and left for the regex
+            try:
+                columns = _convert_fields(lines, values, fields)
+            except ValueError:
+                if len(lines) <= MIN_BLOCK:
+                    for line in lines:
+                        match(line + b'\n')
+                    return
+
+                half = len(lines) // 2
+                convert(lines[:half], values[:half])
+                convert(lines[half:], values[half:])
+                return
+
+            self.data[timestamp].extend(columns[0])
+            for (name, convert_field), column in zip(fields, columns[1:]):
+                if name:
+                    self.data[name].extend(column)
+            counts['matched'] += len(lines)
+
+        def flush():
+            if not block:
+                return
+            begin = time.time()
+            convert(block, rows)
+            del block[:]
+            del rows[:]
+            converting[0] += time.time() - begin
+
+        for lines, partial in self.iter_lines():
+            counts['scanned'] += len(lines)
+            if partial:
+                # leave the last line, missing its line ending, for the regex
+                lines, last = lines[:-1], lines[-1]
+
+            for line in lines:
+                if signature and line.find(signature, DCL_TIMESTAMP_LENGTH) == -1:
+                    counts['rejected_prefilter'] += 1
+                    continue
+
+                values = split(line[DCL_TIMESTAMP_LENGTH + 1:])
+                if values is not None and len(values) == len(fields):
+                    block.append(line)
+                    rows.append(values)
+                elif line:
+                    # keep the records in order, converting the block so far
+                    # before adding the record from this line (if any)
+                    flush()
+                    match(line + b'\n')
+
+            flush()
+            if partial:
+                match(last)
+
+        if self.metrics.enabled:
+            for name, value in counts.items():
+                self.metrics.count(name, value)
+            self.metrics.count('rejected_regex', counts['scanned'] - counts['matched'] -
+                               counts['rejected_prefilter'])
+            self.metrics.add_time('scan', time.time() - start - converting[0])
+
+    def iter_batches(self, batch_size=BATCH_SIZE, offset=0, final=True):
+        '''
+        Parse the data file in batches, reading the file in blocks of
+        batch_size bytes and yielding the parsed data for each block as a new
+        Bunch class object. Partial records at the end of a block are carried
+        over to the next one, so memory use is set by the batch size rather
+        than the size of the file.
+
+        Parsing starts at the byte offset into the file. If final is False, the
+        data left over at the end of the file (which may be a record still
+        being written) is not parsed. Either way, once the batches have been
+        consumed, self.offset is set to the position in the file of any data
+        left over, with that data held in self.tail.
+        '''
+        carry = b''
+        with open(self.infile, 'rb') as fid:
+            fid.seek(offset)
+            while True:
+                block = fid.read(batch_size)
+                self.metrics.count('bytes', len(block))
+                buf = carry + block
+                if block:
+                    stop = self._split_batch(buf)
+                elif final:
+                    # end of the file, parse whatever is left
+                    stop = len(buf)
+                else:
+                    stop = 0
+
+                if stop > 0:
+                    self.raw = buf[:stop]
+                    self.data = self._parameter_names.create_dict()
+                    self.parse_data()
+                    yield self.data
+
+                carry = buf[stop:]
+                offset += stop
+                if not block:
+                    break
+
+        self.raw = None
+        self.offset = offset
+        self.tail = carry
+
+    def parse_append(self, checkpoint=None, batch_size=BATCH_SIZE):
+        '''
+        Parse the data added to the file since the checkpoint returned by an
+        earlier call (or the whole file if the checkpoint is None), appending
+        the records to those already held in self.data, and return a new
+        checkpoint.
+
+        The records parsed from the end of the file, which may be incomplete,
+        are included in self.data but also counted in the checkpoint so they
+        can be removed and parsed again (along with the new data) on the next
+        call. Parser attributes named in self._state, which carry information
+        from one batch to the next, are saved with the checkpoint as they were
+        before the end of the file was parsed.
+        '''
+        offset = 0
+        if checkpoint:
+            offset = checkpoint['offset']
+            for name, value in checkpoint['state'].items():
+                setattr(self, name, value)
+
+        data = self.data
+        for batch in self.iter_batches(batch_size, offset, final=False):
+            data.extend(batch)
+
+        offset, tail = self.offset, self.tail
+        state = dict((name, getattr(self, name)) for name in self._state)
+
+        # parse the end of the file, counting the provisional records. A
+        # record still being written may fail to parse, in which case it is
+        # left for the next call.
+        self.data = self._parameter_names.create_dict()
+        if tail:
+            self.raw = tail
+            try:
+                self.parse_data()
+            except Exception:
+                self.data = self._parameter_names.create_dict()
+            self.raw = None
+
+        rows = _count_rows(self.data)
+        data.extend(self.data)
+        self.data = data
+
+        return {
+            'infile': os.path.abspath(self.infile),
+            'offset': offset,
+            'tail': base64.b64encode(tail),
+            'rows': rows,
+            'state': state
+        }
+
+    def _split_batch(self, buf):
+        '''
+        Return the point at which to split a block of data read in by
+        iter_batches, with the data before that point parsed and the rest
+        carried over to the next block. By default, split after the last
+        complete line. Parsers with multi-line records or binary packets
+        override this method.
+        '''
+        return buf.rfind(b'\n') + 1
+
+
+def scan_buffer(regex, buf):
+    '''
+    Find the lines in a buffer (a string or memory mapped file) that match the
+    regex, returning the same matches as calling regex.match on each line
+    from readlines, but without splitting the buffer into lines.
+    '''
+    try:
+        search = _LINE_REGEX[regex]
+    except KeyError:
+        search = re.compile('^(?:' + regex.pattern + ')', regex.flags | re.MULTILINE)
+        _LINE_REGEX[regex] = search
+
+    pos = 0
+    while True:
+        match = search.search(buf, pos)
+        if not match:
+            return
+
+        # a match may not run past the end of the line it starts on. if it
+        # does, re-match the line on its own.
+        start = match.start()
+        eol = buf.find(b'\n', start, match.end() - 1)
+        if eol != -1:
+            pos = eol + 1
+            match = regex.match(buf, start, pos)
+        else:
+            pos = max(match.end(), start + 1)
+
+        if match:
+            yield match
+
+
+def float_column(values):
+    '''
+    Convert a column of strings to floats, raising a ValueError if any do not
+    match the FLOAT pattern (allowing for leading whitespace).
+    '''
+    values = _check_column(_FLOAT_COLUMN, values)
+    return map(float, values)
+
+
+def fltnan_column(values):
+    '''
+    Convert a column of strings to floats, with the missing values (written as
+    NaN, Na or N) set to NaN, raising a ValueError if any do not match the
+    FLOAT pattern or one of the missing values.
+    '''
+    values = _check_column(_FLTNAN_COLUMN, values)
+    try:
+        return map(float, values)
+    except ValueError:
+        return map(float, ['NaN' if _NAN_REGEX.match(value) else value for value in values])
+
+
+def int_column(values):
+    '''
+    Convert a column of strings to integers, raising a ValueError if any do
+    not match the INTEGER pattern (allowing for leading whitespace).
+    '''
+    values = _check_column(_INTEGER_COLUMN, values)
+    return map(int, values)
+
+
+def string_column(values):
+    '''
+    Return a column of strings as a list.
+    '''
+    return list(values)
+
+
+def format_column(template):
+    '''
+    Return a column converter for strings with a fixed format (e.g. the date
+    and time strings recorded by the instruments), raising a ValueError if any
+    of the strings do not match the template. In the template, a 9 stands for
+    a digit, an A for a letter, digit or underscore, a space for any
+    whitespace and a ? for any character but a newline, with all other
+    characters matched as is.
+    '''
+    table = _format_table(template)
+
+    def convert(values):
+        values = list(values)
+        if set(map(len, values)) != set([len(template)]):
+            raise ValueError('string does not match the format')
+        chars = np.frombuffer(b''.join(values), dtype=np.uint8).reshape(len(values), len(template))
+        if not _check_format(table, chars):
+            raise ValueError('string does not match the format')
+        return values
+
+    return convert
+
+
+def _check_column(regex, values):
+    '''
+    Check all of the values in a column match the pattern, counting the
+    matches in a single pass of the regex over the column (with the values
+    one per line), and returning the values as a list.
+    '''
+    values = list(values)
+    if len(regex.findall(b'\n'.join(values))) != len(values):
+        raise ValueError('value does not match the pattern')
+    return values
+
+
+def _format_table(template):
+    '''
+    Create a table of the characters allowed at each position of a format
+    template (see format_column).
+    '''
+    classes = {
+        '9': string.digits,
+        'A': string.ascii_letters + string.digits + '_',
+        ' ': string.whitespace,
+        '?': ''.join(chr(c) for c in range(256) if chr(c) != '\n')
+    }
+    table = np.zeros((len(template), 256), dtype=bool)
+    for i, c in enumerate(template):
+        table[i, [ord(allowed) for allowed in classes.get(c, c)]] = True
+
+    return table
+
+
+def _check_format(table, chars):
+    '''
+    Check the rows of characters (as a 2D array of bytes) against a table of
+    the characters allowed at each position, created by _format_table.
+    '''
+    return bool(table[np.arange(table.shape[0]), chars].all())
+
+
+# Format of the DCL timestamp (see format_column), followed by the whitespace
+# separating it from the data, used to check the timestamps in bulk
+_DCL_FORMAT = _format_table('9999/99/99 99:99:99?999 ')
+
+
+def _convert_fields(lines, rows, fields):
+    '''
+    Convert a block of records (the lines and the values of the fields split
+    from them) for parse_fields, returning the DCL timestamps followed by the
+    values for each field, or raising a ValueError if the block fails the
+    checks.
+    '''
+    chars = np.frombuffer(b''.join(line[:DCL_TIMESTAMP_LENGTH + 1] for line in lines), dtype=np.uint8)
+    chars = chars.reshape(len(lines), DCL_TIMESTAMP_LENGTH + 1)
+    if not _check_format(_DCL_FORMAT, chars):
+        raise ValueError('badly formed DCL timestamp')
+
+    columns = [chars[:, :DCL_TIMESTAMP_LENGTH].copy().view('S%d' % DCL_TIMESTAMP_LENGTH).ravel().tolist()]
+    for (name, convert), values in zip(fields, zip(*rows)):
+        columns.append(convert(values))
+
+    return columns
+
+
+def scan_signature(regex, buf, signature, offset=DCL_TIMESTAMP_LENGTH):
+    '''
+    Find the lines in a buffer (a string or memory mapped file) containing the
+    signature, a literal string found in every record, at or after the offset
+    from the start of the line (by default, after the DCL timestamp). Returns
+    the result of matching the regex against each of those lines (None if the
+    line does not match), the same as calling regex.match on the lines from
+    readlines. A literal search for the signature passes over the other lines
+    far faster than trying the regex against each of them.
+    '''
+    pos = 0
+    while True:
+        found = buf.find(signature, pos)
+        if found == -1:
+            return
+
+        start = buf.rfind(b'\n', 0, found) + 1
+        if found - start < offset:
+            # too close to the start of the line, try further along
+            pos = found + 1
+            continue
+
+        end = buf.find(b'\n', found)
+        end = len(buf) if end == -1 else end + 1
+        yield regex.match(buf, start, end)
+        pos = end
+
+
+def _count_rows(data):
+    '''
+    Return the number of records held in each of the columns of a store (as
+    a dictionary of the same structure).
+    '''
+    rows = {}
+    for name, value in data.items():
+        if isinstance(value, dict):
+            rows[name] = _count_rows(value)
+        else:
+            rows[name] = len(value)
+
+    return rows
+
+
+def _drop_rows(data, rows):
+    '''
+    Remove the given number of records from the end of each column.
+    '''
+    for name, count in rows.items():
+        if isinstance(count, dict):
+            _drop_rows(data[name], count)
+        elif count:
+            del data[name][-count:]
+
+
+def _load_checkpoint(infile, outfile):
+    '''
+    Load the checkpoint saved with an output file, returning None if there is
+    no checkpoint or it no longer matches the input and output files (e.g. the
+    raw data file was replaced rather than appended to, or the output file
+    was rewritten by another process).
+    '''
+    ckfile = outfile + CHECKPOINT_SUFFIX
+    if not (os.path.exists(ckfile) and os.path.exists(outfile)):
+        return None
+
+    try:
+        with open(ckfile, 'r') as f:
+            checkpoint = json.load(f)
+        tail = base64.b64decode(checkpoint['tail'])
+    except (ValueError, TypeError, KeyError):
+        return None
+
+    if checkpoint['infile'] != os.path.abspath(infile) or checkpoint['size'] != os.path.getsize(outfile):
+        return None
+
+    # the data left over from the last run should still be in the file
+    with open(infile, 'rb') as fid:
+        fid.seek(checkpoint['offset'])
+        if fid.read(len(tail)) != tail:
+            return None
+
+    return checkpoint
+
+
+def _count_lines(buf):
+    '''
+    Count the lines in a buffer (a string or memory mapped file), including
+    any partial line at the end.
+    '''
+    if not len(buf):
+        return 0
+
+    lines = int(np.count_nonzero(np.frombuffer(buf, dtype=np.uint8) == ord('\n')))
+    if buf[-1] != b'\n':
+        lines += 1
+    return lines
+
+
+def _open_json(filename, mode, compress=False):
+    '''
+    Open a JSON file, using gzip if compress is set.
+    '''
+    if compress:
+        return gzip.open(filename, mode + 'b')
+    return open(filename, mode)
+
+
+def write_data(parser, outfile, fmt='json', filename=None):
+    '''
+    Write the parsed data to the output file, either as JSON (the default,
+    compressed with gzip if the output file name ends in .gz) or as a NetCDF4
+    file. If set, the data is written to filename rather than the output file
+    (e.g. a temporary file to be renamed to the output file).
+    '''
+    filename = filename or outfile
+    if fmt == 'netcdf':
+        write_netcdf(parser.data, filename, {'source': os.path.basename(parser.infile)})
+        return
+
+    with _open_json(filename, 'w', outfile.endswith('.gz')) as f:
+        write_json(parser.data, f)
+
+
+def write_summary(stats, outfile):
+    '''
+    Write the statistics accumulated by an IntervalStats object to a JSON
+    file, compressed with gzip if the file name ends in .gz.
+    '''
+    with _open_json(outfile, 'w', outfile.endswith('.gz')) as f:
+        write_json(stats.result(), f)
+
+
+def run_parser(parser, outfile, options=None):
+    '''
+    Parse the data file and write the results to the output file as JSON (or
+    NetCDF4), using the options (the arguments returned by inputs) to set how.
+
+    In append mode, only the data added to the file since the last run is
+    parsed, with the records appended to those in the existing output file.
+    The position reached in the data file is saved in a checkpoint file next
+    to the output (with the CHECKPOINT_SUFFIX), and the whole file is parsed
+    if the checkpoint is missing or out of date.
+
+    Otherwise, if a cache directory is set, the results are copied from the
+    cache if the data file has already been parsed (by the same version of the
+    parser, using the same switch and output format), and added to the cache
+    if not.
+
+    JSON files are compressed with gzip if the output file name ends in .gz.
+
+    If any metrics files are set, the numbers of lines (or packets) scanned,
+    matched and rejected, the bytes read and the time spent in each phase of
+    the run are saved to them, as JSON or (for files ending in .prom) in the
+    Prometheus textfile format.
+
+    If a summary interval (in seconds) is set, the statistics of the parameters
+    named in the parser's _summary attribute over each interval are saved as
+    JSON next to the output file (see summary_filename). The cache is not used
+    in this case. With summary_only set, only the statistics are saved, to the
+    output file, with the data file parsed in batches that are reduced as they
+    are parsed rather than held in memory.
+    '''
+    metrics = getattr(options, 'metrics', None)
+    if metrics:
+        parser.metrics = Metrics()
+
+    _run_parser(parser, outfile, options)
+
+    if metrics:
+        # use the module file name, as the module is __main__ if run as a script
+        module = sys.modules[parser.__class__.__module__]
+        name = os.path.splitext(os.path.basename(module.__file__))[0].replace('parse_', '')
+        for filename in metrics:
+            parser.metrics.write(filename, name, os.path.basename(parser.infile))
+
+
+def _run_parser(parser, outfile, options):
+    '''
+    Parse the data file and write the results, as described in run_parser.
+    '''
+    append = getattr(options, 'append', False)
+    cache = getattr(options, 'cache', None)
+    fmt = getattr(options, 'format', 'json')
+    summary = getattr(options, 'summary', None)
+    if summary:
+        if not parser._summary:
+            raise ValueError('A summary is not available for this parser')
+        cache = None    # the cache only holds the output file
+
+    if summary and getattr(options, 'summary_only', False):
+        if append:
+            raise ValueError('Append mode is not available for the summary only output')
+
+        stats = IntervalStats(parser._summary, summary)
+        with parser.metrics.timer('parse'):
+            for batch in parser.iter_batches():
+                stats.update(batch)
+        with parser.metrics.timer('write'):
+            write_summary(stats, outfile)
+        return
+
+    if not append:
+        if cache:
+            cache = ParseCache(cache)
+            compressed = fmt + '.gz' if outfile.endswith('.gz') else fmt
+            key = cache.key(parser, getattr(options, 'switch', 0), compressed)
+            if cache.fetch(key, outfile):
+                return
+
+        with parser.metrics.timer('load'):
+            parser.load_mmap()
+        with parser.metrics.timer('parse'):
+            parser.parse_data()
+        with parser.metrics.timer('write'):
+            write_data(parser, outfile, fmt)
+            if summary:
+                stats = IntervalStats(parser._summary, summary).update(parser.data)
+                write_summary(stats, summary_filename(outfile))
+
+        if cache:
+            cache.store(key, outfile)
+        return
+
+    if fmt != 'json':
+        raise ValueError('Append mode is only available for JSON formatted output')
+
+    checkpoint = _load_checkpoint(parser.infile, outfile)
+    if checkpoint:
+        # load the previous results, less the provisional records
+        with parser.metrics.timer('load'):
+            with _open_json(outfile, 'r', outfile.endswith('.gz')) as f:
+                previous = json.load(f)
+            _drop_rows(previous, checkpoint['rows'])
+            parser.data.extend(previous)
+
+    with parser.metrics.timer('parse'):
+        checkpoint = parser.parse_append(checkpoint)
+
+    # write the output and then the checkpoint, recording the size of the
+    # output so a checkpoint left behind by an interrupted run is not used
+    with parser.metrics.timer('write'):
+        write_data(parser, outfile, filename=outfile + '.tmp')
+        checkpoint['size'] = os.path.getsize(outfile + '.tmp')
+        with open(outfile + CHECKPOINT_SUFFIX + '.tmp', 'w') as f:
+            f.write(json.dumps(checkpoint, default=_json_default))
+
+    os.rename(outfile + '.tmp', outfile)
+    os.rename(outfile + CHECKPOINT_SUFFIX + '.tmp', outfile + CHECKPOINT_SUFFIX)
+
+    if summary:
+        # the summary of all the records, as held in parser.data
+        with parser.metrics.timer('write'):
+            stats = IntervalStats(parser._summary, summary).update(parser.data)
+            write_summary(stats, summary_filename(outfile))
+
 
 def dcl_to_epoch(time_string):
     '''
@@ -110,6 +1205,105 @@ def dcl_to_epoch(time_string):
     return epts
 
 
+def dcl_to_epoch_array(time_strings):
+    '''
+    Vectorized version of dcl_to_epoch, converting a sequence of DCL formatted
+    date and time strings into a numpy array of epoch timestamps (seconds since
+    1970-01-01) in a single pass.
+    '''
+    strings = np.asarray(time_strings, dtype=np.str_)
+    if strings.size and strings.dtype.itemsize > DCL_TIMESTAMP_LENGTH:
+        # strings that are too long would otherwise be silently truncated
+        bad = strings.ravel()[np.char.str_len(strings.ravel()) > DCL_TIMESTAMP_LENGTH]
+        if bad.size:
+            raise ValueError('Invalid DCL date and time string: %r' % bad[0])
+
+    strings = strings.astype('S%d' % DCL_TIMESTAMP_LENGTH)
+    chars = strings.view(np.uint8).reshape(-1, DCL_TIMESTAMP_LENGTH)
+    return _dcl_chars_to_epoch(chars)
+
+
+def dcl_offsets_to_epoch(buf, offsets):
+    '''
+    Calculate an array of epoch timestamps (seconds since 1970-01-01) from the
+    DCL formatted date and time strings found at the byte offsets in the
+    buffer (e.g. the raw contents of a data file), without first extracting
+    the strings. Raises a ValueError if any of the offsets do not leave room
+    for a whole date and time string within the buffer.
+    '''
+    offsets = np.asarray(offsets, dtype=np.int64).reshape(-1, 1)
+    chars = np.frombuffer(buf, dtype=np.uint8)
+    bad = (offsets < 0) | (offsets + DCL_TIMESTAMP_LENGTH > chars.size)
+    if np.any(bad):
+        raise ValueError('Invalid DCL date and time string offset: %d' % offsets[bad][0])
+
+    chars = chars[offsets + np.arange(DCL_TIMESTAMP_LENGTH)]
+    return _dcl_chars_to_epoch(chars)
+
+
+def _dcl_chars_to_epoch(chars):
+    '''
+    Convert an array of DCL formatted date and time strings, as a 2D array of
+    characters (one row per string), into epoch timestamps. Raises a
+    ValueError, as dcl_to_epoch does, if any of the strings are not correctly
+    formatted or the time is out of range.
+    '''
+    if chars.shape[0] == 0:
+        return np.zeros(0)
+
+    # check the digits and the separators are where they should be
+    valid = np.all((chars[:, _DCL_DIGITS] >= ord('0')) & (chars[:, _DCL_DIGITS] <= ord('9')), axis=1)
+    for i, allowed in _DCL_SEPARATORS:
+        valid &= np.in1d(chars[:, i], allowed)
+
+    # convert the characters to the values of the digits and combine them into
+    # the date and time fields (YYYY/MM/DD HH:MM:SS.sss)
+    digits = chars.astype(np.int64) - ord('0')
+
+    def field(start, stop):
+        value = np.zeros(digits.shape[0], dtype=np.int64)
+        for i in range(start, stop):
+            value = value * 10 + digits[:, i]
+        return value
+
+    date = field(0, 4) * 10000 + field(5, 7) * 100 + field(8, 10)
+    seconds = field(11, 13) * 3600 + field(14, 16) * 60
+    second = field(17, 19)
+    msec = field(20, 23)
+
+    # the month and day are checked when the start of the day is calculated
+    valid &= (field(11, 13) < 24) & (field(14, 16) < 60) & (second <= 60)
+    if not valid.all():
+        bad = chars[np.argmin(valid)].tostring()
+        raise ValueError('Invalid DCL date and time string: %r' % bad)
+
+    # find and correct the incorrectly formatted cases where the seconds are
+    # set to 60.000 (seconds must be between 00 and 59), rolling over to the
+    # next minute.
+    msec[second == 60] = 0
+
+    # look up (or calculate and cache) the epoch time for the start of each
+    # unique day, and then add the time of day.
+    days, index = np.unique(date, return_inverse=True)
+    base = np.array([_day_to_epoch(day) for day in days], dtype=np.float64)
+    epts = base[index] + (seconds + second) + msec / 1000.
+    return epts
+
+
+def _day_to_epoch(date):
+    '''
+    Return the epoch timestamp for the start of a day (set as an integer,
+    YYYYMMDD), using the cached values if available.
+    '''
+    try:
+        return _EPOCH_DAYS[date]
+    except KeyError:
+        day = datetime.datetime.strptime('%08d' % date, '%Y%m%d')
+        epts = timegm(day.timetuple())
+        _EPOCH_DAYS[date] = epts
+        return epts
+
+
 def logfilename_to_epoch(time_string):
     '''
     Use the date and time string extracted from an hourly log filename to 
@@ -143,6 +1337,30 @@ def inputs():
     parser.add_argument("-o", "--outfile", dest="outfile", type=str, required=True)
     parser.add_argument("-s", "--switch", dest="switch", type=int, default=0)
 
+    # optionally, only parse the data added to the input file since the last
+    # run, appending the results to the output file
+    parser.add_argument("-a", "--append", dest="append", action="store_true")
+
+    # optionally, set a directory used to cache the parsed data, so unchanged
+    # files are not parsed again
+    parser.add_argument("-c", "--cache", dest="cache", type=str, default=None)
+
+    # set the output file format, either JSON (the default) or NetCDF4
+    parser.add_argument("-f", "--format", dest="format", type=str, default="json",
+                        choices=["json", "netcdf"])
+
+    # optionally, save the counts of the records scanned, matched and rejected
+    # and the time spent in each phase of the run, as JSON or (if the file name
+    # ends in .prom) a Prometheus textfile. can be given more than once.
+    parser.add_argument("-m", "--metrics", dest="metrics", type=str, action="append", default=None)
+
+    # optionally, save the mean, standard deviation, minimum and maximum of the
+    # data over intervals of the given number of seconds (for the parsers
+    # with a summary defined, e.g. the MOPAK), either next to or (with
+    # --summary-only) instead of the full data
+    parser.add_argument("-S", "--summary", dest="summary", type=float, default=None)
+    parser.add_argument("--summary-only", dest="summary_only", action="store_true")
+
     # parse the input arguements and create a parser object
     args = parser.parse_args()
 
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@package cgsn_parsers.parsers.metrics
+@file cgsn_parsers/parsers/metrics.py
+@author Christopher Wingard
+@brief Counters and timings collected while parsing a data file, saved as a
+    JSON sidecar file and/or a Prometheus textfile for monitoring the harvests.
+'''
+import json
+import os
+import time
+
+from contextlib import contextmanager
+
+# Counters kept for each run, in the order they are reported:
+#   bytes:              bytes of raw data read from the file
+#   scanned:            lines (or, for the binary formats, packets) examined
+#   matched:            lines matching the record regex (or packets found by
+#                       their sync bytes)
+#   rejected_prefilter: lines skipped as they do not contain the literal
+#                       signature of the records
+#   rejected_regex:     lines that did not match the record regex
+#   rejected_checksum:  matched packets dropped because the checksum failed
+#   rejected_size:      matched packets dropped because of a bad packet size
+COUNTERS = ['bytes', 'scanned', 'matched', 'rejected_prefilter', 'rejected_regex', 'rejected_checksum',
+            'rejected_size']
+
+# Phases timed for each run. The time spent decoding the records is the time
+# spent parsing the data, less the time spent scanning for the records.
+PHASES = ['load', 'scan', 'decode', 'write']
+
+
+class NullMetrics(object):
+    '''
+    Stand-in used when the metrics are not being collected, so the parsers can
+    call the same methods either way at next to no cost.
+    '''
+    enabled = False
+
+    def count(self, name, value=1):
+        pass
+
+    @contextmanager
+    def timer(self, phase):
+        yield
+
+
+class Metrics(object):
+    '''
+    Counters and phase timings for a single parser run. Set a Metrics object
+    as the metrics attribute of a parser to start collecting them.
+    '''
+    enabled = True
+
+    def __init__(self):
+        self.counters = dict((name, 0) for name in COUNTERS)
+        self.timings = {}
+
+    def count(self, name, value=1):
+        '''
+        Add the value to the named counter.
+        '''
+        self.counters[name] += value
+
+    def add_time(self, phase, seconds):
+        '''
+        Add the time (in seconds) to the named phase.
+        '''
+        self.timings[phase] = self.timings.get(phase, 0.) + seconds
+
+    @contextmanager
+    def timer(self, phase):
+        '''
+        Time the enclosed block, adding the time to the named phase.
+        '''
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.time() - start)
+
+    def to_dict(self, parser=None, infile=None):
+        '''
+        Return the counters and timings as a dictionary, along with the parser
+        name and input file if given.
+        '''
+        timings = dict((phase, 0.) for phase in PHASES)
+        timings.update(self.timings)
+        if 'parse' in timings:
+            timings['decode'] = max(timings.pop('parse') - timings['scan'], 0.)
+
+        return {
+            'parser': parser,
+            'infile': infile,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'counters': dict(self.counters),
+            'timings': timings
+        }
+
+    def write(self, filename, parser=None, infile=None):
+        '''
+        Save the metrics to a Prometheus textfile, if the file name ends in
+        .prom, otherwise to a JSON file. The file is written to a temporary
+        file and renamed, so a collector never reads a partial file.
+        '''
+        metrics = self.to_dict(parser, infile)
+        if filename.endswith('.prom'):
+            text = to_prometheus(metrics)
+        else:
+            text = json.dumps(metrics, indent=2, sort_keys=True) + '\n'
+
+        tmpfile = '%s.%d.tmp' % (filename, os.getpid())
+        with open(tmpfile, 'w') as f:
+            f.write(text)
+        os.rename(tmpfile, filename)
+
+
+def _labels(**labels):
+    return ','.join('%s="%s"' % (key, str(labels[key]).replace('\\', '\\\\').replace('"', '\\"'))
+                    for key in sorted(labels.keys()) if labels[key] is not None)
+
+
+def to_prometheus(metrics):
+    '''
+    Format the metrics returned by Metrics.to_dict in the Prometheus text
+    exposition format, as read by the node exporter textfile collector. The
+    values are for a single run, replaced by the next run, and so are written
+    as gauges labeled with the parser name only. The input file name is left
+    out, as a label per file would add a new series for every log file; it is
+    kept in the JSON metrics.
+    '''
+    labels = {'parser': metrics['parser']}
+    counters = metrics['counters']
+    lines = [
+        '# HELP cgsn_parser_bytes Bytes of raw data read from the file in the last run.',
+        '# TYPE cgsn_parser_bytes gauge',
+        'cgsn_parser_bytes{%s} %d' % (_labels(**labels), counters['bytes']),
+        '# HELP cgsn_parser_scanned Lines or packets examined in the last run.',
+        '# TYPE cgsn_parser_scanned gauge',
+        'cgsn_parser_scanned{%s} %d' % (_labels(**labels), counters['scanned']),
+        '# HELP cgsn_parser_matched Lines or packets matching the record format in the last run.',
+        '# TYPE cgsn_parser_matched gauge',
+        'cgsn_parser_matched{%s} %d' % (_labels(**labels), counters['matched']),
+        '# HELP cgsn_parser_rejected Lines or packets rejected in the last run, by reason.',
+        '# TYPE cgsn_parser_rejected gauge'
+    ]
+    for reason in ['prefilter', 'regex', 'checksum', 'size']:
+        lines.append('cgsn_parser_rejected{%s} %d' % (_labels(reason=reason, **labels),
+                                                       counters['rejected_' + reason]))
+
+    lines += ['# HELP cgsn_parser_phase_seconds Time spent in each phase of the last run.',
+              '# TYPE cgsn_parser_phase_seconds gauge']
+    for phase in PHASES:
+        lines.append('cgsn_parser_phase_seconds{%s} %.6f' % (_labels(phase=phase, **labels),
+                                                              metrics['timings'][phase]))
+
+    lines += ['# HELP cgsn_parser_last_run_timestamp_seconds Time the run finished.',
+              '# TYPE cgsn_parser_last_run_timestamp_seconds gauge',
+              'cgsn_parser_last_run_timestamp_seconds{%s} %d' % (_labels(**labels), time.time())]
+
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_filename(outfile):
+    '''
+    Return the name of the JSON metrics file saved next to an output file by
+    the batch driver, e.g. 20170101.ctdbp1.metrics.json for 20170101.ctdbp1.json.
+    '''
+    base = outfile[:-3] if outfile.endswith('.gz') else outfile
+    root, ext = os.path.splitext(base)
+    if ext not in ('.json', '.nc'):
+        root = base
+
+    return root + '.metrics.json'
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@package cgsn_parsers.parsers.netcdf
+@file cgsn_parsers/parsers/netcdf.py
+@author Christopher Wingard
+@brief Writes the parsed data to CF compliant NetCDF4 files, as an alternative
+    to the JSON formatted data files.
+'''
+import json
+import numpy as np
+
+try:
+    from netCDF4 import Dataset, default_fillvals, stringtochar
+except ImportError:
+    # only needed if writing NetCDF files
+    Dataset = None
+
+# Compression settings used for all of the numeric variables
+COMPRESSION = {'zlib': True, 'complevel': 4, 'shuffle': True}
+
+# Target size (in bytes) of the variable chunks
+CHUNK_BYTES = 1024 * 1024
+
+# Names of the second dimension for the parameters recorded as a vector (e.g.
+# bins, wavelengths or channels) per record. Other vector parameters use a
+# dimension named after the parameter.
+DIMENSIONS = {
+    # ADCP (Teledyne RDI WorkHorse) depth cells
+    'eastward': 'cells',
+    'northward': 'cells',
+    'vertical': 'cells',
+    'error': 'cells',
+    'magnitude_beam1': 'cells',
+    'magnitude_beam2': 'cells',
+    'magnitude_beam3': 'cells',
+    'magnitude_beam4': 'cells',
+    'intensity_beam1': 'cells',
+    'intensity_beam2': 'cells',
+    'intensity_beam3': 'cells',
+    'intensity_beam4': 'cells',
+    'good_3beam': 'cells',
+    'transforms_reject': 'cells',
+    'bad_beams': 'cells',
+    'good_4beam': 'cells',
+    # OPTAA (WET Labs AC-S) wavelengths
+    'a_reference_raw': 'wavelengths',
+    'a_signal_raw': 'wavelengths',
+    'c_reference_raw': 'wavelengths',
+    'c_signal_raw': 'wavelengths',
+    # NUTNR (Satlantic SUNA) and SPKIR (Satlantic OCR-507) channels
+    'channel_measurements': 'channels',
+    'raw_channels': 'channels',
+    # ZPLSC (ASL AZFP) bins and frequencies
+    'profiles_freq1': 'bins_freq1',
+    'profiles_freq2': 'bins_freq2',
+    'profiles_freq3': 'bins_freq3',
+    'profiles_freq4': 'bins_freq4',
+    'frequencies': 'frequencies',
+    'minimum_values': 'frequencies',
+    # VEL3D and VELPT (Nortek Vector and Aquadopp) beams
+    'amplitudes': 'beams',
+    'correlations': 'beams',
+    'noise_amplitudes': 'beams',
+    'noise_correlations': 'beams'
+}
+
+# CF attributes for the time variables
+TIME_ATTRIBUTES = {
+    'standard_name': 'time',
+    'long_name': 'Time',
+    'units': 'seconds since 1970-01-01 00:00:00 0:00',
+    'calendar': 'gregorian',
+    'axis': 'T'
+}
+
+
+def _as_array(value):
+    '''
+    Convert a column into a NumPy array, returning None if the records differ
+    in shape.
+    '''
+    try:
+        array = np.asarray(value)
+    except ValueError:
+        return None
+
+    if array.dtype == object:
+        return None
+    if array.dtype == bool:
+        array = array.astype('i1')
+
+    return array
+
+
+def _as_ragged(value):
+    '''
+    Convert a column of numeric vectors that differ in length (e.g. the ZPLSC
+    profiles, where the number of bins can change from burst to burst) into a
+    2D array padded with the fill value, returning the array, the fill value
+    and the length of each vector. Returns None if the records are not all
+    numeric vectors.
+    '''
+    try:
+        vectors = [np.asarray(v) for v in value]
+    except ValueError:
+        return None
+
+    if not vectors or any(v.ndim != 1 or v.dtype.kind not in 'biuf' for v in vectors):
+        return None
+
+    lengths = np.array([v.size for v in vectors], dtype='i4')
+    dtype = np.result_type(*[v.dtype for v in vectors if v.size] or [np.float64])
+    if dtype == bool:
+        dtype = np.dtype('i1')
+
+    fill = default_fillvals[dtype.str[1:]]
+    array = np.full((len(vectors), lengths.max()), fill, dtype=dtype)
+    for i, v in enumerate(vectors):
+        array[i, :v.size] = v
+
+    return array, fill, lengths
+
+
+def _dimensions(group, name, shape, record_dim='time'):
+    '''
+    Return the dimensions of a variable, creating any needed beyond the record
+    dimension (time, the unlimited dimension, unless the column does not hold
+    a value for every record).
+    '''
+    if record_dim != 'time' and record_dim not in group.dimensions:
+        group.createDimension(record_dim, shape[0])
+
+    dims = [record_dim]
+    for axis, size in enumerate(shape[1:], 1):
+        dim = '%s_dim%d' % (name, axis)
+        if axis == 1 and name in DIMENSIONS:
+            dim = DIMENSIONS[name]
+            if dim in group.dimensions and len(group.dimensions[dim]) != size:
+                # the same dimension name with a different size
+                dim = '%s_%s' % (name, dim)
+
+        if dim not in group.dimensions:
+            group.createDimension(dim, size)
+        dims.append(dim)
+
+    return tuple(dims)
+
+
+def _chunks(shape, itemsize):
+    '''
+    Return the chunk sizes for a variable, with each chunk holding whole
+    records and up to about CHUNK_BYTES of data.
+    '''
+    record = itemsize * int(np.prod(shape[1:]))
+    rows = max(1, min(shape[0], CHUNK_BYTES // max(1, record)))
+    return (rows,) + tuple(max(1, n) for n in shape[1:])
+
+
+def _create_variable(group, name, array, record_dim, fill=None):
+    '''
+    Create a chunked and compressed variable in the group and save the array
+    to it.
+    '''
+    dims = _dimensions(group, name, array.shape, record_dim)
+    var = group.createVariable(name, array.dtype, dims, fill_value=fill,
+                               chunksizes=_chunks(array.shape, array.dtype.itemsize),
+                               **COMPRESSION)
+    if array.size:
+        var[:] = array
+
+    return var
+
+
+def _write_variable(group, name, value, record_dim='time'):
+    '''
+    Add a column of the parsed data to the group as a variable.
+    '''
+    array = _as_array(value)
+    if array is None:
+        ragged = _as_ragged(value)
+        if ragged is not None:
+            # numeric vectors that differ in length are padded with the fill
+            # value, with the length of each saved in its own variable
+            array, fill, lengths = ragged
+            _create_variable(group, name, array, record_dim, fill)
+            _create_variable(group, name + '_length', lengths, record_dim)
+            return
+
+        # anything else is saved as JSON strings
+        strings = [json.dumps(v, default=lambda obj: obj.tolist()) for v in value]
+        var = group.createVariable(name, str, _dimensions(group, name, (len(strings),), record_dim))
+        var.encoding = 'json'
+        if strings:
+            var[:] = np.array(strings, dtype=object)
+        return
+
+    if array.dtype.kind in 'SU':
+        # strings (e.g. the DCL date and time strings) are saved as fixed
+        # width character arrays, with the string length as the last dimension
+        if array.dtype.kind == 'U':
+            array = np.char.encode(array, 'utf-8')
+        width = max(1, array.dtype.itemsize)
+        chars = stringtochar(array.astype('S%d' % width))
+        dim = 'strlen%d' % width
+        if dim not in group.dimensions:
+            group.createDimension(dim, width)
+
+        dims = _dimensions(group, name, array.shape, record_dim) + (dim,)
+        var = group.createVariable(name, 'S1', dims, chunksizes=_chunks(chars.shape, 1), **COMPRESSION)
+        var._Encoding = 'utf-8'
+        if array.size:
+            var[:] = chars
+        return
+
+    var = _create_variable(group, name, array, record_dim)
+    if name == 'time':
+        var.setncatts(TIME_ATTRIBUTES)
+
+
+def _write_group(group, data, records=None):
+    '''
+    Add the columns of the parsed data to the group, with nested stores (e.g.
+    the ADCP or VEL3D data types) added as sub-groups. Stores without a time
+    column share the time dimension of their parent. Columns that do not hold
+    a value for every record (e.g. the VELPT diagnostics header, where the
+    last header may not be followed by any diagnostics) are given their own
+    record dimension, rather than being padded out to the length of time.
+    '''
+    if 'time' in data or group.parent is None:
+        group.createDimension('time', None)
+    if 'time' in data:
+        records = len(data['time'])
+
+    for name in sorted(data.keys()):
+        value = data[name]
+        if isinstance(value, dict):
+            _write_group(group.createGroup(name), value, records)
+            continue
+
+        if records is None:
+            records = len(value)
+        dim = 'time' if len(value) == records else '%s_records' % name
+        _write_variable(group, name, value, dim)
+
+
+def write_netcdf(data, outfile, attributes=None):
+    '''
+    Write the parsed data (a Bunch or ColumnStore) to a NetCDF4 file, with time
+    as the unlimited dimension and vector parameters saved as 2D variables.
+    Numeric variables are chunked and compressed. Optional global attributes
+    can be added via the attributes dictionary.
+    '''
+    if Dataset is None:
+        raise ImportError('The netCDF4 package is needed to write NetCDF files')
+
+    nc = Dataset(outfile, 'w', format='NETCDF4')
+    try:
+        nc.Conventions = 'CF-1.6'
+        for name, value in sorted((attributes or {}).items()):
+            nc.setncattr(name, value)
+
+        _write_group(nc, data)
+    finally:
+        nc.close()
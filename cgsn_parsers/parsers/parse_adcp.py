@@ -6,7 +6,7 @@
 @author Christopher Wingard
 @brief Parses Teledyne RDI WorkHorse ADCP data, reported as an ASCIIHEX string
     (in PD0 format) to the DCL with a DCL timestamp prepended to the record
-    string.
+    string, or recorded internally by the ADCP as binary PD0 data.
 
 Release notes:
     This code evolved from earlier work by Roger Unwin at the University of
@@ -17,13 +17,15 @@ Release notes:
 import os
 import re
 
-from binascii import unhexlify
-from munch import Munch as Bunch
+import numpy as np
+
+from binascii import hexlify, unhexlify
 from struct import unpack
 
 # Import common utilites and base classes
-from cgsn_parsers.parsers.common import ParserCommon
-from cgsn_parsers.parsers.common import dcl_to_epoch, inputs, DCL_TIMESTAMP, NEWLINE
+from cgsn_parsers.parsers.checksum import as_bytes, check_byte_sums, stored_checksums
+from cgsn_parsers.parsers.common import ColumnStore, ParserCommon
+from cgsn_parsers.parsers.common import dcl_to_epoch_array, inputs, run_parser, DCL_TIMESTAMP, NEWLINE
 
 # Regex set to find the start of a PD0 packet (DCL timestamp and the first 6
 # bytes of the header data). Using the first 6 bytes of the packet is a more
@@ -36,6 +38,18 @@ PATTERN = (
 )
 REGEX = re.compile(PATTERN, re.DOTALL)
 
+# Regex set to find the start of an ensemble in binary PD0 data, using the
+# same first 6 bytes of the header.
+BINARY_PATTERN = b'\x7f\x7f[\x00-\xff]{2}\x00[\x06\x07]'
+BINARY_REGEX = re.compile(BINARY_PATTERN, re.DOTALL)
+
+# Largest possible ensemble (the number of bytes is an unsigned short, plus
+# the 2 byte checksum)
+MAX_ENSEMBLE = 65537
+
+# Amount of data (in bytes) used to tell binary PD0 data from a DCL log
+SNIFF_BYTES = 64 * 1024
+
 
 class ParameterNames(object):
     '''
@@ -186,50 +200,148 @@ class ParameterNames(object):
             'good_4beam'
         ]
 
+        # Data types of the per-cell velocity, correlation magnitude, echo
+        # intensity and percent good data (all other parameters are held in
+        # lists).
+        self._types = {
+            'time': 'f8',
+            'fixed_index': 'i4',
+            'eastward': 'i2',
+            'northward': 'i2',
+            'vertical': 'i2',
+            'error': 'i2',
+            'magnitude_beam1': 'u1',
+            'magnitude_beam2': 'u1',
+            'magnitude_beam3': 'u1',
+            'magnitude_beam4': 'u1',
+            'intensity_beam1': 'u1',
+            'intensity_beam2': 'u1',
+            'intensity_beam3': 'u1',
+            'intensity_beam4': 'u1',
+            'good_3beam': 'u1',
+            'transforms_reject': 'u1',
+            'bad_beams': 'u1',
+            'good_4beam': 'u1'
+        }
+
     # Create the initial dictionary object from the fixed, variable, velocity,
     # correlation magnitude, echo intensity and percent good data types. Note,
     # while it is possible that a pd0 data file may only contain the fixed and
     # variable data types, it really wouldn't make much sense. Thus, we can
     # assume that velocity, correlation, intensity and percent data is present
     # as the default.
+    #
+    # The fixed leader data only changes when the instrument is reconfigured,
+    # so rather than repeating it for every ensemble, the fixed data type holds
+    # one record for each distinct configuration (with the time it was first
+    # seen), and fixed_index gives the configuration used by each ensemble (-1
+    # if the ensemble has no fixed leader). Use expand_fixed to recreate the
+    # fixed leader data for each ensemble.
     def create_dict(self):
         '''
-        Create a Bunch class object to store the parameter names for the
-        Workhorse ADCP pd0 data files, with the data organized hierarchically
-        by the data type.
+        Create a ColumnStore (Bunch) class object to store the parameter names
+        for the Workhorse ADCP pd0 data files, with the data organized
+        hierarchically by the data type.
         '''
-        bunch = Bunch()
-        bunch.time = []
-        bunch.header = Bunch()
-        bunch.fixed = Bunch()
-        bunch.variable = Bunch()
-        bunch.velocity = Bunch()
-        bunch.correlation = Bunch()
-        bunch.echo = Bunch()
-        bunch.percent = Bunch()
-
-        for name in self._header:
-            bunch.header[name] = []
+        bunch = ColumnStore()
+        bunch.add_columns(['time', 'fixed_index'], self._types)
+        bunch.header = ColumnStore()
+        bunch.fixed = ColumnStore()
+        bunch.variable = ColumnStore()
+        bunch.velocity = ColumnStore()
+        bunch.correlation = ColumnStore()
+        bunch.echo = ColumnStore()
+        bunch.percent = ColumnStore()
+
+        bunch.header.add_columns(self._header, self._types)
+        bunch.fixed.add_columns(['time'] + self._fixed, self._types)
+        bunch.variable.add_columns(self._variable, self._types)
+        bunch.velocity.add_columns(self._velocity, self._types)
+        bunch.correlation.add_columns(self._correlation, self._types)
+        bunch.echo.add_columns(self._echo, self._types)
+        bunch.percent.add_columns(self._percent, self._types)
 
-        for name in self._fixed:
-            bunch.fixed[name] = []
+        return bunch
 
-        for name in self._variable:
-            bunch.variable[name] = []
 
-        for name in self._velocity:
-            bunch.velocity[name] = []
+def _struct_dtype(fmt, names):
+    '''
+    Create a NumPy structured dtype equivalent to a struct format string (e.g.
+    '<2BH'), with the fields named in order. Names starting with an underscore
+    are used for the reserved bytes.
+    '''
+    codes = {'B': 'u1', 'b': 'i1', 'H': 'u2', 'h': 'i2', 'I': 'u4', 'i': 'i4', 'Q': 'u8'}
+    types = []
+    for count, code in re.findall(r'(\d*)([BbHhIiQ])', fmt[1:]):
+        types += [fmt[0] + codes[code]] * int(count or 1)
+
+    return np.dtype(zip(names, types))
+
+
+# Fixed leader data (data type 0x0000, 59 bytes)
+FIXED_LEADER = _struct_dtype('<H2BH4B3H4BH4B2h2B2H4BHQH2BIB', [
+    'fixed_leader_id', 'firmware_version', 'firmware_revision', 'sysconfig', 'data_flag',
+    'lag_length', 'num_beams', 'num_cells', 'pings_per_ensemble', 'depth_cell_length',
+    'blank_after_transmit', 'signal_processing_mode', 'low_corr_threshold', 'num_code_repetitions',
+    'percent_good_min', 'error_vel_threshold', 'time_per_ping_minutes', 'time_per_ping_seconds',
+    'time_per_ping_hundredths', 'coord_transform_type', 'heading_alignment', 'heading_bias',
+    'sensor_source', 'sensor_available', 'bin_1_distance', 'transmit_pulse_length',
+    'reference_layer_start', 'reference_layer_stop', 'false_target_threshold', '_spare1',
+    'transmit_lag_distance', '_spare2', 'system_bandwidth', '_spare3', '_spare4', 'serial_number',
+    'beam_angle'
+])
+
+# Variable leader data (data type 0x0080, 65 bytes)
+VARIABLE_LEADER = _struct_dtype('<2H10B3H2hHh18BH2I9B', [
+    'variable_leader_id', 'ensemble_number', 'rtc1_year', 'rtc1_month', 'rtc1_day', 'rtc1_hour',
+    'rtc1_minute', 'rtc1_second', 'rtc1_hundredths', 'ensemble_number_increment', 'error_bit_field',
+    '_reserved_error_bit_field', 'speed_of_sound', 'transducer_depth', 'heading', 'pitch', 'roll',
+    'salinity', 'temperature', 'mpt_minutes', 'mpt_seconds', 'mpt_hundredths', 'heading_stdev',
+    'pitch_stdev', 'roll_stdev', 'adc_transmit_current', 'adc_transmit_voltage', 'adc_ambient_temp',
+    'adc_pressure_plus', 'adc_pressure_minus', 'adc_attitude_temp', 'adc_attitude',
+    'adc_contamination_sensor', 'error_status_word_1', 'error_status_word_2', 'error_status_word_3',
+    'error_status_word_4', '_spare1', 'pressure', 'pressure_variance', '_spare2', 'rtc2_century',
+    'rtc2_year', 'rtc2_month', 'rtc2_day', 'rtc2_hour', 'rtc2_minute', 'rtc2_second', 'rtc2_hundredths'
+])
+
+# Data type IDs found at the start of each of the data types in an ensemble
+FIXED_ID = b'\x00\x00'
+VARIABLE_ID = b'\x80\x00'
+CELL_IDS = {
+    b'\x00\x01': ('velocity', '<i2'),
+    b'\x00\x02': ('correlation', 'u1'),
+    b'\x00\x03': ('echo', 'u1'),
+    b'\x00\x04': ('percent', 'u1')
+}
+
+# System frequencies (kHz), indexed by the lower 3 bits of the system configuration
+FREQUENCIES = np.array([75, 150, 300, 600, 1200, 2400])
+
+
+def _bit(values, bit):
+    '''
+    Return 1 where the bit is set in the values, 0 otherwise.
+    '''
+    return (values >> bit) & 1
 
-        for name in self._correlation:
-            bunch.correlation[name] = []
 
-        for name in self._echo:
-            bunch.echo[name] = []
+def _layout(ensemble):
+    '''
+    Return the layout of an ensemble: the length of the ensemble, the header
+    (with the offsets to the data types), the data type IDs and the number of
+    depth cells (set in the fixed leader). Ensembles with the same layout can
+    be decoded together.
+    '''
+    num_data_types = ord(ensemble[5])
+    header = ensemble[:6 + 2 * num_data_types]
+    offsets = unpack('<%dH' % num_data_types, header[6:])
+    ids = tuple(ensemble[offset:offset + 2] for offset in offsets)
 
-        for name in self._percent:
-            bunch.percent[name] = []
+    num_cells = None
+    if FIXED_ID in ids:
+        num_cells = ord(ensemble[offsets[ids.index(FIXED_ID)] + 9])
 
-        return bunch
+    return len(ensemble), header, ids, num_cells
 
 
 class Parser(ParserCommon):
@@ -237,404 +349,469 @@ class Parser(ParserCommon):
     A Parser class that extracts the data records from a PD0 data packet
     formatted in ASCIIHEX produced by a Teledyne RDI Workhorse ADCP.
     """
+    # PD0 ensemble header ID and data source ID, found in every record
+    _signature = b'7F7F'
+
+    # the fixed leaders (as hex strings) of the configurations already added to
+    # the data, carried from one batch to the next in append mode
+    _state = ['_configurations']
+
     def __init__(self, infile):
         # set the infile name and path
         self.infile = infile
 
         # initialize the data dictionary using the names defined above
-        data = ParameterNames()
-        self.data = data.create_dict()
+        self._parameter_names = ParameterNames()
+        self.data = self._parameter_names.create_dict()
         self.raw = None
+        self._configurations = []
 
     def parse_data(self):
         '''
-        Iterate through the record markers (defined via the regex expression
-        above) in the data object, and parse the data file into a pre-defined
+        Parse the ensembles from either a DCL log file (ASCIIHEX records) or a
+        binary PD0 data file, detected from the data, into a pre-defined
         dictionary object created using the Bunch class.
         '''
-        for line in self.raw:
-            match = REGEX.match(line)
-            if match:
-                self._build_parsed_values(match)
+        if is_binary(_head(self.raw)):
+            self._parse_binary()
+        else:
+            self._parse_asciihex()
 
-    # Parse the ADCP ensembles, building a full, parsed record
-    def _build_parsed_values(self, match):
-        """
-        Start by parsing the beginning portion of the ensemble (Header Data)
-        """
-        # build the ensemble string from match.group(2) through to the end.
-        length = unpack("<H", unhexlify(match.group(3)))[0]
-        ensemble = unhexlify(''.join(match.groups()[1:]))
-
-        # Calculate the checksum
-        total = int(0)
-        for i in range(0, length):
-            total += int(ord(ensemble[i]))
-
-        checksum = total & 65535    # bitwise and with 65535 or mod vs 65536
-        if checksum != unpack("<H", ensemble[length: length+2])[0]:
-            raise Exception("Checksum mismatch")
-
-        (header_id, data_source_id, num_bytes, spare, num_data_types) = \
-            unpack('<2BH2B', ensemble[0:6])
-
-        self.data.time.append(dcl_to_epoch(match.group(1)))
-        self.data.header.num_bytes.append(num_bytes)
-        self.data.header.num_data_types.append(num_data_types)
-
-        offsets = []    # create list for offsets
-        strt = 6        # offsets start at byte 6 (using 0 indexing)
-        nDT = 1         # counter for N data types
-        while nDT <= num_data_types:
-            value = unpack('<H', ensemble[strt:strt+2])[0]
-            offsets.append(value)
-            strt += 2
-            nDT += 1
-
-        for offset in offsets:
-            # for each offset, using the starting byte, determine the data type
-            # and then parse accordingly.
-            data_type = unpack('<H', ensemble[offset:offset+2])[0]
-
-            # fixed leader data (x00x00)
-            if data_type == 0:
-                chunk = ensemble[offset:offset+59]
-                self._parse_fixed_chunk(chunk)
-                iCells = self.num_depth_cells   # grab the # of depth cells
-
-            # variable leader data (x80x00)
-            if data_type == 128:
-                chunk = ensemble[offset:offset+65]
-                self._parse_variable_chunk(chunk)
-
-            # velocity data (x00x01)
-            if data_type == 256:
-                # number of bytes is a function of the user selectable number
-                # of depth cells (WN command), obtained above
-                nBytes = 2 + 8 * iCells
-                chunk = ensemble[offset:offset+nBytes]
-                self._parse_velocity_chunk(chunk)
-
-            # correlation magnitude data (x00x02)
-            if data_type == 512:
-                # number of bytes is a function of the user selectable number
-                # of depth cells (WN command), obtained above
-                nBytes = 2 + 4 * iCells
-                chunk = ensemble[offset:offset+nBytes]
-                self._parse_corelation_magnitude_chunk(chunk)
-
-            # echo intensity data (x00x03)
-            if data_type == 768:
-                # number of bytes is a function of the user selectable number
-                # of depth cells (WN command), obtained above
-                nBytes = 2 + 4 * iCells
-                chunk = ensemble[offset:offset+nBytes]
-                self._parse_echo_intensity_chunk(chunk)
-
-            # percent-good data (x00x04)
-            if data_type == 1024:
-                # number of bytes is a function of the user selectable number
-                # of depth cells (WN command), obtained above
-                nBytes = 2 + 4 * iCells
-                chunk = ensemble[offset:offset+nBytes]
-                self._parse_percent_good_chunk(chunk)
-
-    def _parse_fixed_chunk(self, chunk):
+    def _parse_asciihex(self):
+        '''
+        Iterate through the record markers (defined via the regex expression
+        above) in the data object, collecting the ASCIIHEX records, and then
+        convert all of the records to binary in a single pass. The ensembles
+        are then framed and decoded in the same way as the binary data, using
+        the DCL timestamp of the record each ensemble starts in as its time.
+        '''
+        timestamps = []
+        records = []
+        for match in self.iter_matches(REGEX):
+            record = match.string[match.start(2):match.end(6)]
+            if len(record) % 2:
+                # a record cut short by a dropped character
+                self.metrics.count('rejected_size')
+                continue
+            records.append(record)
+            timestamps.append(match.group(1))
+
+        buf = unhexlify(''.join(records))
+        starts, stops = self._frame_ensembles(buf)
+        first, rtc = self._decode_ensembles([buf[start:stop] for start, stop in zip(starts, stops)])
+
+        # convert the DCL timestamps into epoch timestamps (seconds since
+        # 1970-01-01) in a single pass, using the time of the first ensemble
+        # with each new configuration as the time of the configuration
+        offsets = np.cumsum([0] + [len(record) // 2 for record in records])
+        epts = dcl_to_epoch_array(timestamps)[np.searchsorted(offsets, starts, side='right') - 1]
+        self.data.time.extend(epts)
+        self.data.fixed.time.extend(epts[first])
+
+    def _parse_binary(self):
+        '''
+        Frame and decode the ensembles in binary PD0 data, using the real time
+        clock in the variable leader as the time of each ensemble.
+        '''
+        buf = b''.join(self.raw) if isinstance(self.raw, list) else self.raw
+        with self.metrics.timer('scan'):
+            starts, stops = self._frame_ensembles(buf, count=True)
+
+        first, rtc = self._decode_ensembles([buf[start:stop] for start, stop in zip(starts, stops)])
+        self.data.time.extend(rtc)
+        self.data.fixed.time.extend(rtc[first])
+
+    def _frame_ensembles(self, buf, count=False):
+        '''
+        Find the ensembles in a buffer of binary PD0 data, returning their
+        start and stop offsets. See frame_ensembles. The candidates found by
+        their header bytes are counted as scanned and matched if count is set
+        (they are already counted as lines for the ASCIIHEX records), with
+        those failing the checksum counted as rejected.
+        '''
+        starts, stops, examined = frame_ensembles(buf)
+        if count:
+            self.metrics.count('scanned', examined)
+            self.metrics.count('matched', examined)
+        self.metrics.count('rejected_checksum', examined - len(starts))
+        return starts, stops
+
+    def _split_batch(self, buf):
+        '''
+        Split the block of data read in by iter_batches after the last
+        complete line, or for binary PD0 data after the last complete
+        ensemble (carrying over at most the size of the largest possible
+        ensemble).
+        '''
+        if not is_binary(buf[:SNIFF_BYTES]):
+            return buf.rfind(b'\n') + 1
+
+        starts, stops, examined = frame_ensembles(buf)
+        stop = stops[-1] if len(stops) else 0
+        return max(stop, len(buf) - MAX_ENSEMBLE)
+
+    def _decode_ensembles(self, ensembles):
+        '''
+        Decode a list of PD0 ensembles (as binary strings). The ensembles are
+        grouped by their layout (see _layout), with the ensembles in a group
+        stacked into a 2D array of bytes and each data type decoded for the
+        whole group at once using NumPy structured dtypes. The results for
+        each group are then combined, in the order of the ensembles, and
+        added to the data dictionary.
+
+        Returns the positions of the ensembles with a new configuration (see
+        _index_fixed), and the times of the ensembles from the real time clock
+        in the variable leader (NaN for ensembles without one).
+        '''
+        groups = {}
+        for i, ensemble in enumerate(ensembles):
+            groups.setdefault(_layout(ensemble), []).append(i)
+
+        columns = {}
+        leaders = np.zeros((len(ensembles), FIXED_LEADER.itemsize), dtype=np.uint8)
+        present = np.zeros(len(ensembles), dtype=bool)
+        rtc = np.full(len(ensembles), np.nan)
+        for layout, indices in groups.items():
+            raw = np.frombuffer(b''.join([ensembles[i] for i in indices]), dtype=np.uint8)
+            raw = raw.reshape(len(indices), layout[0])
+            for (section, name), values in self._decode_group(layout, raw):
+                if (section, name) == (None, 'fixed'):
+                    # the raw bytes of the fixed leaders
+                    leaders[indices] = values
+                    present[indices] = True
+                    continue
+                if (section, name) == (None, 'time'):
+                    rtc[indices] = values
+                    continue
+                columns.setdefault((section, name), []).append((indices, values))
+
+        first = self._index_fixed(leaders, present)
+
+        for (section, name), parts in columns.items():
+            column = self.data[section][name]
+            values = _combine(parts)
+            if isinstance(column, list):
+                values = values.tolist() if isinstance(values, np.ndarray) else values
+            column.extend(values)
+
+        return first, rtc
+
+    def _index_fixed(self, leaders, present):
+        '''
+        Set the configuration (the index into the fixed data type) used by each
+        ensemble from the raw bytes of the fixed leaders, adding the fixed
+        leaders not seen before to the fixed data type. Only the ensembles
+        where the fixed leader differs from the one before are looked up, and
+        only the new configurations are decoded.
+
+        Returns the positions of the ensembles with a new configuration.
+        '''
+        index = np.full(len(leaders), -1, dtype=np.int32)
+        rows = np.flatnonzero(present)
+        leaders = leaders[rows]
+        changes = np.flatnonzero(np.concatenate([[True], (leaders[1:] != leaders[:-1]).any(axis=1)]))
+        changes = changes[changes < len(rows)]
+
+        known = dict((unhexlify(leader), i) for i, leader in enumerate(self._configurations))
+        configurations = []
+        new = []
+        for i in changes:
+            leader = leaders[i].tostring()
+            if leader not in known:
+                known[leader] = len(self._configurations)
+                self._configurations.append(hexlify(leader))
+                new.append(i)
+            configurations.append(known[leader])
+
+        # each configuration is used until the next change
+        index[rows] = np.repeat(configurations, np.diff(np.append(changes, len(rows))))
+        self.data.fixed_index.extend(index)
+
+        if new:
+            leader = np.ascontiguousarray(leaders[new]).view(FIXED_LEADER).ravel()
+            for (section, name), values in self._parse_fixed(leader):
+                self.data.fixed[name].extend(values.tolist())
+
+        return rows[new]
+
+    def _decode_group(self, layout, raw):
+        '''
+        Decode a group of ensembles with the same layout (held in a 2D array of
+        bytes, one row per ensemble), returning the values for each parameter
+        as a list of ((section, name), values) pairs.
+        '''
+        size, header, ids, num_cells = layout
+        length = unpack('<H', header[2:4])[0]
+        num_data_types = ord(header[5])
+        results = [
+            (('header', 'num_bytes'), np.full(len(raw), length, dtype=np.int64)),
+            (('header', 'num_data_types'), np.full(len(raw), num_data_types, dtype=np.int64))
+        ]
+
+        offsets = unpack('<%dH' % num_data_types, header[6:])
+        for offset, data_id in zip(offsets, ids):
+            if data_id == FIXED_ID:
+                # the fixed leaders are only decoded for each new configuration
+                _check_size(raw, offset, FIXED_LEADER)
+                results.append(((None, 'fixed'), raw[:, offset:offset + FIXED_LEADER.itemsize]))
+
+            elif data_id == VARIABLE_ID:
+                leader = _view(raw, offset, VARIABLE_LEADER)
+                results += self._parse_variable(leader)
+                results.append(((None, 'time'), _rtc_to_epoch(leader)))
+
+            elif data_id in CELL_IDS:
+                # the number of bytes is a function of the user selectable
+                # number of depth cells (WN command), set in the fixed leader
+                if num_cells is None:
+                    raise Exception("depth cell data found without the fixed leader data")
+
+                section, dtype = CELL_IDS[data_id]
+                dtype = np.dtype(dtype)
+                cells = min(num_cells, (size - offset - 2) // (4 * dtype.itemsize))
+                start = offset + 2
+                data = np.ascontiguousarray(raw[:, start:start + 4 * cells * dtype.itemsize])
+                data = data.view(dtype).reshape(len(raw), cells, 4)
+                for beam, name in enumerate(getattr(self._parameter_names, '_' + section)):
+                    results.append(((section, name), data[:, :, beam]))
+
+        return results
+
+    def _parse_fixed(self, leader):
         """
-        Parse the fixed leader portion of the particle
+        Parse the fixed leader portion of a group of ensembles
 
         @throws Exception If there is a problem with sample creation
         """
-        (fixed_leader_id, firmware_version, firmware_revision,
-         sysconfig_frequency, data_flag, lag_length, num_beams, num_cells,
-         pings_per_ensemble, depth_cell_length, blank_after_transmit,
-         signal_processing_mode, low_corr_threshold, num_code_repetitions,
-         percent_good_min, error_vel_threshold, time_per_ping_minutes,
-         time_per_ping_seconds, time_per_ping_hundredths, coord_transform_type,
-         heading_alignment, heading_bias, sensor_source, sensor_available,
-         bin_1_distance, transmit_pulse_length, reference_layer_start,
-         reference_layer_stop, false_target_threshold, SPARE1,
-         transmit_lag_distance, SPARE2, system_bandwidth,
-         SPARE3, SPARE4, serial_number, beam_angle) = \
-            unpack('<H2BH4B3H4BH4B2h2B2H4BHQH2BIB', chunk)
-
-        if 0 != fixed_leader_id:
-            raise Exception("fixed_leader_id was not equal to 0")
-
-        # store the number of depth cells for use elsewhere
-        self.num_depth_cells = num_cells
-
-        self.data.fixed.firmware_version.append(firmware_version)
-        self.data.fixed.firmware_revision.append(firmware_revision)
-
-        frequencies = [75, 150, 300, 600, 1200, 2400]
-
-        self.data.fixed.sysconfig_frequency.append(frequencies[sysconfig_frequency & 0b00000111])
-        self.data.fixed.sysconfig_beam_pattern.append(1 if sysconfig_frequency & 0b00001000 else 0)
-        self.data.fixed.sysconfig_sensor_config.append(sysconfig_frequency & 0b00110000 >> 4)
-        self.data.fixed.sysconfig_head_attached.append(1 if sysconfig_frequency & 0b01000000 else 0)
-        self.data.fixed.sysconfig_vertical_orientation.append(1 if sysconfig_frequency & 0b10000000 else 0)
-
-        if 0 != data_flag:
+        if (leader['data_flag'] != 0).any():
             raise Exception("data_flag was not equal to 0")
 
-        self.data.fixed.data_flag.append(data_flag)
-        self.data.fixed.lag_length.append(lag_length)
-        self.data.fixed.num_beams.append(num_beams)
-        self.data.fixed.num_cells.append(num_cells)
-        self.data.fixed.pings_per_ensemble.append(pings_per_ensemble)
-        self.data.fixed.depth_cell_length.append(depth_cell_length)
-        self.data.fixed.blank_after_transmit.append(blank_after_transmit)
-
-        if 1 != signal_processing_mode:
+        if (leader['signal_processing_mode'] != 1).any():
             raise Exception("signal_processing_mode was not equal to 1")
 
-        self.data.fixed.signal_processing_mode.append(signal_processing_mode)
-        self.data.fixed.low_corr_threshold.append(low_corr_threshold)
-        self.data.fixed.num_code_repetitions.append(num_code_repetitions)
-        self.data.fixed.percent_good_min.append(percent_good_min)
-        self.data.fixed.error_vel_threshold.append(error_vel_threshold)
-        self.data.fixed.time_per_ping_minutes.append(time_per_ping_minutes)
-
-        tpp_float_seconds = float(time_per_ping_seconds + (time_per_ping_hundredths/100))
-        self.data.fixed.time_per_ping_seconds.append(tpp_float_seconds)
-        self.data.fixed.coord_transform_type.append(coord_transform_type & 0b00011000 >> 3)
-        self.data.fixed.coord_transform_tilts.append(1 if coord_transform_type & 0b00000100 else 0)
-        self.data.fixed.coord_transform_beams.append(1 if coord_transform_type & 0b0000000 else 0)
-        self.data.fixed.coord_transform_mapping.append(1 if coord_transform_type & 0b00000001 else 0)
-
-        # lame, but expedient - mask off un-needed bits
-        self.coord_transform_type = (coord_transform_type & 0b00011000) >> 3
-
-        self.data.fixed.heading_alignment.append(heading_alignment)
-        self.data.fixed.heading_bias.append(heading_bias)
-        self.data.fixed.sensor_source_speed.append(1 if sensor_source & 0b01000000 else 0)
-        self.data.fixed.sensor_source_depth.append(1 if sensor_source & 0b00100000 else 0)
-        self.data.fixed.sensor_source_heading.append(1 if sensor_source & 0b00010000 else 0)
-        self.data.fixed.sensor_source_pitch.append(1 if sensor_source & 0b00001000 else 0)
-        self.data.fixed.sensor_source_roll.append(1 if sensor_source & 0b00000100 else 0)
-        self.data.fixed.sensor_source_conductivity.append(1 if sensor_source & 0b00000010 else 0)
-        self.data.fixed.sensor_source_temperature.append(1 if sensor_source & 0b00000001 else 0)
-        self.data.fixed.sensor_available_depth.append(1 if sensor_available & 0b00100000 else 0)
-        self.data.fixed.sensor_available_heading.append(1 if sensor_available & 0b00010000 else 0)
-        self.data.fixed.sensor_available_pitch.append(1 if sensor_available & 0b00001000 else 0)
-        self.data.fixed.sensor_available_roll.append(1 if sensor_available & 0b00000100 else 0)
-        self.data.fixed.sensor_available_conductivity.append(1 if sensor_available & 0b00000010 else 0)
-        self.data.fixed.sensor_available_temperature.append(1 if sensor_available & 0b00000001 else 0)
-        self.data.fixed.bin_1_distance.append(bin_1_distance)
-        self.data.fixed.transmit_pulse_length.append(transmit_pulse_length)
-        self.data.fixed.reference_layer_start.append(reference_layer_start)
-        self.data.fixed.reference_layer_stop.append(reference_layer_stop)
-        self.data.fixed.false_target_threshold.append(false_target_threshold)
-        self.data.fixed.transmit_lag_distance.append(transmit_lag_distance)
-        self.data.fixed.system_bandwidth.append(system_bandwidth)
-        self.data.fixed.serial_number.append(serial_number)
-        self.data.fixed.beam_angle.append(beam_angle)
-
-    def _parse_variable_chunk(self, chunk):
+        sysconfig = leader['sysconfig']
+        coord_transform_type = leader['coord_transform_type']
+        sensor_source = leader['sensor_source']
+        sensor_available = leader['sensor_available']
+        values = {
+            'sysconfig_frequency': FREQUENCIES[sysconfig & 0b00000111],
+            'sysconfig_beam_pattern': _bit(sysconfig, 3),
+            'sysconfig_sensor_config': (sysconfig & 0b00110000) >> 4,
+            'sysconfig_head_attached': _bit(sysconfig, 6),
+            'sysconfig_vertical_orientation': _bit(sysconfig, 7),
+            'time_per_ping_seconds': leader['time_per_ping_seconds'] + leader['time_per_ping_hundredths'] / 100.,
+            'coord_transform_type': (coord_transform_type & 0b00011000) >> 3,
+            'coord_transform_tilts': _bit(coord_transform_type, 2),
+            'coord_transform_beams': _bit(coord_transform_type, 1),
+            'coord_transform_mapping': _bit(coord_transform_type, 0),
+            'sensor_source_speed': _bit(sensor_source, 6),
+            'sensor_source_depth': _bit(sensor_source, 5),
+            'sensor_source_heading': _bit(sensor_source, 4),
+            'sensor_source_pitch': _bit(sensor_source, 3),
+            'sensor_source_roll': _bit(sensor_source, 2),
+            'sensor_source_conductivity': _bit(sensor_source, 1),
+            'sensor_source_temperature': _bit(sensor_source, 0),
+            'sensor_available_depth': _bit(sensor_available, 5),
+            'sensor_available_heading': _bit(sensor_available, 4),
+            'sensor_available_pitch': _bit(sensor_available, 3),
+            'sensor_available_roll': _bit(sensor_available, 2),
+            'sensor_available_conductivity': _bit(sensor_available, 1),
+            'sensor_available_temperature': _bit(sensor_available, 0)
+        }
+
+        return [(('fixed', name), values[name] if name in values else leader[name])
+                for name in self._parameter_names._fixed]
+
+    def _parse_variable(self, leader):
         """
-        Parse the variable leader portion of the particle
+        Parse the variable leader portion of a group of ensembles
 
         @throws Exception If there is a problem with sample creation
         """
-        rtc1 = {}
-        rtc2 = {}
-        (variable_leader_id, ensemble_number, rtc1['year'], rtc1['month'],
-         rtc1['day'], rtc1['hour'], rtc1['minute'], rtc1['second'],
-         rtc1['hundredths'], ensemble_number_increment, error_bit_field,
-         reserved_error_bit_field, speed_of_sound, transducer_depth, heading,
-         pitch, roll, salinity, temperature, mpt_minutes, mpt_seconds_component,
-         mpt_hundredths_component, heading_stdev, pitch_stdev, roll_stdev,
-         adc_transmit_current, adc_transmit_voltage, adc_ambient_temp,
-         adc_pressure_plus, adc_pressure_minus, adc_attitude_temp,
-         adc_attitiude, adc_contamination_sensor, error_status_word_1,
-         error_status_word_2, error_status_word_3, error_status_word_4,
-         SPARE1, pressure, pressure_variance, SPARE2, rtc2['century'],
-         rtc2['year'], rtc2['month'], rtc2['day'], rtc2['hour'], rtc2['minute'],
-         rtc2['second'], rtc2['hundredths']) = \
-            unpack('<2H10B3H2hHh18BH2I9B', chunk)
-
-        if 128 != variable_leader_id:
-            raise Exception("variable_leader_id was not equal to 128")
-
-        self.data.variable.ensemble_number.append(ensemble_number)
-        self.data.variable.ensemble_number_increment.append(ensemble_number_increment)
-
-        self.data.variable.real_time_clock1.append([rtc1['year'], rtc1['month'], rtc1['day'],
-                                                    rtc1['hour'], rtc1['minute'], rtc1['second'],
-                                                    rtc1['hundredths']])
-
-        self.data.variable.bit_result_demod_1.append(1 if error_bit_field & 0b00001000 else 0)
-        self.data.variable.bit_result_demod_2.append(1 if error_bit_field & 0b00010000 else 0)
-        self.data.variable.bit_result_timing.append(1 if error_bit_field & 0b00000010 else 0)
-        self.data.variable.speed_of_sound.append(speed_of_sound)
-        self.data.variable.transducer_depth.append(transducer_depth)
-        self.data.variable.heading.append(heading)
-        self.data.variable.pitch.append(pitch)
-        self.data.variable.roll.append(roll)
-        self.data.variable.salinity.append(salinity)
-        self.data.variable.temperature.append(temperature)
-        self.data.variable.mpt_minutes.append(mpt_minutes)
-
-        mpt_seconds = float(mpt_seconds_component + (mpt_hundredths_component/100))
-        self.data.variable.mpt_seconds.append(mpt_seconds)
-        self.data.variable.heading_stdev.append(heading_stdev)
-        self.data.variable.pitch_stdev.append(pitch_stdev)
-        self.data.variable.roll_stdev.append(roll_stdev)
-        self.data.variable.adc_transmit_current.append(adc_transmit_current)
-        self.data.variable.adc_transmit_voltage.append(adc_transmit_voltage)
-        self.data.variable.adc_ambient_temp.append(adc_ambient_temp)
-        self.data.variable.adc_pressure_plus.append(adc_pressure_plus)
-        self.data.variable.adc_pressure_minus.append(adc_pressure_minus)
-        self.data.variable.adc_attitude_temp.append(adc_attitude_temp)
-        self.data.variable.adc_attitude.append(adc_attitiude)
-        self.data.variable.adc_contamination_sensor.append(adc_contamination_sensor)
-        self.data.variable.bus_error_exception.append(1 if error_status_word_1 & 0b00000001 else 0)
-        self.data.variable.address_error_exception.append(1 if error_status_word_1 & 0b00000010 else 0)
-        self.data.variable.illegal_instruction_exception.append(1 if error_status_word_1 & 0b00000100 else 0)
-        self.data.variable.zero_divide_instruction.append(1 if error_status_word_1 & 0b00001000 else 0)
-        self.data.variable.emulator_exception.append(1 if error_status_word_1 & 0b00010000 else 0)
-        self.data.variable.unassigned_exception.append(1 if error_status_word_1 & 0b00100000 else 0)
-        self.data.variable.watchdog_restart_occurred.append(1 if error_status_word_1 & 0b01000000 else 0)
-        self.data.variable.battery_saver_power.append(1 if error_status_word_1 & 0b10000000 else 0)
-        self.data.variable.pinging.append(1 if error_status_word_1 & 0b00000001 else 0)
-        self.data.variable.cold_wakeup_occurred.append(1 if error_status_word_1 & 0b01000000 else 0)
-        self.data.variable.unknown_wakeup_occurred.append(1 if error_status_word_1 & 0b10000000 else 0)
-        self.data.variable.clock_read_error.append(1 if error_status_word_3 & 0b00000001 else 0)
-        self.data.variable.unexpected_alarm.append(1 if error_status_word_3 & 0b00000010 else 0)
-        self.data.variable.clock_jump_forward.append(1 if error_status_word_3 & 0b00000100 else 0)
-        self.data.variable.clock_jump_backward.append(1 if error_status_word_3 & 0b00001000 else 0)
-        self.data.variable.power_fail.append(1 if error_status_word_4 & 0b00001000 else 0)
-        self.data.variable.spurious_dsp_interrupt.append(1 if error_status_word_4 & 0b00010000 else 0)
-        self.data.variable.spurious_uart_interrupt.append(1 if error_status_word_4 & 0b00100000 else 0)
-        self.data.variable.spurious_clock_interrupt.append(1 if error_status_word_4 & 0b01000000 else 0)
-        self.data.variable.level_7_interrupt.append(1 if error_status_word_4 & 0b10000000 else 0)
-        self.data.variable.pressure.append(pressure)
-        self.data.variable.pressure_variance.append(pressure_variance)
-        self.data.variable.real_time_clock2.append([rtc2['century'], rtc2['year'],
-                                                    rtc2['month'], rtc2['day'],
-                                                    rtc2['hour'], rtc2['minute'],
-                                                    rtc2['second'], rtc2['hundredths']])
-
-    def _parse_velocity_chunk(self, chunk):
-        """
-        Parse the velocity portion of the particle
+        error_bit_field = leader['error_bit_field']
+        word1 = leader['error_status_word_1']
+        word2 = leader['error_status_word_2']
+        word3 = leader['error_status_word_3']
+        word4 = leader['error_status_word_4']
+        values = {
+            'real_time_clock1': _stack(leader, ['rtc1_year', 'rtc1_month', 'rtc1_day', 'rtc1_hour',
+                                                'rtc1_minute', 'rtc1_second', 'rtc1_hundredths']),
+            'bit_result_demod_1': _bit(error_bit_field, 3),
+            'bit_result_demod_2': _bit(error_bit_field, 4),
+            'bit_result_timing': _bit(error_bit_field, 1),
+            'mpt_seconds': leader['mpt_seconds'] + leader['mpt_hundredths'] / 100.,
+            'bus_error_exception': _bit(word1, 0),
+            'address_error_exception': _bit(word1, 1),
+            'illegal_instruction_exception': _bit(word1, 2),
+            'zero_divide_instruction': _bit(word1, 3),
+            'emulator_exception': _bit(word1, 4),
+            'unassigned_exception': _bit(word1, 5),
+            'watchdog_restart_occurred': _bit(word1, 6),
+            'battery_saver_power': _bit(word1, 7),
+            'pinging': _bit(word2, 0),
+            'cold_wakeup_occurred': _bit(word2, 6),
+            'unknown_wakeup_occurred': _bit(word2, 7),
+            'clock_read_error': _bit(word3, 0),
+            'unexpected_alarm': _bit(word3, 1),
+            'clock_jump_forward': _bit(word3, 2),
+            'clock_jump_backward': _bit(word3, 3),
+            'power_fail': _bit(word4, 3),
+            'spurious_dsp_interrupt': _bit(word4, 4),
+            'spurious_uart_interrupt': _bit(word4, 5),
+            'spurious_clock_interrupt': _bit(word4, 6),
+            'level_7_interrupt': _bit(word4, 7),
+            'real_time_clock2': _stack(leader, ['rtc2_century', 'rtc2_year', 'rtc2_month', 'rtc2_day',
+                                                'rtc2_hour', 'rtc2_minute', 'rtc2_second', 'rtc2_hundredths'])
+        }
+
+        return [(('variable', name), values[name] if name in values else leader[name])
+                for name in self._parameter_names._variable]
+
+
+def _head(raw):
+    '''
+    Return the first SNIFF_BYTES of the data, read in either as a list of lines
+    or as a single buffer.
+    '''
+    if not isinstance(raw, list):
+        return raw[:SNIFF_BYTES]
 
-        @throws Exception If there is a problem with sample creation
-        """
-        N = (len(chunk) - 2) / 2 / 4
-        offset = 0
-
-        velocity_data_id = unpack("<H", chunk[0:2])[0]
-        if 256 != velocity_data_id:
-            raise Exception("velocity_data_id was not equal to 256")
-
-        beam1 = []
-        beam2 = []
-        beam3 = []
-        beam4 = []
-        for row in range(1, N):
-            (a, b, c, d) = unpack('<4h', chunk[offset + 2: offset + 10])
-            beam1.append(a)
-            beam2.append(b)
-            beam3.append(c)
-            beam4.append(d)
-            offset += 4 * 2
-
-        self.data.velocity.eastward.append(beam1)
-        self.data.velocity.northward.append(beam2)
-        self.data.velocity.vertical.append(beam3)
-        self.data.velocity.error.append(beam4)
-
-    def _parse_corelation_magnitude_chunk(self, chunk):
-        """
-        Parse the corelation magnitude portion of the particle
+    lines = []
+    size = 0
+    for line in raw:
+        lines.append(line)
+        size += len(line)
+        if size >= SNIFF_BYTES:
+            break
 
-        @throws Exception If there is a problem with sample creation
-        """
-        N = (len(chunk) - 2) / 4
-        offset = 0
-
-        correlation_magnitude_id = unpack("<H", chunk[0:2])[0]
-        if 512 != correlation_magnitude_id:
-            raise Exception("correlation_magnitude_id was not equal to 512")
-
-        beam1 = []
-        beam2 = []
-        beam3 = []
-        beam4 = []
-        for row in range(1, N):
-            (a, b, c, d) = unpack('<4B', chunk[offset + 2: offset + 6])
-            beam1.append(a)
-            beam2.append(b)
-            beam3.append(c)
-            beam4.append(d)
-            offset += 4
-
-        self.data.correlation.magnitude_beam1.append(beam1)
-        self.data.correlation.magnitude_beam2.append(beam2)
-        self.data.correlation.magnitude_beam3.append(beam3)
-        self.data.correlation.magnitude_beam4.append(beam4)
-
-    def _parse_echo_intensity_chunk(self, chunk):
-        """
-        Parse the echo intensity portion of the particle
+    return b''.join(lines)[:SNIFF_BYTES]
 
-        @throws Exception If there is a problem with sample creation
-        """
-        N = (len(chunk) - 2) / 4
-        offset = 0
-
-        echo_intensity_id = unpack("<H", chunk[0:2])[0]
-        if 768 != echo_intensity_id:
-            raise Exception("echo_intensity_id was not equal to 768")
-
-        beam1 = []
-        beam2 = []
-        beam3 = []
-        beam4 = []
-        for row in range(1, N):
-            (a, b, c, d) = unpack('<4B', chunk[offset + 2: offset + 6])
-            beam1.append(a)
-            beam2.append(b)
-            beam3.append(c)
-            beam4.append(d)
-            offset += 4
-
-        self.data.echo.intensity_beam1.append(beam1)
-        self.data.echo.intensity_beam2.append(beam2)
-        self.data.echo.intensity_beam3.append(beam3)
-        self.data.echo.intensity_beam4.append(beam4)
-
-    def _parse_percent_good_chunk(self, chunk):
-        """
-        Parse the percent good portion of the particle
 
-        @throws Exception If there is a problem with sample creation
-        """
-        N = (len(chunk) - 2) / 4
-        offset = 0
-
-        percent_good_id = unpack("<H", chunk[0:2])[0]
-        if 1024 != percent_good_id:
-            raise Exception("percent_good_id was not equal to 1024")
-
-        percent1 = []
-        percent2 = []
-        percent3 = []
-        percent4 = []
-        for row in range(1, N):
-            (a, b, c, d) = unpack('<4B', chunk[offset + 2: offset + 6])
-            percent1.append(a)
-            percent2.append(b)
-            percent3.append(c)
-            percent4.append(d)
-            offset += 4
-
-        self.data.percent.good_3beam.append(percent1)
-        self.data.percent.transforms_reject.append(percent2)
-        self.data.percent.bad_beams.append(percent3)
-        self.data.percent.good_4beam.append(percent4)
+def is_binary(head):
+    '''
+    Return True if the start of a data file is binary PD0 data (with at least
+    one ensemble header found and no DCL ASCIIHEX records), rather than a DCL
+    log file.
+    '''
+    return BINARY_REGEX.search(head) is not None and REGEX.search(head) is None
+
+
+def frame_ensembles(buf):
+    '''
+    Find the ensembles in a buffer of binary PD0 data, returning their start
+    and stop offsets as arrays, along with the number of candidate ensembles
+    examined.
+
+    The candidates are found by their header bytes, with the length of each
+    read from the header and the checksums of all the candidates validated at
+    once. Working through the candidates in order, each valid ensemble is
+    accepted and any candidates within it (data that happens to look like a
+    header) are skipped. An invalid candidate is rejected, with the search
+    continuing from the next candidate, resynchronizing on the ensembles
+    following any corrupted data.
+    '''
+    starts = np.array([m.start() for m in BINARY_REGEX.finditer(buf)], dtype=np.int64)
+    if not len(starts):
+        return starts, starts, 0
+
+    # the header holds the offsets of each data type, so must fit in the
+    # number of bytes in the ensemble
+    lengths = stored_checksums(buf, starts + 2).astype(np.int64)
+    num_data_types = as_bytes(buf)[starts + 5].astype(np.int64)
+    valid = check_byte_sums(buf, starts, lengths) & (lengths >= 6 + 2 * num_data_types)
+    stops = starts + lengths + 2
+
+    accepted = []
+    examined = 0
+    position = 0
+    for i, (start, stop, ok) in enumerate(zip(starts.tolist(), stops.tolist(), valid.tolist())):
+        if start < position:
+            continue
+        examined += 1
+        if ok:
+            accepted.append(i)
+            position = stop
+
+    return starts[accepted], stops[accepted], examined
+
+
+def _rtc_to_epoch(leader):
+    '''
+    Convert the Y2K real time clock in the variable leaders into epoch
+    timestamps (seconds since 1970-01-01).
+    '''
+    year = leader['rtc2_century'].astype(np.int64) * 100 + leader['rtc2_year']
+    months = (year - 1970) * 12 + leader['rtc2_month'] - 1
+    days = months.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64) + leader['rtc2_day'] - 1
+    seconds = (days * 24 + leader['rtc2_hour']) * 3600 + leader['rtc2_minute'] * 60 + leader['rtc2_second']
+    return seconds + leader['rtc2_hundredths'] / 100.
+
+
+def _check_size(raw, offset, dtype):
+    '''
+    Check the data type at the offset fits in the ensembles (the rows of raw).
+    '''
+    if offset + dtype.itemsize > raw.shape[1]:
+        raise Exception("data type at offset %d runs past the end of the ensemble" % offset)
+
+
+def _view(raw, offset, dtype):
+    '''
+    View the bytes at the offset in each of the ensembles (the rows of raw) as
+    a structured array of the given dtype.
+    '''
+    _check_size(raw, offset, dtype)
+    return np.ascontiguousarray(raw[:, offset:offset + dtype.itemsize]).view(dtype).ravel()
+
+
+def _stack(leader, names):
+    '''
+    Stack the named fields of a structured array into a 2D array, one row per
+    ensemble.
+    '''
+    return np.column_stack([leader[name] for name in names])
+
+
+def _combine(parts):
+    '''
+    Combine the values for a parameter decoded from each group of ensembles
+    (as a list of (indices, values) pairs), returning the values in the order
+    of the ensembles. The values are returned as an array, or as a list if the
+    groups differ in the number of depth cells.
+    '''
+    if len(parts) == 1:
+        return parts[0][1]
+
+    indices = np.concatenate([np.asarray(index) for index, values in parts])
+    order = np.argsort(indices, kind='mergesort')
+    if len(set(values.shape[1:] for index, values in parts)) == 1:
+        return np.concatenate([values for index, values in parts])[order]
+
+    rows = [row for index, values in parts for row in values.tolist()]
+    return [rows[i] for i in order]
+
+
+def expand_fixed(data):
+    '''
+    Expand the fixed leader data (one record per configuration) into arrays
+    with one record per ensemble, using the fixed_index of each ensemble.
+    Accepts the parsed data as a ColumnStore or as a dictionary (e.g. loaded
+    from the JSON output). The values for any ensembles without a fixed
+    leader are masked.
+    '''
+    index = np.asarray(data['fixed_index'], dtype=np.int64)
+    missing = index < 0
+    expanded = {}
+    for name, values in data['fixed'].items():
+        values = np.asarray(values)
+        if not len(values):
+            values = np.zeros(1, dtype=values.dtype)
+        values = values[np.where(missing, 0, index)]
+        if missing.any():
+            values = np.ma.masked_array(values, mask=missing)
+        expanded[name] = values
+
+    return expanded
 
 
 if __name__ == '__main__':
@@ -647,10 +824,8 @@ if __name__ == '__main__':
     adcp = Parser(infile)
 
     # load the data into a buffered object and parse the data into a dictionary
-    adcp.load_ascii()
-    adcp.parse_data()
-
-    # write the resulting Bunch object via the toJSON method to a JSON
+    # (either the whole file, or with the append flag set just the data added
+    # since the last run, skipping files already in the cache if one is set),
+    # and write the resulting Bunch object via the toJSON method to a JSON
     # formatted data file (note, no pretty-printing keeping things compact)
-    with open(outfile, 'w') as f:
-        f.write(adcp.data.toJSON())
+    run_parser(adcp, outfile, args)
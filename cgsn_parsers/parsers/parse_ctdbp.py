@@ -11,7 +11,8 @@ import re
 
 # Import common utilites and base classes
 from cgsn_parsers.parsers.common import ParserCommon
-from cgsn_parsers.parsers.common import dcl_to_epoch, inputs, DCL_TIMESTAMP, FLOAT, INTEGER, NEWLINE
+from cgsn_parsers.parsers.common import dcl_to_epoch_array, inputs, run_parser, DCL_TIMESTAMP, FLOAT, INTEGER, NEWLINE
+from cgsn_parsers.parsers.common import float_column, format_column, int_column
 
 # Set regex strings to just find the CTD data (with options for DOSTA or FLORT).
 DOSTA = FLOAT + r',\s+'
@@ -30,6 +31,37 @@ CTDBP1 = BASE_PATTERN + CTD_DATE + NEWLINE
 CTDBP2 = BASE_PATTERN + DOSTA + CTD_DATE + NEWLINE
 CTDBP3 = BASE_PATTERN + FLORT + CTD_DATE + NEWLINE
 
+# Fields in the records of each CTDBP variant, converted in bulk by parse_fields
+_ctd_date_column = format_column('99 AAA 9999 99:99:99')
+_FIELDS = {
+    1: [('temperature', float_column), ('conductivity', float_column), ('pressure', float_column),
+        ('ctd_date_time_string', _ctd_date_column)],
+    2: [('temperature', float_column), ('conductivity', float_column), ('pressure', float_column),
+        ('oxygen_concentration', float_column), ('ctd_date_time_string', _ctd_date_column)],
+    3: [('temperature', float_column), ('conductivity', float_column), ('pressure', float_column),
+        ('raw_backscatter', int_column), ('raw_chlorophyll', int_column), ('raw_cdom', int_column),
+        ('ctd_date_time_string', _ctd_date_column)]
+}
+
+
+def _split_fields(rest):
+    '''
+    Split a CTDBP record into its fields, skipping the lines with a logger ID
+    (left for the regex).
+    '''
+    if not rest[:1].isspace():
+        return None
+
+    parts = rest.split(', ')
+    if parts[0].lstrip()[:1] in '[#':
+        return None
+
+    parts[-1] = parts[-1].strip()
+    if len(parts[-1]) != 20:
+        return None
+
+    return parts
+
 
 def _get_parameter_names_ctdbp(ctd_type):
     parameter_names = [
@@ -86,20 +118,17 @@ class Parser(ParserCommon):
         if self.ctd_type == 3:
             REGEX = re.compile(CTDBP3, re.DOTALL)
 
-        for line in self.raw:
-            match = REGEX.match(line)
-            if match:
-                self._build_parsed_values(match)
+        self.parse_fields(REGEX, _split_fields, _FIELDS[self.ctd_type], self._build_parsed_values)
+
+        # convert the DCL timestamps into epoch timestamps (seconds since
+        # 1970-01-01) in a single pass over all of the records
+        self.data.time = dcl_to_epoch_array(self.data.dcl_date_time_string).tolist()
 
     def _build_parsed_values(self, match):
         """
         Extract the data from the relevant regex groups and assign to elements
         of the data dictionary.
         """
-        # Use the date_time_string to calculate an epoch timestamp (seconds since
-        # 1970-01-01)
-        epts = dcl_to_epoch(match.group(1))
-        self.data.time.append(epts)
         self.data.dcl_date_time_string.append(str(match.group(1)))
 
         # Assign the remaining MET data to the named parameters
@@ -132,10 +161,8 @@ if __name__ == '__main__':
     ctdbp = Parser(infile, ctd_type)
 
     # load the data into a buffered object and parse the data into a dictionary
-    ctdbp.load_ascii()
-    ctdbp.parse_data()
-
-    # write the resulting Bunch object via the toJSON method to a JSON
+    # (either the whole file, or with the append flag set just the data added
+    # since the last run, skipping files already in the cache if one is set),
+    # and write the resulting Bunch object via the toJSON method to a JSON
     # formatted data file (note, no pretty-printing keeping things compact)
-    with open(outfile, 'w') as f:
-        f.write(ctdbp.data.toJSON())
+    run_parser(ctdbp, outfile, args)
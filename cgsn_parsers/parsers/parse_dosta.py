@@ -11,7 +11,8 @@ import re
 
 # Import common utilites and base classes
 from cgsn_parsers.parsers.common import ParserCommon
-from cgsn_parsers.parsers.common import dcl_to_epoch, inputs, DCL_TIMESTAMP, FLOAT, INTEGER, NEWLINE
+from cgsn_parsers.parsers.common import dcl_to_epoch_array, inputs, run_parser, DCL_TIMESTAMP, FLOAT, INTEGER, NEWLINE
+from cgsn_parsers.parsers.common import float_column, int_column
 
 # Regex pattern for a line with a DCL time stamp, possible DCL status value and
 # the 12 following met data values.
@@ -32,6 +33,22 @@ PATTERN = (
 )
 REGEX = re.compile(PATTERN, re.DOTALL)
 
+# Fields in the records, converted in bulk by parse_fields (split on whitespace)
+_FIELDS = [
+    ('product_number', int_column),
+    ('serial_number', int_column),
+    ('estimated_oxygen_concentration', float_column),
+    ('estimated_oxygen_saturation', float_column),
+    ('optode_temperature', float_column),
+    ('calibrated_phase', float_column),
+    ('temp_compensated_phase', float_column),
+    ('blue_phase', float_column),
+    ('red_phase', float_column),
+    ('blue_amplitude', float_column),
+    ('red_amplitude', float_column),
+    ('raw_temperature', float_column)
+]
+
 _parameter_names_dosta = [
         'date_time_string',
         'product_number',
@@ -64,20 +81,17 @@ class Parser(ParserCommon):
         above) in the data object, and parse the data into a pre-defined
         dictionary object created using the Bunch class.
         '''
-        for line in self.raw:
-            match = REGEX.match(line)
-            if match:
-                self._build_parsed_values(match)
+        self.parse_fields(REGEX, str.split, _FIELDS, self._build_parsed_values, timestamp='date_time_string')
+
+        # convert the DCL timestamps into epoch timestamps (seconds since
+        # 1970-01-01) in a single pass over all of the records
+        self.data.time = dcl_to_epoch_array(self.data.date_time_string).tolist()
 
     def _build_parsed_values(self, match):
         """
         Extract the data from the relevant regex groups and assign to elements
         of the data dictionary.
         """
-        # Use the date_time_string to calculate an epoch timestamp (seconds since
-        # 1970-01-01)
-        epts = dcl_to_epoch(match.group(1))
-        self.data.time.append(epts)
         self.data.date_time_string.append(str(match.group(1)))
 
         # Assign the remaining DOSTA data to the named parameters
@@ -104,10 +118,8 @@ if __name__ == '__main__':
     dosta = Parser(infile)
 
     # load the data into a buffered object and parse the data into a dictionary
-    dosta.load_ascii()
-    dosta.parse_data()
-
-    # write the resulting Bunch object via the toJSON method to a JSON
+    # (either the whole file, or with the append flag set just the data added
+    # since the last run, skipping files already in the cache if one is set),
+    # and write the resulting Bunch object via the toJSON method to a JSON
     # formatted data file (note, no pretty-printing keeping things compact)
-    with open(outfile, 'w') as f:
-        f.write(dosta.data.toJSON())
+    run_parser(dosta, outfile, args)
@@ -11,7 +11,8 @@ import re
 
 # Import common utilites and base classes
 from cgsn_parsers.parsers.common import ParserCommon
-from cgsn_parsers.parsers.common import dcl_to_epoch, inputs, DCL_TIMESTAMP, INTEGER, NEWLINE
+from cgsn_parsers.parsers.common import dcl_to_epoch_array, inputs, run_parser, DCL_TIMESTAMP, INTEGER, NEWLINE
+from cgsn_parsers.parsers.common import format_column, int_column
 
 # Regex pattern for a line with a DCL time stamp, possible DCL status value and
 # the 12 following met data values.
@@ -29,6 +30,35 @@ PATTERN = (
 )
 REGEX = re.compile(PATTERN, re.DOTALL)
 
+# Fields in the records, converted in bulk by parse_fields
+_FIELDS = [
+    ('flort_date_time_string', format_column('99/99/99 99:99:99')),
+    ('measurement_wavelength_beta', int_column),
+    ('raw_signal_beta', int_column),
+    ('measurement_wavelength_chl', int_column),
+    ('raw_signal_chl', int_column),
+    ('measurement_wavelength_cdom', int_column),
+    ('raw_signal_cdom', int_column),
+    ('raw_internal_temp', int_column)
+]
+
+
+def _split_fields(rest):
+    '''
+    Split a FLORT record into its fields, joining the date and time (separated
+    by a space or tab) into a single field.
+    '''
+    parts = rest.split()
+    if len(parts) != 9:
+        return None
+
+    stamp = rest.lstrip()[:17]
+    if stamp[8:9] not in ' \t' or stamp[9:] != parts[1]:
+        return None
+
+    return [stamp.replace('\t', ' ')] + parts[2:]
+
+
 _parameter_names_flort = [
         'dcl_date_time_string',
         'flort_date_time_string',
@@ -57,31 +87,28 @@ class Parser(ParserCommon):
         above) in the data object, and parse the data into a pre-defined
         dictionary object created using the Bunch class.
         '''
-        for line in self.raw:
-            match = REGEX.match(line)
-            if match:
-                self._build_parsed_values(match)
+        self.parse_fields(REGEX, _split_fields, _FIELDS, self._build_parsed_values)
+
+        # convert the DCL timestamps into epoch timestamps (seconds since
+        # 1970-01-01) in a single pass over all of the records
+        self.data.time = dcl_to_epoch_array(self.data.dcl_date_time_string).tolist()
 
     def _build_parsed_values(self, match):
         '''
         Extract the data from the relevant regex groups and assign to elements
         of the data dictionary.
         '''
-        # Use the date_time_string to calculate an epoch timestamp (seconds since
-        # 1970-01-01)
-        epts = dcl_to_epoch(match.group(1))
-        self.data.time.append(epts)
         self.data.dcl_date_time_string.append(str(match.group(1)))
 
         # Assign the remaining MET data to the named parameters
         self.data.flort_date_time_string.append(re.sub('\t', ' ', str(match.group(2))))
         self.data.measurement_wavelength_beta.append(int(match.group(3)))
         self.data.raw_signal_beta.append(int(match.group(4)))
-        self.data.measurement_wavelength_chl.append(int(match.group(4)))
-        self.data.raw_signal_chl.append(int(match.group(5)))
-        self.data.measurement_wavelength_cdom.append(int(match.group(6)))
-        self.data.raw_signal_cdom.append(int(match.group(7)))
-        self.data.raw_internal_temp.append(int(match.group(8)))
+        self.data.measurement_wavelength_chl.append(int(match.group(5)))
+        self.data.raw_signal_chl.append(int(match.group(6)))
+        self.data.measurement_wavelength_cdom.append(int(match.group(7)))
+        self.data.raw_signal_cdom.append(int(match.group(8)))
+        self.data.raw_internal_temp.append(int(match.group(9)))
 
 if __name__ == '__main__':
     # load the input arguments
@@ -93,10 +120,8 @@ if __name__ == '__main__':
     flort = Parser(infile)
 
     # load the data into a buffered object and parse the data into a dictionary
-    flort.load_ascii()
-    flort.parse_data()
-
-    # write the resulting Bunch object via the toJSON method to a JSON
+    # (either the whole file, or with the append flag set just the data added
+    # since the last run, skipping files already in the cache if one is set),
+    # and write the resulting Bunch object via the toJSON method to a JSON
     # formatted data file (note, no pretty-printing keeping things compact)
-    with open(outfile, 'w') as f:
-        f.write(flort.data.toJSON())
+    run_parser(flort, outfile, args)
@@ -11,7 +11,8 @@ import re
 
 # Import common utilites and base classes
 from cgsn_parsers.parsers.common import ParserCommon
-from cgsn_parsers.parsers.common import dcl_to_epoch, inputs, DCL_TIMESTAMP, FLOAT, NEWLINE
+from cgsn_parsers.parsers.common import dcl_to_epoch_array, inputs, run_parser, DCL_TIMESTAMP, FLOAT, NEWLINE
+from cgsn_parsers.parsers.common import float_column
 
 # Regex pattern for a line with a DCL time stamp and hydrogen data
 PATTERN = (
@@ -22,6 +23,25 @@ PATTERN = (
 )
 REGEX = re.compile(PATTERN, re.DOTALL)
 
+# Fields in the records, converted in bulk by parse_fields (the repeated value
+# is checked, but not kept)
+_FIELDS = [
+    ('hydrogen_concentration', float_column),
+    (None, float_column)
+]
+
+
+def _split_fields(rest):
+    '''
+    Split a hydrogen record (*value value %) into its fields.
+    '''
+    parts = rest.split()
+    if len(parts) != 3 or parts[0][:1] != '*' or len(parts[0]) == 1 or parts[2] != '%':
+        return None
+
+    return [parts[0][1:], parts[1]]
+
+
 _parameter_names_hydgn = [
         'dcl_date_time_string',
         'hydrogen_concentration'
@@ -34,6 +54,9 @@ class Parser(ParserCommon):
     methods to parse the data, and extracts the METBK data records from the DCL
     daily log files.
     '''
+    # marker preceding the hydrogen readings, found in every record
+    _signature = b'*'
+
     def __init__(self, infile):
         self.initialize(infile, _parameter_names_hydgn)
 
@@ -43,20 +66,17 @@ class Parser(ParserCommon):
         above) in the data object, and parse the data into a pre-defined
         dictionary object created using the Bunch class.
         '''
-        for line in self.raw:
-            match = REGEX.match(line)
-            if match:
-                self._build_parsed_values(match)
+        self.parse_fields(REGEX, _split_fields, _FIELDS, self._build_parsed_values)
+
+        # convert the DCL timestamps into epoch timestamps (seconds since
+        # 1970-01-01) in a single pass over all of the records
+        self.data.time = dcl_to_epoch_array(self.data.dcl_date_time_string).tolist()
 
     def _build_parsed_values(self, match):
         """
         Extract the data from the relevant regex groups and assign to elements
         of the data dictionary.
         """
-        # Use the date_time_string to calculate an epoch timestamp (seconds since
-        # 1970-01-01)
-        epts = dcl_to_epoch(match.group(1))
-        self.data.time.append(epts)
         self.data.dcl_date_time_string.append(str(match.group(1)))
 
         # Assign the remaining MET data to the named parameters
@@ -73,10 +93,8 @@ if __name__ == '__main__':
     hydgn = Parser(infile)
 
     # load the data into a buffered object and parse the data into a dictionary
-    hydgn.load_ascii()
-    hydgn.parse_data()
-
-    # write the resulting Bunch object via the toJSON method to a JSON
+    # (either the whole file, or with the append flag set just the data added
+    # since the last run, skipping files already in the cache if one is set),
+    # and write the resulting Bunch object via the toJSON method to a JSON
     # formatted data file (note, no pretty-printing keeping things compact)
-    with open(outfile, 'w') as f:
-        f.write(hydgn.data.toJSON())
+    run_parser(hydgn, outfile, args)
@@ -11,7 +11,8 @@ import re
 
 # Import common utilites and base classes
 from cgsn_parsers.parsers.common import ParserCommon
-from cgsn_parsers.parsers.common import dcl_to_epoch, inputs, DCL_TIMESTAMP, FLTNAN, NEWLINE
+from cgsn_parsers.parsers.common import dcl_to_epoch_array, inputs, run_parser, DCL_TIMESTAMP, FLTNAN, NEWLINE
+from cgsn_parsers.parsers.common import fltnan_column
 
 # Regex pattern for a line with a DCL time stamp, possible DCL status value and
 # the 12 following met data values.
@@ -33,6 +34,45 @@ PATTERN = (
 )
 REGEX = re.compile(PATTERN, re.DOTALL)
 
+# Fields in the records, converted in bulk by parse_fields (the repeated sea
+# surface conductivity and the battery voltage are checked, but not kept)
+_FIELDS = [(name, fltnan_column) for name in [
+    'barometric_pressure',
+    'relative_humidity',
+    'air_temperature',
+    'longwave_irradiance',
+    'precipitation_level',
+    'sea_surface_temperature',
+    'sea_surface_conductivity',
+    'shortwave_irradiance',
+    'eastward_wind_velocity',
+    'northward_wind_velocity',
+    None,
+    None
+]]
+
+
+def _split_fields(rest):
+    '''
+    Split a METBK record into its fields, skipping the lines with a DCL status
+    string (left for the regex).
+    '''
+    parts = rest.split()
+    if parts[:1] and parts[0][:1] == '[':
+        return None
+
+    return parts
+
+
+def _fill_nans(line):
+    '''
+    Some missing sensor data is represented as either a 'NaN', 'Na', or 'N'.
+    While 'NaN' is fine and can be used to represent missing data, 'Na' or 'N'
+    needs to be set to a full 'NaN'.
+    '''
+    return re.sub(r'N[aN]*', 'NaN', line)
+
+
 _parameter_names_metbk = [
     'dcl_date_time_string',
     'barometric_pressure',
@@ -63,24 +103,19 @@ class Parser(ParserCommon):
         above) in the data object, and parse the data into a pre-defined
         dictionary object created using the Bunch class.
         '''
-        for line in self.raw:
-            # Some missing sensor data is represented as either a 'NaN', 'Na', 
-            # or 'N'. While 'NaN' is fine and can be used to represent missing
-            # data, 'Na' or 'N' needs to be set to a full 'NaN'.
-            line = re.sub(r'N[aN]*', 'NaN', line)
-            match = REGEX.match(line)
-            if match:                
-                self._build_parsed_values(match)
+        # the missing values (NaN, Na or N) are set to NaN by fltnan_column for
+        # the records converted in bulk, and by _fill_nans for the rest
+        self.parse_fields(REGEX, _split_fields, _FIELDS, self._build_parsed_values, clean=_fill_nans)
+
+        # convert the DCL timestamps into epoch timestamps (seconds since
+        # 1970-01-01) in a single pass over all of the records
+        self.data.time = dcl_to_epoch_array(self.data.dcl_date_time_string).tolist()
 
     def _build_parsed_values(self, match):
         """
         Extract the data from the relevant regex groups and assign to elements
         of the data dictionary.
         """
-        # Use the date_time_string to calculate an epoch timestamp (seconds since
-        # 1970-01-01)
-        epts = dcl_to_epoch(match.group(1))
-        self.data.time.append(epts)
         self.data.dcl_date_time_string.append(str(match.group(1)))
 
         # Assign the remaining MET data to the named parameters
@@ -106,10 +141,8 @@ if __name__ == '__main__':
     metbk = Parser(infile)
 
     # load the data into a buffered object and parse the data into a dictionary
-    metbk.load_ascii()
-    metbk.parse_data()
-
-    # write the resulting Bunch object via the toJSON method to a JSON
+    # (either the whole file, or with the append flag set just the data added
+    # since the last run, skipping files already in the cache if one is set),
+    # and write the resulting Bunch object via the toJSON method to a JSON
     # formatted data file (note, no pretty-printing keeping things compact)
-    with open(outfile, 'w') as f:
-        f.write(metbk.data.toJSON())
+    run_parser(metbk, outfile, args)
@@ -6,21 +6,37 @@
 @author Christopher Wingard
 @brief Parses MOPAK data logged by the custom built WHOI data loggers.
 '''
+import numpy as np
 import os
 import re
 
-from struct import Struct
-
 # Import common utilites and base classes
+from cgsn_parsers.parsers.checksum import as_bytes, check_byte_sums, gather_packets
 from cgsn_parsers.parsers.common import ParserCommon
-from cgsn_parsers.parsers.common import logfilename_to_epoch, inputs, LOGFILENAME_TIMESTAMP
-
-# Regex pattern for a binary MOPAK (Microstrain 3DM-GX3-25) data packet;
-PATTERN = b'(\xCB)([\x00-\xff]{42})'
-REGEX = re.compile(PATTERN, re.DOTALL)
-
-# Struct class object for the MOPAK binary data byte streams
-MOPAK = Struct('>B9fIH')
+from cgsn_parsers.parsers.common import logfilename_to_epoch, inputs, run_parser, LOGFILENAME_TIMESTAMP
+
+# Start of a binary MOPAK (Microstrain 3DM-GX3-25) data packet, and the size
+# of the packets
+SYNC = 0xCB
+PACKET_SIZE = 43
+
+# Structured dtype for the MOPAK binary data packets (big-endian), the
+# accelerations, angular rates and magnetometer values followed by the timer
+# and the checksum (the sum of the first 41 bytes)
+MOPAK = np.dtype([
+    ('sync', 'u1'),
+    ('acceleration_x', '>f4'),
+    ('acceleration_y', '>f4'),
+    ('acceleration_z', '>f4'),
+    ('angular_rate_x', '>f4'),
+    ('angular_rate_y', '>f4'),
+    ('angular_rate_z', '>f4'),
+    ('magnetometer_x', '>f4'),
+    ('magnetometer_y', '>f4'),
+    ('magnetometer_z', '>f4'),
+    ('timer', '>u4'),
+    ('checksum', '>u2')
+])
 
 _parameter_names_mopak = [
         'acceleration_x',
@@ -35,6 +51,20 @@ _parameter_names_mopak = [
         'timer'
     ]
 
+_parameter_types_mopak = {
+        'time': 'f8',
+        'acceleration_x': 'f4',
+        'acceleration_y': 'f4',
+        'acceleration_z': 'f4',
+        'angular_rate_x': 'f4',
+        'angular_rate_y': 'f4',
+        'angular_rate_z': 'f4',
+        'magnetometer_x': 'f4',
+        'magnetometer_y': 'f4',
+        'magnetometer_z': 'f4',
+        'timer': 'f8'
+    }
+
 
 class Parser(ParserCommon):
     '''
@@ -42,13 +72,17 @@ class Parser(ParserCommon):
     methods to parse the data, and extracts the mopak data records from the DCL
     daily log files.
     '''
+    # motion data summarized over time intervals for monitoring
+    _summary = _parameter_names_mopak[:6]
+
     def __init__(self, infile):
-        self.initialize(infile, _parameter_names_mopak)
+        self.initialize(infile, _parameter_names_mopak, _parameter_types_mopak)
 
     def parse_data(self):
         '''
-        Iterate through packets to parse the data into a pre-defined
-        dictionary object created using the Bunch class.
+        Find and validate all of the packets at once (see frame_packets), and
+        parse them into a pre-defined dictionary object created using the
+        Bunch class.
         '''
         # determine epoch start time from characters in the log file name; the
         # date_time in this filename marks when the file was created...that's
@@ -66,63 +100,75 @@ class Parser(ParserCommon):
         epts = epts + twake
 
         # find all the mopak data packets
-        record_marker = [m.start() for m in REGEX.finditer(self.raw)]
-
-        # if we have mopak records, then parse them one-by-one
-        while record_marker:
-            # set the start and stop points of the packet
-            start = record_marker[0]
-            stop = start + 43
-
-            # parse the packet
-            self._build_parsed_values(self.raw[start:stop], epts)
-
-            # grab the next packet
-            record_marker.pop(0)
+        buf = as_bytes(self.raw)
+        with self.metrics.timer('scan'):
+            starts, examined = frame_packets(buf)
+        self.metrics.count('scanned', examined)
+        self.metrics.count('matched', examined)
+        self.metrics.count('rejected_checksum', examined - len(starts))
+
+        # gather the packets into a 2D array of bytes, viewed as a structured
+        # array with one record per packet, and parse them all at once
+        packets = gather_packets(buf, starts, PACKET_SIZE).view(MOPAK).ravel()
+        self._build_parsed_values(packets, epts)
+
+    def _split_batch(self, buf):
+        '''
+        Split the block of data read in by iter_batches after the last
+        complete packet, carrying over the bytes that may hold the start of a
+        partial packet.
+        '''
+        starts, examined = frame_packets(as_bytes(buf))
+        end = starts[-1] + PACKET_SIZE if len(starts) else 0
+        return max(end, len(buf) - PACKET_SIZE + 1)
 
-    def _build_parsed_values(self, packet, epts):
+    def _build_parsed_values(self, packets, epts):
         '''
-        Extract the data from the relevant byte groupings and assign to
-        elements of the data dictionary.
+        Extract the data from the packets (a structured array of the packets
+        with valid checksums) and assign to elements of the data dictionary.
         '''
-        # unpack the packet
-        (_, accx, accy, accz, angx, angy, angz,
-         magx, magy, magz, timer, check) = MOPAK.unpack(packet)
-
-        # Check the size
-        if len(packet) != 43:
-            print("Incorrect packet size")
-            print("mopak data packet failed to parse")
-            return False
-
-        # Check the checksums
-        if check != self._calc_checksum(packet[:-2]):
-            print("Checksum mismatch")
-            return False
-
-        # assign the MOPAK header data to the named parameters
-        self.data.time.append(epts + (timer / 62500.))
-        self.data.acceleration_x.append(accx)
-        self.data.acceleration_y.append(accy)
-        self.data.acceleration_z.append(accz)
-        self.data.angular_rate_x.append(angx)
-        self.data.angular_rate_y.append(angy)
-        self.data.angular_rate_z.append(angz)
-        self.data.magnetometer_x.append(magx)
-        self.data.magnetometer_y.append(magz)
-        self.data.magnetometer_z.append(magz)
-        self.data.timer.append(timer / 62500.)
-        return True
-
-    def _calc_checksum(self, packet):
-        # add integer representations of the 1-byte characters
-        checksum = 0
-        for byte in packet:
-            checksum += ord(byte)
-
-        # reduce checksum to 2 significant bytes
-        checksum = checksum & 65535
-        return checksum
+        # assign the MOPAK data to the named parameters
+        timer = packets['timer'] / 62500.
+        self.data.time.extend(epts + timer)
+        for name in _parameter_names_mopak[:-1]:
+            self.data[name].extend(packets[name])
+        self.data.timer.extend(timer)
+
+
+def frame_packets(buf):
+    '''
+    Find the MOPAK packets in a buffer of unsigned bytes, returning the offsets
+    of the packets with a valid checksum and the number of candidate packets
+    examined.
+
+    Every sync byte far enough from the end of the buffer to start a complete
+    packet is a candidate, with the checksums of all the candidates validated
+    at once. The sync bytes found within a valid packet (part of the data) are
+    dropped, and the rest examined, so a corrupted packet is rejected without
+    losing a valid packet starting within it.
+    '''
+    starts = np.flatnonzero(buf[:max(len(buf) - PACKET_SIZE + 1, 0)] == SYNC)
+    valid = check_byte_sums(buf, starts, PACKET_SIZE - 2, '>')
+
+    # drop the valid packets starting within an earlier valid packet (the
+    # rare case where the data in a packet looks like a packet)
+    accepted = starts[valid]
+    if len(accepted) > 1 and (np.diff(accepted) < PACKET_SIZE).any():
+        keep = []
+        stop = 0
+        for start in accepted.tolist():
+            if start >= stop:
+                keep.append(start)
+                stop = start + PACKET_SIZE
+        accepted = np.array(keep, dtype=np.int64)
+
+    # count the rejected candidates, other than those within a valid packet
+    rejected = starts[~valid]
+    previous = np.searchsorted(accepted, rejected, side='right') - 1
+    inside = (previous >= 0) & (rejected < accepted[np.maximum(previous, 0)] + PACKET_SIZE) \
+        if len(accepted) else np.zeros(len(rejected), dtype=bool)
+
+    return accepted.astype(np.int64), len(accepted) + int(np.count_nonzero(~inside))
 
 if __name__ == '__main__':
     # load the input arguments
@@ -133,11 +179,9 @@ if __name__ == '__main__':
     # initialize the Parser object for vel3d
     mopak = Parser(infile)
 
-    # load the data into a buffered object and parse the data into dictionaries
-    mopak.load_binary()
-    mopak.parse_data()
-
-    # write the resulting Bunch object via the toJSON method to a JSON
+    # load the data into a buffered object and parse the data into a dictionary
+    # (either the whole file, or with the append flag set just the data added
+    # since the last run, skipping files already in the cache if one is set),
+    # and write the resulting Bunch object via the toJSON method to a JSON
     # formatted data file (note, no pretty-printing keeping things compact)
-    with open(outfile, 'w') as f:
-        f.write(mopak.data.toJSON())
+    run_parser(mopak, outfile, args)
@@ -6,12 +6,14 @@
 @author Russell Desiderio with edits from Christopher Wingard
 @brief Parses OPTAA data logged by the custom built WHOI data loggers.
 '''
+import numpy as np
 import os
 import re
 from struct import unpack
 
 # Import common utilites and base classes
-from cgsn_parsers.parsers.common import ParserCommon, logfilename_to_epoch, inputs, LOGFILENAME_TIMESTAMP
+from cgsn_parsers.parsers.checksum import as_bytes, check_byte_sums, gather_packets, stored_checksums
+from cgsn_parsers.parsers.common import ParserCommon, logfilename_to_epoch, inputs, run_parser, LOGFILENAME_TIMESTAMP
 
 # Regex pattern for the start of a binary OPTAA (ac-s) data packet
 PATTERN = b'(\xff\x00\xff\x00)'
@@ -60,6 +62,24 @@ _parameter_names_optaa = [
         'a_signal_raw'
     ]
 
+_parameter_types_optaa = {
+        'time': 'f8',
+        'serial_number': 'u4',
+        'a_reference_dark': 'u2',
+        'pressure_raw': 'u2',
+        'a_signal_dark': 'u2',
+        'external_temp_raw': 'u2',
+        'internal_temp_raw': 'u2',
+        'c_reference_dark': 'u2',
+        'c_signal_dark': 'u2',
+        'elapsed_run_time': 'u4',
+        'num_wavelengths': 'u1',
+        'c_reference_raw': 'u2',
+        'a_reference_raw': 'u2',
+        'c_signal_raw': 'u2',
+        'a_signal_raw': 'u2'
+    }
+
 
 class Parser(ParserCommon):
     """
@@ -67,8 +87,16 @@ class Parser(ParserCommon):
     methods to parse the data, and extracts the optaa data records from the DCL
     hourly log files.
     """
+    _state = ['record_length', 'nwave', 'time_zero']
+
     def __init__(self, infile):
-        self.initialize(infile, _parameter_names_optaa)
+        self.initialize(infile, _parameter_names_optaa, _parameter_types_optaa)
+
+        # record length, number of wavelengths and elapsed run time (time
+        # zero) of the first packet in the file, set when it is parsed
+        self.record_length = 0
+        self.nwave = 0
+        self.time_zero = 0
 
     def parse_data(self):
         # Determine epoch start time from characters in the log file name; the
@@ -78,79 +106,149 @@ class Parser(ParserCommon):
         dt_regex = re.compile(LOGFILENAME_TIMESTAMP, re.DOTALL)
         match = dt_regex.search(self.infile)
         epts = logfilename_to_epoch(match.group(1))
-        
+
         # find all the optaa data packets
-        record_marker = [m.start() for m in REGEX.finditer(self.raw)]
-        record_length = 0   # default record length set to 0, updated with first packet
-        
-        # if we have optaa packets, then parse them one-by-one
-        while record_marker:
-            # set the start point of the packet
+        buf = as_bytes(self.raw)
+        with self.metrics.timer('scan'):
+            record_marker = find_markers(buf)
+        self.metrics.count('scanned', len(record_marker))
+        self.metrics.count('matched', len(record_marker))
+        if not len(record_marker):
+            return
+
+        if self.record_length == 0:     # this is the first packet, set defaults
+            # set the record length for the packets, as well as the number
+            # of wavelengths and time zero for the file, from the first packet.
             start = record_marker[0]
-            if record_length == 0:      # this is the first packet, set defaults
-                # set the record length for the packets, as well as the number 
-                # of wavelengths and time zero for the file.
-                record_length = unpack('>H', self.raw[start+4:start+6])[0]
-                nwave = unpack('>B', self.raw[start+31])[0]
-                if nwave != (record_length - 32) / 8:
-                    raise Exception('optaa data packet: record length does not match number of wavelengths.')
-
-                # mark the first packet's elapsed_run_time 
-                time_zero = unpack('>I', self.raw[start+26:start+30])[0]
-
-            # now set the stop point of the packet
+            self.record_length = unpack('>H', self.raw[start+4:start+6])[0]
+            self.nwave = unpack('>B', self.raw[start+31])[0]
+            if self.nwave != (self.record_length - 32) / 8:
+                raise Exception('optaa data packet: record length does not match number of wavelengths.')
+
+            # mark the first packet's elapsed_run_time
+            self.time_zero = unpack('>I', self.raw[start+26:start+30])[0]
+
+        # validate the record lengths and the checksums of all the packets at
+        # once, rejecting those with a different record length (or too close
+        # to the end of the data to hold one) before those failing the checksum
+        inside = record_marker + 6 <= len(buf)
+        lengths = stored_checksums(buf, np.where(inside, record_marker + 4, 0), '>')
+        sized = inside & (lengths == self.record_length)
+        valid = sized & check_byte_sums(buf, record_marker, self.record_length, '>')
+        self.metrics.count('rejected_size', int(np.count_nonzero(~sized)))
+        self.metrics.count('rejected_checksum', int(np.count_nonzero(sized & ~valid)))
+
+        # gather the valid packets (less the padding byte) into a 2D array of
+        # bytes, viewed as a big-endian structured array with one record per
+        # packet, and parse them all at once
+        packets = gather_packets(buf, record_marker[valid], self.record_length + 2)
+        packets = packets.view(_packet_dtype(self.nwave)).ravel()
+        self._build_parsed_values(packets, epts, self.time_zero)
+
+    def _split_batch(self, buf):
+        '''
+        Split the block of data read in by iter_batches at the start of the
+        first packet that runs past the end of the block, carrying it over to
+        the next block.
+        '''
+        record_length = self.record_length
+        covered = 0
+        for match in REGEX.finditer(buf):
+            start = match.start()
+            if record_length == 0:
+                # use the first packet to set the record length
+                if start + 32 > len(buf):
+                    return start
+                record_length = unpack('>H', buf[start+4:start+6])[0]
+
             stop = start + record_length + 3
-            
-            # parse the packet
-            if self._acs_checksum_agreement(self.raw[start:stop]):
-                self._build_parsed_values(self.raw[start:stop], nwave, epts, time_zero)
+            if stop <= len(buf):
+                covered = max(covered, stop)
+            elif start >= covered:
+                # partial packet (markers found within a complete packet are
+                # left in place, as they are when parsing the whole file)
+                return start
 
-            # pop to the next packet
-            record_marker.pop(0)
+        return max(covered, len(buf) - 3)
 
-    def _build_parsed_values(self, packet, nwave, epts, time_zero):
+    def _build_parsed_values(self, packets, epts, time_zero):
         """
-        Extract data from the relevant byte groupings and assign to elements
-        of the data dictionary.
+        Extract data from the packets (a structured array, see _packet_dtype)
+        and assign to elements of the data dictionary.
         """
         # Assign the optaa data to the named parameters
-        self.data.serial_number.append(unpack('>I', '\x00' + packet[9:12])[0])
-        self.data.a_reference_dark.append(unpack('>H', packet[12:14])[0])
-        self.data.pressure_raw.append(unpack('>H', packet[14:16])[0])
-        self.data.a_signal_dark.append(unpack('>H', packet[16:18])[0])
-        self.data.external_temp_raw.append(unpack('>H', packet[18:20])[0])
-        self.data.internal_temp_raw.append(unpack('>H', packet[20:22])[0])
-        self.data.c_reference_dark.append(unpack('>H', packet[22:24])[0])
-        self.data.c_signal_dark.append(unpack('>H', packet[24:26])[0])
-        elapsed_run_time = unpack('>I',packet[26:30])[0]
-        self.data.elapsed_run_time.append(elapsed_run_time)
-        time = epts + (elapsed_run_time - time_zero) / 1000.
-        self.data.time.append(time)
-        self.data.num_wavelengths.append(unpack('>B', packet[31])[0])
-        optical_data = unpack(('>' +  str(4 * nwave) + 'H'), packet[32:32 + 2 * 4 * nwave])
-        self.data.c_reference_raw.append(optical_data[0::4])
-        self.data.a_reference_raw.append(optical_data[1::4])
-        self.data.c_signal_raw.append(optical_data[2::4])
-        self.data.a_signal_raw.append(optical_data[3::4])
-        
-        # Note, record time is a function of the "absolute" file start time 
+        serial_number = packets['serial_number'].astype(np.uint32)
+        self.data.serial_number.extend((serial_number[:, 0] << 16) | (serial_number[:, 1] << 8) |
+                                       serial_number[:, 2])
+        for name in ['a_reference_dark', 'pressure_raw', 'a_signal_dark', 'external_temp_raw',
+                     'internal_temp_raw', 'c_reference_dark', 'c_signal_dark', 'elapsed_run_time',
+                     'num_wavelengths']:
+            self.data[name].extend(packets[name])
+
+        time = epts + (packets['elapsed_run_time'].astype(np.int64) - time_zero) / 1000.
+        self.data.time.extend(time)
+
+        # the optical data is ordered cref, aref, csig, asig for each
+        # wavelength, returned as (packets, wavelengths) arrays
+        optical_data = packets['optical_data']
+        self.data.c_reference_raw.extend(optical_data[:, :, 0])
+        self.data.a_reference_raw.extend(optical_data[:, :, 1])
+        self.data.c_signal_raw.extend(optical_data[:, :, 2])
+        self.data.a_signal_raw.extend(optical_data[:, :, 3])
+
+        # Note, record time is a function of the "absolute" file start time
         # noted in the file name, used to calculate the epoch_time, and the
-        # relative time recorded in the data in the elapsed_run_time (msec) 
-        # parameter. The first elapsed_run_time measurement is used to set 
+        # relative time recorded in the data in the elapsed_run_time (msec)
+        # parameter. The first elapsed_run_time measurement is used to set
         # time_zero, from there:
         #   time = epoch_time - time_zero + elapsed_run_time
 
-    def _acs_checksum_agreement(self, packet):
-        # sum integer representations of the 1-byte characters
-        checksum = 0
-        for byte in packet[:-3]:
-            checksum += ord(byte)
-            
-        # reduce checksum to 2 significant bytes
-        checksum = checksum & 65535  # or np.mod(checksum, 65536) could be used
 
-        # compare the calculated and reported checksum values
-        return checksum == unpack('>H', packet[-3:-1])[0]
+def find_markers(buf):
+    """
+    Return the offsets of the packet registration bytes in a buffer of
+    unsigned bytes, matching those found by REGEX (where the markers overlap,
+    as in a run of 0xFF 0x00 pairs, only the first of each is kept).
+    """
+    starts = np.flatnonzero(buf[:-3] == 0xff) if len(buf) > 3 else np.zeros(0, dtype=np.int64)
+    starts = starts[(buf[starts + 1] == 0) & (buf[starts + 2] == 0xff) & (buf[starts + 3] == 0)]
+    if len(starts) > 1 and (np.diff(starts) < 4).any():
+        keep = []
+        stop = 0
+        for start in starts.tolist():
+            if start >= stop:
+                keep.append(start)
+                stop = start + 4
+        starts = np.array(keep)
+
+    return starts.astype(np.int64)
+
+
+def _packet_dtype(nwave):
+    """
+    Return the big-endian structured dtype for an optaa packet with nwave
+    wavelengths (less the padding byte, see the packet layout above).
+    """
+    return np.dtype([
+        ('registration', '>u4'),
+        ('record_length', '>u2'),
+        ('packet_type', 'u1'),
+        ('_reserved1', 'u1'),
+        ('meter_type', 'u1'),
+        ('serial_number', 'u1', (3,)),
+        ('a_reference_dark', '>u2'),
+        ('pressure_raw', '>u2'),
+        ('a_signal_dark', '>u2'),
+        ('external_temp_raw', '>u2'),
+        ('internal_temp_raw', '>u2'),
+        ('c_reference_dark', '>u2'),
+        ('c_signal_dark', '>u2'),
+        ('elapsed_run_time', '>u4'),
+        ('_reserved2', 'u1'),
+        ('num_wavelengths', 'u1'),
+        ('optical_data', '>u2', (nwave, 4)),
+        ('checksum', '>u2')
+    ])
 
 if __name__ == '__main__':
     # load the input arguments
@@ -162,10 +260,8 @@ if __name__ == '__main__':
     optaa = Parser(infile)
 
     # load the data into a buffered object and parse the data into a dictionary
-    optaa.load_binary()
-    optaa.parse_data()
-
-    # write the resulting Bunch object via the toJSON method to a JSON
+    # (either the whole file, or with the append flag set just the data added
+    # since the last run, skipping files already in the cache if one is set),
+    # and write the resulting Bunch object via the toJSON method to a JSON
     # formatted data file (note, no pretty-printing keeping things compact)
-    with open(outfile, 'w') as f:
-        f.write(optaa.data.toJSON())
+    run_parser(optaa, outfile, args)
@@ -11,7 +11,8 @@ import re
 
 # Import common utilites and base classes
 from cgsn_parsers.parsers.common import ParserCommon
-from cgsn_parsers.parsers.common import dcl_to_epoch, inputs, DCL_TIMESTAMP, FLOAT, INTEGER, NEWLINE
+from cgsn_parsers.parsers.common import dcl_to_epoch_array, inputs, run_parser, DCL_TIMESTAMP, FLOAT, INTEGER, NEWLINE
+from cgsn_parsers.parsers.common import float_column, format_column, int_column, string_column
 
 # Regex pattern for a line with a DCL time stamp, possible DCL status value and
 # the 12 following met data values.
@@ -32,6 +33,37 @@ PATTERN = (
 )
 REGEX = re.compile(PATTERN, re.DOTALL)
 
+# Fields in the records, converted in bulk by parse_fields
+_FIELDS = [
+    ('co2_date_time_string', format_column('9999/99/99 99:99:99')),
+    ('zero_a2d', int_column),
+    ('current_a2d', int_column),
+    ('measured_water_co2', float_column),
+    ('avg_irga_temperature', float_column),
+    ('humidity', float_column),
+    ('humidity_temperature', float_column),
+    ('gas_stream_pressure', int_column),
+    ('irga_detector_temperature', float_column),
+    ('irga_source_temperature', float_column),
+    ('co2_source', string_column)
+]
+
+
+def _split_fields(rest):
+    '''
+    Split a PCO2A record into its fields, dropping the M (measurement) flag.
+    '''
+    parts = rest.lstrip().split(',')
+    if len(parts) != 12 or parts[0][:1] != '#' or len(parts[0]) != 20 or parts[1] != ' M':
+        return None
+
+    source = parts[11].strip()
+    if source not in ('A', 'W'):
+        return None
+
+    return [parts[0][1:]] + parts[2:11] + [source]
+
+
 _parameter_names_pco2a = [
         'dcl_date_time_string',
         'co2_date_time_string',
@@ -54,6 +86,9 @@ class Parser(ParserCommon):
     methods to parse the data, and extracts the PCO2A data records from the DCL
     daily log files.
     """
+    # measurement record type, found in every record
+    _signature = b', M,'
+
     def __init__(self, infile):
         self.initialize(infile, _parameter_names_pco2a)
 
@@ -63,20 +98,17 @@ class Parser(ParserCommon):
         above) in the data object, and parse the data into a pre-defined
         dictionary object created using the Bunch class.
         '''
-        for line in self.raw:
-            match = REGEX.match(line)
-            if match:
-                self._build_parsed_values(match)
+        self.parse_fields(REGEX, _split_fields, _FIELDS, self._build_parsed_values)
+
+        # convert the DCL timestamps into epoch timestamps (seconds since
+        # 1970-01-01) in a single pass over all of the records
+        self.data.time = dcl_to_epoch_array(self.data.dcl_date_time_string).tolist()
 
     def _build_parsed_values(self, match):
         """
         Extract the data from the relevant regex groups and assign to elements
         of the data dictionary.
         """
-        # Use the date_time_string to calculate an epoch timestamp (seconds since
-        # 1970-01-01)
-        epts = dcl_to_epoch(match.group(1))
-        self.data.time.append(epts)
         self.data.dcl_date_time_string.append(str(match.group(1)))
 
         # Assign the remaining MET data to the named parameters
@@ -102,10 +134,8 @@ if __name__ == '__main__':
     pco2a = Parser(infile)
 
     # load the data into a buffered object and parse the data into a dictionary
-    pco2a.load_ascii()
-    pco2a.parse_data()
-
-    # write the resulting Bunch object via the toJSON method to a JSON
+    # (either the whole file, or with the append flag set just the data added
+    # since the last run, skipping files already in the cache if one is set),
+    # and write the resulting Bunch object via the toJSON method to a JSON
     # formatted data file (note, no pretty-printing keeping things compact)
-    with open(outfile, 'w') as f:
-        f.write(pco2a.data.toJSON())
+    run_parser(pco2a, outfile, args)
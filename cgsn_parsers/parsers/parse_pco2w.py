@@ -11,7 +11,7 @@ import re
 
 # Import common utilites and base classes
 from cgsn_parsers.parsers.common import ParserCommon
-from cgsn_parsers.parsers.common import dcl_to_epoch, inputs, DCL_TIMESTAMP
+from cgsn_parsers.parsers.common import dcl_to_epoch_array, inputs, run_parser, DCL_TIMESTAMP
 
 # Regex pattern for a line with a DCL time stamp, the "*" character, 4 unknown
 # characters (2 for a 1 byte hash of the unit serial number and calibration,
@@ -83,16 +83,28 @@ class Parser(ParserCommon):
             # bump to the next marker
             record_marker.pop(0)
 
+        # convert the DCL timestamps into epoch timestamps (seconds since
+        # 1970-01-01) in a single pass over all of the records
+        self.data.time = dcl_to_epoch_array(self.data.collect_date_time).tolist()
+
+    def _split_batch(self, buf):
+        '''
+        Split the block of data read in by iter_batches at the start of the
+        last record, which may continue into the next block.
+        '''
+        record_marker = [m.start() for m in REGEX.finditer(buf)]
+        if record_marker:
+            return record_marker[-1]
+
+        # no records, carry over the last two lines (a possible partial record)
+        last = buf.rfind(b'\n')
+        return buf.rfind(b'\n', 0, max(last, 0)) + 1
+
     def _build_parsed_values(self, collect_time, process_time, sample):
         """
         Extract the data from the relevant regex groups and assign to elements
         of the data dictionary.
         """
-        # Use the date_time_string from the collection time to calculate an
-        # epoch timestamp (seconds since 1970-01-01), using that values as the
-        # preferred time record for the data
-        epts = dcl_to_epoch(collect_time)
-        self.data.time.append(epts)
         self.data.collect_date_time.append(collect_time)
         self.data.process_date_time.append(process_time)
 
@@ -123,10 +135,8 @@ if __name__ == '__main__':
     pco2w = Parser(infile)
 
     # load the data into a buffered object and parse the data into a dictionary
-    pco2w.load_binary()     # not really binary, but this creates on object that is easy to parse
-    pco2w.parse_data()
-
-    # write the resulting Bunch object via the toJSON method to a JSON
+    # (either the whole file, or with the append flag set just the data added
+    # since the last run, skipping files already in the cache if one is set),
+    # and write the resulting Bunch object via the toJSON method to a JSON
     # formatted data file (note, no pretty-printing keeping things compact)
-    with open(outfile, 'w') as f:
-        f.write(pco2w.data.toJSON())
+    run_parser(pco2w, outfile, args)
@@ -11,7 +11,7 @@ import re
 
 # Import common utilites and base classes
 from cgsn_parsers.parsers.common import ParserCommon
-from cgsn_parsers.parsers.common import dcl_to_epoch, inputs, DCL_TIMESTAMP
+from cgsn_parsers.parsers.common import dcl_to_epoch_array, inputs, run_parser, DCL_TIMESTAMP
 
 # Regex pattern for a line with a DCL time stamp, the "*" character, 4 unknown
 # characters (2 for a 1 byte hash of the unit serial number and calibration,
@@ -83,15 +83,27 @@ class Parser(ParserCommon):
             # bump to the next marker
             record_marker.pop(0)
 
+        # convert the DCL timestamps into epoch timestamps (seconds since
+        # 1970-01-01) in a single pass over all of the records
+        self.data.time = dcl_to_epoch_array(self.data.dcl_date_time_string).tolist()
+
+    def _split_batch(self, buf):
+        '''
+        Split the block of data read in by iter_batches at the start of the
+        last record, which may continue into the next block.
+        '''
+        record_marker = [m.start() for m in REGEX_START.finditer(buf)]
+        if record_marker:
+            return record_marker[-1]
+
+        # no records, carry over the last (partial) line
+        return buf.rfind(b'\n') + 1
+
     def _build_parsed_values(self, timestamp, sample):
         """
         Extract the data from the relevant regex groups and assign to elements
         of the data dictionary.
         """
-        # Use the date_time_string to calculate an epoch timestamp (seconds since
-        # 1970-01-01)
-        epts = dcl_to_epoch(timestamp)
-        self.data.time.append(epts)
         self.data.dcl_date_time_string.append(timestamp)
 
         self.data.record_length.append(int(sample[3:5], 16))
@@ -130,10 +142,8 @@ if __name__ == '__main__':
     phsen = Parser(infile)
 
     # load the data into a buffered object and parse the data into a dictionary
-    phsen.load_binary()     # not really binary, but this creates on object that is easy to parse
-    phsen.parse_data()
-
-    # write the resulting Bunch object via the toJSON method to a JSON
+    # (either the whole file, or with the append flag set just the data added
+    # since the last run, skipping files already in the cache if one is set),
+    # and write the resulting Bunch object via the toJSON method to a JSON
     # formatted data file (note, no pretty-printing keeping things compact)
-    with open(outfile, 'w') as f:
-        f.write(phsen.data.toJSON())
+    run_parser(phsen, outfile, args)
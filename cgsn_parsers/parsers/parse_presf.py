@@ -11,7 +11,8 @@ import re
 
 # Import common utilites and base classes
 from cgsn_parsers.parsers.common import ParserCommon
-from cgsn_parsers.parsers.common import dcl_to_epoch, inputs, DCL_TIMESTAMP, FLOAT, NEWLINE
+from cgsn_parsers.parsers.common import dcl_to_epoch_array, inputs, run_parser, DCL_TIMESTAMP, FLOAT, NEWLINE
+from cgsn_parsers.parsers.common import float_column, format_column
 
 # Regex pattern for a line with a DCL time stamp and the PRESF tide data.
 presf_date = r'(\d{2}\s\w{3}\s\d{4}\s\d{2}:\d{2}:\d{2})'
@@ -24,6 +25,32 @@ PATTERN = (
 )
 REGEX = re.compile(PATTERN, re.DOTALL)
 
+# Fields in the records, converted in bulk by parse_fields
+_FIELDS = [
+    ('presf_date_time_string', format_column('99 AAA 9999 99:99:99')),
+    ('absolute_pressure', float_column),
+    ('pressure_temp', float_column),
+    ('seawater_temperature', float_column)
+]
+
+
+def _split_fields(rest):
+    '''
+    Split a PRESF tide record into its fields, removing the labels.
+    '''
+    parts = rest.lstrip().split(', ')
+    if (len(parts) != 4 or not parts[0].startswith('tide: start time = ') or len(parts[0]) != 39 or
+            not parts[1].startswith('p = ') or not parts[2].startswith('pt = ') or
+            not parts[3].startswith('t = ')):
+        return None
+
+    values = [parts[0][19:], parts[1][4:], parts[2][5:], parts[3][4:].rstrip()]
+    if values[1][:1].isspace() or values[2][:1].isspace() or values[3][:1].isspace():
+        return None
+
+    return values
+
+
 _parameter_names_presf = [
         'dcl_date_time_string',
         'presf_date_time_string',
@@ -39,6 +66,9 @@ class Parser(ParserCommon):
     methods to parse the data, and extracts the PRESF data records from the DCL
     daily log files.
     """
+    # tide measurement leader, found in every record
+    _signature = b'tide:'
+
     def __init__(self, infile):
         self.initialize(infile, _parameter_names_presf)
 
@@ -48,20 +78,17 @@ class Parser(ParserCommon):
         above) in the data object, and parse the data into a pre-defined
         dictionary object created using the Bunch class.
         '''
-        for line in self.raw:
-            match = REGEX.match(line)
-            if match:
-                self._build_parsed_values(match)
+        self.parse_fields(REGEX, _split_fields, _FIELDS, self._build_parsed_values)
+
+        # convert the DCL timestamps into epoch timestamps (seconds since
+        # 1970-01-01) in a single pass over all of the records
+        self.data.time = dcl_to_epoch_array(self.data.dcl_date_time_string).tolist()
 
     def _build_parsed_values(self, match):
         """
         Extract the data from the relevant regex groups and assign to elements
         of the data dictionary.
         """
-        # Use the date_time_string to calculate an epoch timestamp (seconds
-        # since 1970-01-01)
-        epts = dcl_to_epoch(match.group(1))
-        self.data.time.append(epts)
         self.data.dcl_date_time_string.append(str(match.group(1)))
 
         # Assign the remaining PRESF data to the named parameters
@@ -80,10 +107,8 @@ if __name__ == '__main__':
     presf = Parser(infile)
 
     # load the data into a buffered object and parse the data into a dictionary
-    presf.load_ascii()
-    presf.parse_data()
-
-    # write the resulting Bunch object via the toJSON method to a JSON
+    # (either the whole file, or with the append flag set just the data added
+    # since the last run, skipping files already in the cache if one is set),
+    # and write the resulting Bunch object via the toJSON method to a JSON
     # formatted data file (note, no pretty-printing keeping things compact)
-    with open(outfile, 'w') as f:
-        f.write(presf.data.toJSON())
+    run_parser(presf, outfile, args)
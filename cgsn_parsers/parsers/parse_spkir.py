@@ -13,7 +13,7 @@ from struct import Struct
 
 # Import common utilites and base classes
 from cgsn_parsers.parsers.common import ParserCommon
-from cgsn_parsers.parsers.common import dcl_to_epoch, inputs, DCL_TIMESTAMP, FLOAT, NEWLINE
+from cgsn_parsers.parsers.common import dcl_to_epoch_array, inputs, run_parser, DCL_TIMESTAMP, FLOAT, NEWLINE
 
 # Regex pattern for a line with a DCL time stamp and the OCR-507 data sample
 PATTERN = (
@@ -47,6 +47,9 @@ class Parser(ParserCommon):
     methods to parse the data, and extracts the SPKIR data records from the DCL
     daily log files.
     '''
+    # SATDI7 frame header, found in every record
+    _signature = b'SATDI7'
+
     def __init__(self, infile):
         self.initialize(infile, _parameter_names_spkir)
 
@@ -56,21 +59,18 @@ class Parser(ParserCommon):
         above) in the data object, and parse the data into a pre-defined
         dictionary object created using the Bunch class.
         '''
-        for line in self.raw:
-            match = REGEX.match(line)
-            if match:
-                self._build_parsed_values(match)
+        for match in self.iter_matches(REGEX):
+            self._build_parsed_values(match)
+
+        # convert the DCL timestamps into epoch timestamps (seconds since
+        # 1970-01-01) in a single pass over all of the records
+        self.data.time = dcl_to_epoch_array(self.data.date_time_string).tolist()
 
     def _build_parsed_values(self, match):
         '''
         Extract the data from the relevant regex groups and assign to elements
         of the data dictionary.
         '''
-        # Use the date_time_string to calculate an epoch timestamp (seconds since
-        # 1970-01-01)
-        epts = dcl_to_epoch(match.group(1))
-        self.data.time.append(epts)
-
         self.data.date_time_string.append(str(match.group(1)))
         self.data.serial_number.append(int(match.group(2)))
         self.data.timer.append(float(match.group(3)))
@@ -97,10 +97,8 @@ if __name__ == '__main__':
     spkir = Parser(infile)
 
     # load the data into a buffered object and parse the data into a dictionary
-    spkir.load_ascii()
-    spkir.parse_data()
-
-    # write the resulting Bunch object via the toJSON method to a JSON
+    # (either the whole file, or with the append flag set just the data added
+    # since the last run, skipping files already in the cache if one is set),
+    # and write the resulting Bunch object via the toJSON method to a JSON
     # formatted data file (note, no pretty-printing keeping things compact)
-    with open(outfile, 'w') as f:
-        f.write(spkir.data.toJSON())
+    run_parser(spkir, outfile, args)
@@ -9,14 +9,14 @@
 import os
 import re
 
-from munch import Munch as Bunch
 from calendar import timegm
 from datetime import datetime
 from pytz import timezone
 from struct import unpack
 
 # Import common utilites and base classes
-from cgsn_parsers.parsers.common import ParserCommon, inputs
+from cgsn_parsers.parsers.checksum import check_word_sums
+from cgsn_parsers.parsers.common import ColumnStore, ParserCommon, inputs, run_parser
 
 # Regex pattern for a binary VEL3D data packet;
 VELOCITY_REGEX = b'(\xa5\x10)([\x00-\xff]{22})'     # velocity data packets
@@ -67,27 +67,48 @@ class ParameterNames(object):
             'correlations'
         ]
 
+        # Data types of the parameters, shared by the data types above (the
+        # header and system times are whole seconds, the velocity times are
+        # set from the sample rate)
+        self._types = {
+            'time': 'i8',
+            'date_time_array': 'i2',
+            'records_to_follow': 'u2',
+            'noise_amplitudes': 'u1',
+            'noise_correlations': 'u1',
+            'battery_voltage': 'f8',
+            'speed_of_sound': 'f8',
+            'heading': 'f8',
+            'pitch': 'f8',
+            'roll': 'f8',
+            'temperature': 'f8',
+            'error_code': 'i1',
+            'status_code': 'i1',
+            'ensemble_counter': 'u1',
+            'pressure': 'f8',
+            'velocity_east': 'i2',
+            'velocity_north': 'i2',
+            'velocity_vertical': 'i2',
+            'amplitudes': 'u1',
+            'correlations': 'u1'
+        }
+
     # Create the initial dictionary object from the velocity, system and
     # header data types.
     def create_dict(self):
         '''
-        Create a Bunch class object to store the parameter names for the Nortek
-        Vector (aka VEL3D), with the data organized hierarchically by the
-        data type.
+        Create a ColumnStore (Bunch) class object to store the parameter names
+        for the Nortek Vector (aka VEL3D), with the data organized
+        hierarchically by the data type.
         '''
-        bunch = Bunch()
-        bunch.header = Bunch()
-        bunch.system = Bunch()
-        bunch.velocity = Bunch()
-
-        for name in self._header:
-            bunch.header[name] = []
-
-        for name in self._system:
-            bunch.system[name] = []
+        bunch = ColumnStore()
+        bunch.header = ColumnStore()
+        bunch.system = ColumnStore()
+        bunch.velocity = ColumnStore()
 
-        for name in self._velocity:
-            bunch.velocity[name] = []
+        bunch.header.add_columns(self._header, self._types)
+        bunch.system.add_columns(self._system, self._types)
+        bunch.velocity.add_columns(self._velocity, dict(self._types, time='f8'))
 
         return bunch
 
@@ -98,16 +119,30 @@ class Parser(ParserCommon):
     methods to parse the data, and extracts the VEL3D data records from the DCL
     hourly log files.
     """
+    _state = ['_system_time', '_velocity_count']
+
     def __init__(self, infile, sample_rate):
         # set the infile name and path
         self.infile = infile
         self.sample_rate = sample_rate
 
         # initialize the data dictionary using the names defined above
-        data = ParameterNames()
-        self.data = data.create_dict()
+        self._parameter_names = ParameterNames()
+        self.data = self._parameter_names.create_dict()
         self.raw = None
 
+        # time of the last successfully parsed system packet (None until the
+        # first is found) and the number of velocity packets following it
+        self._system_time = None
+        self._velocity_count = 0
+
+    def parse_data(self):
+        '''
+        Parse the header, system and velocity data packets.
+        '''
+        self.parse_header()
+        self.parse_velocity()
+
     def parse_header(self):
         '''
         Iterate through the record markers (defined via the regex expression
@@ -115,7 +150,13 @@ class Parser(ParserCommon):
         dictionary object created using the Bunch class.
         '''
         # find all the header data packets
-        record_marker = [m.start() for m in HEADER_MATCHER.finditer(self.raw)]
+        with self.metrics.timer('scan'):
+            record_marker = [m.start() for m in HEADER_MATCHER.finditer(self.raw)]
+        self.metrics.count('scanned', len(record_marker))
+        self.metrics.count('matched', len(record_marker))
+
+        # validate the checksums of all the header packets at once
+        valid = list(check_word_sums(self.raw, record_marker, 40))
 
         # if we have header records, then parse them one-by-one
         while record_marker:
@@ -124,7 +165,7 @@ class Parser(ParserCommon):
             stop = start + 42
 
             # parse the header packet
-            self._build_parsed_header(self.raw[start:stop])
+            self._build_parsed_header(self.raw[start:stop], valid.pop(0))
 
             # advance to the next record
             record_marker.pop(0)
@@ -135,59 +176,59 @@ class Parser(ParserCommon):
         above) in the data object, and parse the data file into a pre-defined
         dictionary object created using the Bunch class.
         '''
-        # find all the velocity and system data packets
-        system_marker = [m.start() for m in SYSTEM_MATCHER.finditer(self.raw)]
-        velocity_marker = [m.start() for m in VELOCITY_MATCHER.finditer(self.raw)]
-
-        # if we have system records, then parse them one-by-one
-        while system_marker:
-            # set the start and stop points of the system packet
-            start = system_marker[0]
-            stop = start + 28
-
-            # determine if this is the last system packet
-            if len(system_marker) == 1:
-                last = len(self.raw)
-            else:
-                last = system_marker[1]
-
-            # parse the system packet and set the counter
-            system = self._build_parsed_system(self.raw[start:stop])
-            time = self.data.system['time'][-1]
-            cnt = 0
+        # find all the velocity and system data packets, working through them
+        # in the order they appear in the file
+        with self.metrics.timer('scan'):
+            system = [m.start() for m in SYSTEM_MATCHER.finditer(self.raw)]
+            velocity = [m.start() for m in VELOCITY_MATCHER.finditer(self.raw)]
+            record_marker = sorted([(start, 'system') for start in system] +
+                                   [(start, 'velocity') for start in velocity])
+        self.metrics.count('scanned', len(record_marker))
+        self.metrics.count('matched', len(record_marker))
+
+        # validate the checksums of all the system and velocity packets at once
+        valid = dict(zip(system, check_word_sums(self.raw, system, 26)))
+        valid.update(zip(velocity, check_word_sums(self.raw, velocity, 22)))
+
+        for start, packet in record_marker:
+            if packet == 'system':
+                # parse the system packet and reset the counter
+                if self._build_parsed_system(self.raw[start:start + 28], valid[start]):
+                    self._system_time = self.data.system['time'][-1]
+                else:
+                    self._system_time = None
+                self._velocity_count = 0
+                continue
 
             # the system packet precedes the velocity packets, starting with
-            # the first successfully parsed system packet, find the
+            # the first successfully parsed system packet, parse the
             # corresponding velocity packets
-            if system:
-                while velocity_marker:
-                    # make sure the first velocity packet comes after the first
-                    # system packet
-                    if velocity_marker[0] < start:
-                        velocity_marker.pop(0)
-                        continue
-                    # make sure we don't process past the next system.
-                    if velocity_marker[0] > last:
-                        break
-
-                    # set the start and stop points and process the packet
-                    vstrt = velocity_marker[0]
-                    vstop = vstrt + 24
-                    self._build_parsed_velocity(self.raw[vstrt:vstop])
-
-                    # use the counter and the time of the system packet to
-                    # generate a time record for the velocity packets.
-                    vtime = float(time) + (float(cnt) * 1/self.sample_rate)
-                    self.data.velocity.time.append(vtime)
-
-                    # advance to the next velocity record
-                    velocity_marker.pop(0)
-                    cnt += 1
-
-            # advance to the next system record
-            system_marker.pop(0)
-
-    def _build_parsed_header(self, header):
+            if self._system_time is None:
+                continue
+
+            self._build_parsed_velocity(self.raw[start:start + 24], valid[start])
+
+            # use the counter and the time of the system packet to generate a
+            # time record for the velocity packets.
+            cnt = self._velocity_count
+            vtime = float(self._system_time) + (float(cnt) * 1/self.sample_rate)
+            self.data.velocity.time.append(vtime)
+            self._velocity_count += 1
+
+    def _split_batch(self, buf):
+        '''
+        Split the block of data read in by iter_batches after the last
+        complete packet, carrying over the bytes that may hold the start of a
+        partial packet.
+        '''
+        end = 0
+        for matcher in (HEADER_MATCHER, SYSTEM_MATCHER, VELOCITY_MATCHER):
+            for match in matcher.finditer(buf):
+                end = max(end, match.end())
+
+        return max(end, len(buf) - 41)
+
+    def _build_parsed_header(self, header, valid):
         '''
         Extract the data from the relevant byte groupings and assign to
         elements of the data dictionary.
@@ -195,17 +236,19 @@ class Parser(ParserCommon):
         # unpack the header packet
         (_, _, size, minute, second, day, hour, year, month, records,
          noise1, noise2, noise3, _, corr1, corr2, corr3,
-         _, _, check) = unpack('<2BH6BH4B4B20sH', header)
+         _, _, _) = unpack('<2BH6BH4B4B20sH', header)
 
         # Check the size, some packets report erroneous sizes for some reason.
         if size * 2 != 42:
             print("Incorrect packet size")
             print("header data packet failed to parse")
+            self.metrics.count('rejected_size')
             return False
 
         # Check the checksums.
-        if check != self._calc_checksum(size * 2, header):
+        if not valid:
             print("Checksum mismatch")
+            self.metrics.count('rejected_checksum')
             return False
 
         # calculate an epoch timestamp from the time array, first converting
@@ -232,7 +275,7 @@ class Parser(ParserCommon):
         self.data.header.noise_correlations.append([corr1, corr2, corr3])
         return True
 
-    def _build_parsed_system(self, system):
+    def _build_parsed_system(self, system, valid):
         '''
         Extract the data from the relevant byte groupings and assign to
         elements of the data dictionary.
@@ -240,16 +283,18 @@ class Parser(ParserCommon):
         # unpack the system packet
         (_, _, size, minute, second, day, hour, year, month,
          battery, speed, heading, pitch, roll, temp, error, status,
-         _, check) = unpack('<2BH6B2H4h2b2H', system)
+         _, _) = unpack('<2BH6B2H4h2b2H', system)
 
         # Check the size, some packets report erroneous sizes for some reason.
         if size * 2 != 28:
             print("Incorrect packet size")
+            self.metrics.count('rejected_size')
             return False
 
         # Check the checksums...
-        if check != self._calc_checksum(size * 2, system):
+        if not valid:
             print("Checksum mismatch")
+            self.metrics.count('rejected_checksum')
             return False
 
         # calculate an epoch timestamp from the time array, first converting
@@ -281,24 +326,26 @@ class Parser(ParserCommon):
         self.data.system.status_code.append(status)
         return True
 
-    def _build_parsed_velocity(self, velocity):
+    def _build_parsed_velocity(self, velocity, valid):
         '''
         Extract the data from the relevant byte groupings and assign to
         elements of the data dictionary.
         '''
         # parse the velocity packet
         (_, _, _, count, pMSB, _, pLSW, _, vel1, vel2, vel3, amp1, amp2, amp3,
-         cor1, cor2, cor3, check) = unpack('<6B2H3h6BH', velocity)
+         cor1, cor2, cor3, _) = unpack('<6B2H3h6BH', velocity)
 
         # Check the size, some packets report erroneous sizes for some reason.
         size = len(velocity)
         if size != 24:
             print("Incorrect packet size")
+            self.metrics.count('rejected_size')
             return False
 
         # Check the checksums...
-        if check != self._calc_checksum(size, velocity):
+        if not valid:
             print("Checksum mismatch")
+            self.metrics.count('rejected_checksum')
             return False
 
         # calculate the pressure value
@@ -314,22 +361,6 @@ class Parser(ParserCommon):
         self.data.velocity.correlations.append([cor1, cor2, cor3])
         return True
 
-    def _calc_checksum(self, length, record):
-        """
-        Calculate the checksum for the data record
-        """
-        # The base value of the checksum, given in the manual
-        # base = int('0xb58c', 16) = 46476
-        base = 46476
-
-        # Add up the uint16 integers in the packet, minus the checksum
-        for x in range(0, length-2, 2):
-            base += unpack('<H', record[x:x+2])[0]
-
-        # Modulo 65536 is applied to the checksum to keep it a 16 bit value
-        checksum = base % 65536
-        return checksum
-
     def _convert_bcd(self, cBCD):
         '''
         Convert the BCD values to integers
@@ -351,12 +382,9 @@ if __name__ == '__main__':
     # initialize the Parser object for vel3d
     vel3d = Parser(infile, sample_rate)
 
-    # load the data into a buffered object and parse the data into dictionaries
-    vel3d.load_binary()
-    vel3d.parse_header()
-    vel3d.parse_velocity()
-
-    # write the resulting Bunch object via the toJSON method to a JSON
+    # load the data into a buffered object and parse the data into a dictionary
+    # (either the whole file, or with the append flag set just the data added
+    # since the last run, skipping files already in the cache if one is set),
+    # and write the resulting Bunch object via the toJSON method to a JSON
     # formatted data file (note, no pretty-printing keeping things compact)
-    with open(outfile, 'w') as f:
-        f.write(vel3d.data.toJSON())
+    run_parser(vel3d, outfile, args)
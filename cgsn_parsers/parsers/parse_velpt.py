@@ -9,14 +9,14 @@
 import os
 import re
 
-from munch import Munch as Bunch
 from calendar import timegm
 from datetime import datetime
 from pytz import timezone
 from struct import unpack
 
 # Import common utilites and base classes
-from cgsn_parsers.parsers.common import ParserCommon, inputs
+from cgsn_parsers.parsers.checksum import check_word_sums
+from cgsn_parsers.parsers.common import ColumnStore, ParserCommon, inputs, run_parser
 
 # Regex pattern for a binary VELPT data packet;
 VELOCITY_REGEX = b'(\xa5\x01)([\x00-\xff]{40})'     # velocity data packets
@@ -63,25 +63,48 @@ class ParameterNames(object):
             'amplitude_beam3'
         ]
 
+        # Data types of the parameters, shared by the data types above
+        self._types = {
+            'time': 'i8',
+            'records_to_follow': 'u2',
+            'cell_number': 'u2',
+            'noise_amplitudes': 'u1',
+            'processing_magnitudes': 'u2',
+            'beam_distances': 'u2',
+            'date_time_array': 'i2',
+            'error_code': 'i2',
+            'battery_voltage': 'f8',
+            'speed_of_sound': 'f8',
+            'heading': 'f8',
+            'pitch': 'f8',
+            'roll': 'f8',
+            'pressure': 'f8',
+            'status_code': 'i1',
+            'temperature': 'f8',
+            'velocity_east': 'i2',
+            'velocity_north': 'i2',
+            'velocity_vertical': 'i2',
+            'amplitude_beam1': 'u1',
+            'amplitude_beam2': 'u1',
+            'amplitude_beam3': 'u1'
+        }
+
     # Create the initial dictionary object from the velocity, diagnostics and
     # diagnostics data header data types.
     def create_dict(self):
         '''
-        Create a Bunch class object to store the parameter names for the Nortek
-        Aquadopp (aka VELPT), with the data organized hierarchically by the
-        data type.
+        Create a ColumnStore (Bunch) class object to store the parameter names
+        for the Nortek Aquadopp (aka VELPT), with the data organized
+        hierarchically by the data type.
         '''
-        bunch = Bunch()
-        bunch.header = Bunch()
-        bunch.diagnostics = Bunch()
-        bunch.velocity = Bunch()
-
-        for name in self._header:
-            bunch.header[name] = []
+        bunch = ColumnStore()
+        bunch.header = ColumnStore()
+        bunch.diagnostics = ColumnStore()
+        bunch.velocity = ColumnStore()
 
-        for name in self._packet:
-            bunch.diagnostics[name] = []
-            bunch.velocity[name] = []
+        bunch.header.add_columns(self._header, self._types)
+        bunch.diagnostics.add_columns(self._packet, self._types)
+        bunch.velocity.add_columns(self._packet, self._types)
 
         return bunch
 
@@ -92,15 +115,28 @@ class Parser(ParserCommon):
     methods to parse the data, and extracts the VELPT data records from the DCL
     daily log files.
     """
+    _state = ['_diagnostics_count']
+
     def __init__(self, infile):
         # set the infile name and path
         self.infile = infile
 
         # initialize the data dictionary using the names defined above
-        data = ParameterNames()
-        self.data = data.create_dict()
+        self._parameter_names = ParameterNames()
+        self.data = self._parameter_names.create_dict()
         self.raw = None
 
+        # number of diagnostics packets following the last header packet (None
+        # until the first header is found)
+        self._diagnostics_count = None
+
+    def parse_data(self):
+        '''
+        Parse the velocity, and the diagnostics header and data packets.
+        '''
+        self.parse_velocity()
+        self.parse_diagnostics()
+
     def parse_velocity(self):
         '''
         Iterate through the record markers (defined via the regex expression
@@ -108,7 +144,13 @@ class Parser(ParserCommon):
         dictionary object created using the Bunch class.
         '''
         # find all the velocity data packets
-        record_marker = [m.start() for m in VELOCITY_MATCHER.finditer(self.raw)]
+        with self.metrics.timer('scan'):
+            record_marker = [m.start() for m in VELOCITY_MATCHER.finditer(self.raw)]
+        self.metrics.count('scanned', len(record_marker))
+        self.metrics.count('matched', len(record_marker))
+
+        # validate the checksums of all the velocity packets at once
+        valid = list(check_word_sums(self.raw, record_marker, 40))
 
         # if we have velocity records, then parse them one-by-one
         while record_marker:
@@ -117,7 +159,7 @@ class Parser(ParserCommon):
             stop = start + 42
 
             # parse the velocity packet
-            self._build_parsed_velocity(self.raw[start:stop])
+            self._build_parsed_velocity(self.raw[start:stop], valid.pop(0))
 
             # advance to the next record
             record_marker.pop(0)
@@ -128,61 +170,60 @@ class Parser(ParserCommon):
         above) in the data object, and parse the data file into a pre-defined
         dictionary object created using the Bunch class.
         '''
-        # find all the diagnostics data header packets
-        header_marker = [m.start() for m in HEADER_MATCHER.finditer(self.raw)]
-        diagnostics_marker = [m.start() for m in DIAGNOSTICS_MATCHER.finditer(self.raw)]
-
-        # if we have header records, then parse them one-by-one
-        while header_marker:
-            # set the start and stop points of the header packet
-            start = header_marker[0]
-            stop = start + 36
-
-            # determine if this is the last packet
-            if len(header_marker) == 1:
-                last = len(self.raw)
-            else:
-                last = header_marker[1]
-
-            # parse the header packet and set the counter
-            self._build_parsed_header(self.raw[start:stop])
-            cnt = 0
+        # find all the diagnostics data header and data packets, working
+        # through them in the order they appear in the file
+        with self.metrics.timer('scan'):
+            header = [m.start() for m in HEADER_MATCHER.finditer(self.raw)]
+            diagnostics = [m.start() for m in DIAGNOSTICS_MATCHER.finditer(self.raw)]
+            record_marker = sorted([(start, 'header') for start in header] +
+                                   [(start, 'diagnostics') for start in diagnostics])
+        self.metrics.count('scanned', len(record_marker))
+        self.metrics.count('matched', len(record_marker))
+
+        # validate the checksums of all the header and diagnostics packets at once
+        valid = dict(zip(header, check_word_sums(self.raw, header, 34)))
+        valid.update(zip(diagnostics, check_word_sums(self.raw, diagnostics, 40)))
+
+        for start, packet in record_marker:
+            if packet == 'header':
+                # parse the header packet and reset the counter
+                self._build_parsed_header(self.raw[start:start + 36], valid[start])
+                self._diagnostics_count = 0
+                continue
 
             # the header packet precedes the diagnostic packets, starting with
-            # the first header packet, find the first diagnostic packet...
-            while diagnostics_marker:
-                # make sure the first packet comes after the first header
-                if diagnostics_marker[0] < start:
-                    diagnostics_marker.pop(0)
-                    continue
-                # make sure we don't process past the next header.
-                if diagnostics_marker[0] > last:
-                    break
-
-                # set the start and stop points and process the packet
-                dstrt = diagnostics_marker[0]
-                dstop = dstrt + 42
-                self._build_parsed_diagnostics(self.raw[dstrt:dstop])
-
-                # advance to the next diagnostics record
-                diagnostics_marker.pop(0)
-
-                # check the counter, if this is the first packet, use its time
-                # record for the header.
-                cnt += 1
-                if cnt == 1:
-                    self.data.header.time.append(self.data.diagnostics.time[-1])
-
-            # advance to the next header record
-            header_marker.pop(0)
-
-    def _build_parsed_diagnostics(self, diagnostics):
+            # the first header packet, parse the diagnostic packets
+            if self._diagnostics_count is None:
+                continue
+
+            self._build_parsed_diagnostics(self.raw[start:start + 42], valid[start])
+
+            # check the counter, if this is the first packet, use its time
+            # record for the header.
+            self._diagnostics_count += 1
+            if self._diagnostics_count == 1:
+                self.data.header.time.append(self.data.diagnostics.time[-1])
+
+    def _split_batch(self, buf):
+        '''
+        Split the block of data read in by iter_batches after the last
+        complete packet, carrying over the bytes that may hold the start of a
+        partial packet.
+        '''
+        end = 0
+        for matcher in (VELOCITY_MATCHER, HEADER_MATCHER, DIAGNOSTICS_MATCHER):
+            for match in matcher.finditer(buf):
+                end = max(end, match.end())
+
+        return max(end, len(buf) - 41)
+
+    def _build_parsed_diagnostics(self, diagnostics, valid):
         '''
         Extract the data from the relevant byte groupings and assign to
         elements of the data dictionary.
         '''
         # parse the diagnostics packet
-        data = self._parse_aquadopp_packet(diagnostics)
+        data = self._parse_aquadopp_packet(diagnostics, valid)
         if not data:
             print "diagnostics data packet failed to parse"
             return
@@ -206,7 +247,7 @@ class Parser(ParserCommon):
         self.data.diagnostics.amplitude_beam2.append(data[15])
         self.data.diagnostics.amplitude_beam3.append(data[16])
 
-    def _build_parsed_header(self, header):
+    def _build_parsed_header(self, header, valid):
         '''
         Extract the data from the relevant byte groupings and assign to
         elements of the data dictionary.
@@ -214,17 +255,19 @@ class Parser(ParserCommon):
         # unpack the velocity packet
         (_, _, size, records, cell, noise1, noise2, noise3, noise4,
          proc1, proc2, proc3, proc4, dist1, dist2, dist3, dist4,
-         _, _, _, _, _, _, check) = unpack('<2B3H4B4H4H6bH', header)
+         _, _, _, _, _, _, _) = unpack('<2B3H4B4H4H6bH', header)
 
         # Check the size, some packets report erroneous sizes for some reason.
         if size * 2 != 36:
             print "Incorrect packet size"
             print "header data packet failed to parse"
+            self.metrics.count('rejected_size')
             return
 
         # Check the checksums...
-        if check != self._calc_checksum(size * 2, header):
+        if not valid:
             print "Checksum mismatch"
+            self.metrics.count('rejected_checksum')
             return
 
         self.data.header.records_to_follow.append(records)
@@ -233,13 +276,13 @@ class Parser(ParserCommon):
         self.data.header.processing_magnitudes.append([proc1, proc2, proc3, proc4])
         self.data.header.beam_distances.append([dist1, dist2, dist3, dist4])
 
-    def _build_parsed_velocity(self, velocity):
+    def _build_parsed_velocity(self, velocity, valid):
         '''
         Extract the data from the relevant byte groupings and assign to
         elements of the data dictionary.
         '''
         # parse the velocity packet
-        data = self._parse_aquadopp_packet(velocity)
+        data = self._parse_aquadopp_packet(velocity, valid)
         if not data:
             print "Velocity data packet failed to parse"
             return
@@ -263,7 +306,7 @@ class Parser(ParserCommon):
         self.data.velocity.amplitude_beam2.append(data[15])
         self.data.velocity.amplitude_beam3.append(data[16])
 
-    def _parse_aquadopp_packet(self, packet):
+    def _parse_aquadopp_packet(self, packet, valid):
         '''
         Unpack the Aquadopp velocity data packet. Same structure is used for
         both the velocity (0xA501) and diagnostics (0xA580) packets.
@@ -272,16 +315,18 @@ class Parser(ParserCommon):
         (_, _, size, minute, second, day, hour, year, month,
          error, _, battery, speed, heading, pitch, roll, pMSB,
          status, pLSW, temp, vel1, vel2, vel3, amp1, amp2, amp3, _,
-         check) = unpack('<2BH6B2h2H3hBbHh3h3BbH', packet)
+         _) = unpack('<2BH6B2h2H3hBbHh3h3BbH', packet)
 
         # Check the size, some packets report erroneous sizes for some reason.
         if size * 2 != 42:
             print "Incorrect packet size"
+            self.metrics.count('rejected_size')
             return []
 
         # Check the checksums...
-        if check != self._calc_checksum(size * 2, packet):
+        if not valid:
             print "Checksum mismatch"
+            self.metrics.count('rejected_checksum')
             return []
 
         # calculate an epoch timestamp from the time array, first converting
@@ -308,22 +353,6 @@ class Parser(ParserCommon):
                 pitch, roll, dbar, status, temp, vel1, vel2, vel3,
                 amp1, amp2, amp3]
 
-    def _calc_checksum(self, length, record):
-        """
-        Calculate the checksum for the data record
-        """
-        # The base value of the checksum, given in the manual
-        # base = int('0xb58c', 16) = 46476
-        base = 46476
-
-        # Add up the uint16 integers in the packet, minus the checksum
-        for x in range(0, length-2, 2):
-            base += unpack('<H', record[x:x+2])[0]
-
-        # Modulo 65536 is applied to the checksum to keep it a 16 bit value
-        checksum = base % 65536
-        return checksum
-
     def _convert_bcd(self, cBCD):
         '''
         Convert the BCD values to integers
@@ -344,12 +373,9 @@ if __name__ == '__main__':
     # initialize the Parser object for velpt
     velpt = Parser(infile)
 
-    # load the data into a buffered object and parse the data into dictionaries
-    velpt.load_binary()
-    velpt.parse_velocity()
-    velpt.parse_diagnostics()
-
-    # write the resulting Bunch object via the toJSON method to a JSON
+    # load the data into a buffered object and parse the data into a dictionary
+    # (either the whole file, or with the append flag set just the data added
+    # since the last run, skipping files already in the cache if one is set),
+    # and write the resulting Bunch object via the toJSON method to a JSON
     # formatted data file (note, no pretty-printing keeping things compact)
-    with open(outfile, 'w') as f:
-        f.write(velpt.data.toJSON())
+    run_parser(velpt, outfile, args)
@@ -11,7 +11,7 @@ import re
 
 # Import common utilites and base classes
 from cgsn_parsers.parsers.common import ParserCommon
-from cgsn_parsers.parsers.common import dcl_to_epoch, inputs, DCL_TIMESTAMP, STRING, NEWLINE
+from cgsn_parsers.parsers.common import dcl_to_epoch_array, inputs, run_parser, DCL_TIMESTAMP, STRING, NEWLINE
 
 # Set regex string to just find the ZPLSC data.
 PATTERN = (
@@ -48,6 +48,9 @@ class Parser(ParserCommon):
     methods to parse the data, and extracts the ZPLSC data records from the DCL
     daily log files.
     '''
+    # transmission time stamp leader, found in every record
+    _signature = b'@D'
+
     def __init__(self, infile):
         self.initialize(infile, _parameter_names_zplsc)
 
@@ -57,20 +60,18 @@ class Parser(ParserCommon):
         above) in the data object, and parse the data into a pre-defined
         dictionary object created using the Bunch class.
         '''
-        for line in self.raw:
-            match = REGEX.match(line)
-            if match:
-                self._build_parsed_values(match)
+        for match in self.iter_matches(REGEX):
+            self._build_parsed_values(match)
+
+        # convert the DCL timestamps into epoch timestamps (seconds since
+        # 1970-01-01) in a single pass over all of the records
+        self.data.time = dcl_to_epoch_array(self.data.dcl_date_time_string).tolist()
 
     def _build_parsed_values(self, match):
         '''
         Extract the data from the relevant regex groups and assign to elements
         of the data dictionary.
         '''
-        # Use the date_time_string to calculate an epoch timestamp (seconds
-        # since 1970-01-01)
-        epts = dcl_to_epoch(match.group(1))
-        self.data.time.append(epts)
         self.data.dcl_date_time_string.append(str(match.group(1)))
 
         # Assign the remaining ZPLSC data to the named parameters
@@ -138,10 +139,8 @@ if __name__ == '__main__':
     zplsc = Parser(infile)
 
     # load the data into a buffered object and parse the data into a dictionary
-    zplsc.load_ascii()
-    zplsc.parse_data()
-
-    # write the resulting Bunch object via the toJSON method to a JSON
+    # (either the whole file, or with the append flag set just the data added
+    # since the last run, skipping files already in the cache if one is set),
+    # and write the resulting Bunch object via the toJSON method to a JSON
     # formatted data file (note, no pretty-printing keeping things compact)
-    with open(outfile, 'w') as f:
-        f.write(zplsc.data.toJSON())
+    run_parser(zplsc, outfile, args)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@package cgsn_parsers.parsers.registry
+@file cgsn_parsers/parsers/registry.py
+@author Christopher Wingard
+@brief Registry of the parsers, used to select the parser (and the switch for
+    those parsers with more than one variant) for a log file from the file
+    name and the first few KB of the file contents.
+'''
+import fnmatch
+import importlib
+import os
+import re
+
+# Log file name patterns (YYYYMMDD[_HHMMSS].<instrument>.log) and the parsers
+# used for them. The supervisor files are named the same for the CPMs and the
+# DCLs, and are separated by the directory they are found in. Binary PD0 files
+# recovered from the ADCPs are also parsed by the adcp parser.
+PATTERNS = [
+    ('*.adcp*.log', 'adcp'),
+    ('*.pd0', 'adcp'),
+    ('*.PD0', 'adcp'),
+    ('*.ctdbp*.log', 'ctdbp'),
+    ('*.dosta*.log', 'dosta'),
+    ('*.fdchp*.log', 'fdchp'),
+    ('*.flort*.log', 'flort'),
+    ('*.gps*.log', 'gps'),
+    ('*.hyd*.log', 'hydgn'),
+    ('*.metbk*.log', 'metbk'),
+    ('*.mopak*.log', 'mopak'),
+    ('*.nutnr*.log', 'nutnr'),
+    ('*.optaa*.log', 'optaa'),
+    ('*.pco2a*.log', 'pco2a'),
+    ('*.pco2w*.log', 'pco2w'),
+    ('*.phsen*.log', 'phsen'),
+    ('*.presf*.log', 'presf'),
+    ('*.pwrsys*.log', 'pwrsys'),
+    ('*.spkir*.log', 'spkir'),
+    ('*.superv*.log', 'superv'),
+    ('*.vel3d*.log', 'vel3d'),
+    ('*.velpt*.log', 'velpt'),
+    ('*.wavss*.log', 'wavss'),
+    ('*.zplsc*.log', 'zplsc')
+]
+
+# Switch values used by the harvester scripts, for when the variant cannot be
+# detected from the file contents (e.g. an empty or partial file)
+SWITCHES = {
+    'ctdbp': 2,     # CTD with an attached DOSTA
+    'nutnr': 1,     # full spectral frames
+    'vel3d': 8      # 8 Hz sampling
+}
+
+# Amount of data (in bytes) read from the start of the file to detect the variant
+SNIFF_BYTES = 64 * 1024
+
+# Sampling rates (in Hz) available on the Nortek Vector (VEL3D)
+VEL3D_RATES = [1, 2, 4, 8, 16, 32, 64]
+
+
+def _read_head(infile, size=SNIFF_BYTES):
+    '''
+    Read the first part of a log file.
+    '''
+    with open(infile, 'rb') as f:
+        return f.read(size)
+
+
+def _sniff_ctdbp(head):
+    '''
+    Return the CTDBP type (1 = CTD only, 2 = with a DOSTA, 3 = with a FLORT)
+    matching the most records.
+    '''
+    from cgsn_parsers.parsers.parse_ctdbp import CTDBP1, CTDBP2, CTDBP3
+
+    counts = [(len(re.findall(pattern, head, re.DOTALL)), ctd_type)
+              for ctd_type, pattern in [(1, CTDBP1), (2, CTDBP2), (3, CTDBP3)]]
+    count, ctd_type = max(counts)
+    return ctd_type if count else None
+
+
+def _sniff_nutnr(head):
+    '''
+    Return the NUTNR spectra flag, 1 if the SATN frames are the full frames
+    (with the spectral channels) and 0 if they are the condensed frames.
+    '''
+    from cgsn_parsers.parsers.parse_nutnr import REGEX
+
+    fields = [len(match.group(4).split(',')) for match in REGEX.finditer(head)]
+    if not fields:
+        return None
+
+    return 1 if max(fields) > 19 else 0
+
+
+def _sniff_vel3d(head):
+    '''
+    Return the VEL3D sampling rate, using the median number of velocity packets
+    recorded between the once a second system packets.
+    '''
+    from cgsn_parsers.parsers.parse_vel3d import SYSTEM_MATCHER, VELOCITY_MATCHER
+
+    system = [m.start() for m in SYSTEM_MATCHER.finditer(head)]
+    velocity = [m.start() for m in VELOCITY_MATCHER.finditer(head)]
+    counts = sorted(len([v for v in velocity if start < v < stop])
+                    for start, stop in zip(system[:-1], system[1:]))
+    if not counts or not counts[len(counts) // 2]:
+        return None
+
+    count = counts[len(counts) // 2]
+    return min(VEL3D_RATES, key=lambda rate: abs(rate - count))
+
+
+SNIFFERS = {
+    'ctdbp': _sniff_ctdbp,
+    'nutnr': _sniff_nutnr,
+    'vel3d': _sniff_vel3d
+}
+
+
+def match_name(infile):
+    '''
+    Return the name of the parser for a log file, based on the file name (and
+    for the supervisor files the directory), or None if there is no match.
+    '''
+    filename = os.path.basename(infile)
+    for pattern, parser in PATTERNS:
+        if fnmatch.fnmatch(filename, pattern):
+            break
+    else:
+        return None
+
+    if parser == 'superv':
+        # the DCL supervisor files are found under the dclNN directories, the
+        # CPM supervisor files under the superv or cpmN/superv directories
+        dirs = os.path.abspath(infile).split(os.sep)[:-1]
+        if any(re.match(r'^dcl\d+$', name) for name in dirs):
+            return 'superv_dcl'
+        return 'superv_cpm'
+
+    return parser
+
+
+def sniff_switch(parser, infile):
+    '''
+    Detect the switch value for a parser from the first few KB of the log file,
+    returning None if the parser does not use one or it cannot be determined.
+    '''
+    if parser not in SNIFFERS:
+        return None
+
+    return SNIFFERS[parser](_read_head(infile))
+
+
+def detect(infile):
+    '''
+    Return the name of the parser and the switch value (None for the parsers
+    without one) to use for a log file. The switch falls back to the value used
+    by the harvester scripts if it cannot be detected. Raises a ValueError if
+    the file name does not match any of the parsers.
+    '''
+    parser = match_name(infile)
+    if parser is None:
+        raise ValueError('Unable to find a parser for %s' % infile)
+
+    switch = sniff_switch(parser, infile)
+    if switch is None:
+        switch = SWITCHES.get(parser)
+
+    return parser, switch
+
+
+def get_parser(name):
+    '''
+    Return the Parser class for a parser name, importing the module on first use.
+    '''
+    module = importlib.import_module('cgsn_parsers.parsers.parse_' + name)
+    return module.Parser
+
+
+def create_parser(infile, name=None, switch=None):
+    '''
+    Create the Parser object for a log file, detecting the parser and switch
+    from the file if they are not given.
+    '''
+    if name is None:
+        name, detected = detect(infile)
+        if switch is None:
+            switch = detected
+    elif switch is None:
+        switch = sniff_switch(name, infile)
+        if switch is None:
+            switch = SWITCHES.get(name)
+
+    if switch is None:
+        return get_parser(name)(infile)
+
+    return get_parser(name)(infile, switch)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@package cgsn_parsers.parsers.summary
+@file cgsn_parsers/parsers/summary.py
+@author Christopher Wingard
+@brief Streaming statistics (mean, standard deviation, minimum and maximum) of
+    the parsed data over fixed time intervals, used to reduce high rate data
+    (e.g. the 10 Hz MOPAK data) to a compact summary for monitoring.
+'''
+import numpy as np
+import os
+
+from munch import Munch as Bunch
+
+# Statistics calculated for each parameter
+STATISTICS = ['mean', 'std', 'min', 'max']
+
+
+class IntervalStats(object):
+    '''
+    Accumulates the statistics of a set of parameters over fixed time
+    intervals (e.g. per minute), from any number of blocks of parsed data, so
+    the full rate data never needs to be held in memory at once.
+
+    Each block of data is reduced to the count, mean, sum of squared
+    differences from the mean (M2), minimum and maximum for each interval,
+    which are then merged into the running values using the pairwise form of
+    Welford's algorithm (Chan et al., 1979). This avoids the loss of precision
+    of accumulating sums of squares, and gives the same results whether the
+    data is added in one block or many, in any order.
+    '''
+    def __init__(self, names, interval=60.):
+        self.names = list(names)
+        self.interval = float(interval)
+        self.bins = np.zeros(0, dtype=np.int64)
+        self.count = np.zeros(0, dtype=np.int64)
+        self._mean = dict((name, np.zeros(0)) for name in self.names)
+        self._m2 = dict((name, np.zeros(0)) for name in self.names)
+        self._min = dict((name, np.zeros(0)) for name in self.names)
+        self._max = dict((name, np.zeros(0)) for name in self.names)
+
+    def update(self, data):
+        '''
+        Add a block of parsed data (a Bunch, ColumnStore or dictionary with
+        the time and the named parameters) to the statistics.
+        '''
+        time = np.asarray(data['time'], dtype=np.float64)
+        if not len(time):
+            return self
+
+        # group the records by interval
+        bins = np.floor(time / self.interval).astype(np.int64)
+        order = np.argsort(bins, kind='mergesort')
+        bins, first, count = np.unique(bins[order], return_index=True, return_counts=True)
+
+        # place the running and new values for each interval in a common set
+        # of intervals
+        merged = np.union1d(self.bins, bins)
+        old = np.searchsorted(merged, self.bins)
+        new = np.searchsorted(merged, bins)
+        na = np.zeros(len(merged))
+        na[old] = self.count
+        nb = np.zeros(len(merged))
+        nb[new] = count
+        n = na + nb
+
+        for name in self.names:
+            values = np.asarray(data[name], dtype=np.float64)[order]
+            mean = np.add.reduceat(values, first) / count
+            delta = values - np.repeat(mean, count)
+            m2 = np.add.reduceat(delta * delta, first)
+
+            ma = _expand(self._mean[name], old, len(merged), 0.)
+            mb = _expand(mean, new, len(merged), 0.)
+            delta = mb - ma
+            self._mean[name] = ma + delta * nb / n
+            self._m2[name] = (_expand(self._m2[name], old, len(merged), 0.) + _expand(m2, new, len(merged), 0.) +
+                              delta * delta * na * nb / n)
+            self._min[name] = np.fmin(_expand(self._min[name], old, len(merged), np.nan),
+                                      _expand(np.minimum.reduceat(values, first), new, len(merged), np.nan))
+            self._max[name] = np.fmax(_expand(self._max[name], old, len(merged), np.nan),
+                                      _expand(np.maximum.reduceat(values, first), new, len(merged), np.nan))
+
+        self.bins = merged
+        self.count = n.astype(np.int64)
+        return self
+
+    def result(self):
+        '''
+        Return the statistics as a Bunch, with the start time of each interval
+        (seconds since 1970-01-01), the number of records in each, and the
+        mean, (population) standard deviation, minimum and maximum of each
+        parameter grouped by statistic.
+        '''
+        summary = Bunch(time=self.bins * self.interval, interval=self.interval, count=self.count)
+        for stat in STATISTICS:
+            summary[stat] = Bunch()
+
+        for name in self.names:
+            summary.mean[name] = self._mean[name]
+            summary.std[name] = np.sqrt(self._m2[name] / np.maximum(self.count, 1))
+            summary.min[name] = self._min[name]
+            summary.max[name] = self._max[name]
+
+        return summary
+
+
+def _expand(values, index, size, fill):
+    '''
+    Place the values at the index in an array of the given size, with the
+    other elements set to the fill value.
+    '''
+    expanded = np.full(size, fill)
+    expanded[index] = values
+    return expanded
+
+
+def summary_filename(outfile):
+    '''
+    Return the name of the summary file saved next to the output file, e.g.
+    20170101_000000.mopak.summary.json for 20170101_000000.mopak.json.
+    '''
+    base = outfile[:-3] if outfile.endswith('.gz') else outfile
+    root, ext = os.path.splitext(base)
+    if ext not in ('.json', '.nc'):
+        root = base
+
+    return root + '.summary.json' + ('.gz' if outfile.endswith('.gz') else '')
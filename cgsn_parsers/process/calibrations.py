@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@package cgsn_parsers.process.calibrations
+@file cgsn_parsers/process/calibrations.py
+@author Christopher Wingard
+@brief Local store of the instrument calibration coefficients, with an offline
+    mirror of the OOI asset management calibration files.
+'''
+import json
+import numpy as np
+import os
+import re
+import shutil
+
+from collections import OrderedDict
+
+# Location of the calibration files maintained on GitHub by the OOI CI team
+ASSET_MANAGEMENT_URL = 'https://github.com/ooi-integration/asset-management/raw/master/calibration'
+
+# Calibration file names (<instrument class>-<serial number>__<cal date>, e.g.
+# CGINS-OPTAAJ-00138__20150410.csv), with any arrays held in separate files
+# (e.g. CGINS-OPTAAJ-00138__20150410__CC_taarray.ext)
+NAME_REGEX = re.compile(r'^(?P<class>.+)-(?P<serial>[^-]+)__(?P<date>\d{8})(__.*)?\.(csv|ext)$')
+
+# Number of calibrations held in memory by each process, shared by all of the
+# stores (see CalibrationStore.load)
+CACHE_SIZE = 32
+
+# Coefficients loaded so far, most recently used last, keyed on the directory
+# they were loaded from
+_CACHE = OrderedDict()
+
+
+def parse_name(name):
+    '''
+    Return the key (instrument class, serial number and calibration date) for
+    an asset management calibration file name or URL, or None if the name does
+    not follow the naming convention.
+    '''
+    match = NAME_REGEX.match(os.path.basename(name))
+    if not match:
+        return None
+
+    return match.group('class'), match.group('serial'), match.group('date')
+
+
+def _write(filename, text):
+    '''
+    Write to a temporary file and rename it, so other processes sharing the
+    store never see a partially written file.
+    '''
+    tmpfile = '%s.%d.tmp' % (filename, os.getpid())
+    with open(tmpfile, 'wb') as f:
+        f.write(text)
+    os.rename(tmpfile, filename)
+
+
+def _makedirs(path):
+    '''
+    Create a directory (and any parents), if it does not already exist.
+    '''
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
+
+class CalibrationStore(object):
+    '''
+    A directory holding a local mirror of the asset management calibration
+    files (under mirror/, using the same <class>/<file> layout as the
+    calibration directory of the asset management repository, so a checkout of
+    the repository can be copied in directly), and the coefficients read from
+    them (under coeffs/<class>/<serial>/<date>/, one .npy file per
+    coefficient, loaded as memory mapped arrays). An index of the calibrations
+    keyed on the instrument class, serial number and calibration date is kept
+    in index.json.
+
+    Loaded coefficients are held in memory, so a batch run over many data files
+    reads each calibration from disk only once.
+    '''
+    def __init__(self, path, url=ASSET_MANAGEMENT_URL):
+        self.path = os.path.abspath(path)
+        self.url = url.rstrip('/')
+        for name in ['mirror', 'coeffs']:
+            _makedirs(os.path.join(self.path, name))
+
+        self.index = {}
+        if os.path.exists(self._index_file()):
+            with open(self._index_file(), 'rb') as f:
+                self.index = json.load(f)
+
+    def _index_file(self):
+        return os.path.join(self.path, 'index.json')
+
+    def _save_index(self):
+        _write(self._index_file(), json.dumps(self.index, indent=1, sort_keys=True))
+
+    def _entry(self, key):
+        # index entry for a calibration, created if missing
+        return self.index.setdefault('/'.join(key), {})
+
+    def mirror_path(self, url):
+        '''
+        Return the path in the mirror for a calibration file URL (or asset
+        management path) ending in <class>/<file>.
+        '''
+        parts = url.rstrip('/').split('/')
+        return os.path.join(self.path, 'mirror', parts[-2], parts[-1])
+
+    def _add(self, path):
+        # add a calibration file in the mirror to the index
+        key = parse_name(path)
+        if key and path.endswith('.csv'):
+            entry = self._entry(key)
+            if entry.get('csv') != os.path.relpath(path, self.path):
+                entry['csv'] = os.path.relpath(path, self.path)
+                self._save_index()
+
+    def fetch(self, url):
+        '''
+        Return the local path of a calibration file, downloading it into the
+        mirror if it is not already there. Local files are returned as is.
+        '''
+        if os.path.isfile(url):
+            return url
+
+        path = self.mirror_path(url)
+        if not os.path.exists(path):
+            import requests
+            response = requests.get(url)
+            response.raise_for_status()
+            _makedirs(os.path.dirname(path))
+            _write(path, response.content)
+
+        self._add(path)
+        return path
+
+    def mirror(self, names):
+        '''
+        Copy a set of calibration files into the mirror, given as paths to the
+        files (e.g. in a checkout of the asset management repository) or as
+        paths relative to the asset management calibration directory (e.g.
+        OPTAAJ/CGINS-OPTAAJ-00138__20150410.csv) to download them. Returns the
+        paths of the mirrored files.
+        '''
+        paths = []
+        for name in names:
+            if not os.path.isfile(name):
+                paths.append(self.fetch(self.url + '/' + name.lstrip('/')))
+                continue
+
+            path = self.mirror_path(os.path.abspath(name))
+            if not os.path.exists(path):
+                _makedirs(os.path.dirname(path))
+                shutil.copyfile(name, path)
+            self._add(path)
+            paths.append(path)
+
+        return paths
+
+    def reindex(self):
+        '''
+        Rebuild the index of the calibration files from the contents of the
+        mirror (e.g. after copying in a checkout of the asset management
+        repository) and of the stored coefficients.
+        '''
+        index = {}
+        mirror = os.path.join(self.path, 'mirror')
+        for dirpath, dirnames, filenames in os.walk(mirror):
+            for name in filenames:
+                key = parse_name(name)
+                if key and name.endswith('.csv'):
+                    path = os.path.relpath(os.path.join(dirpath, name), self.path)
+                    index.setdefault('/'.join(key), {})['csv'] = path
+
+        coeffs = os.path.join(self.path, 'coeffs')
+        for dirpath, dirnames, filenames in os.walk(coeffs):
+            key = os.path.relpath(dirpath, coeffs).split(os.sep)
+            if len(key) == 3 and filenames and not dirpath.endswith('.tmp'):
+                index.setdefault('/'.join(key), {})['coeffs'] = os.path.relpath(dirpath, self.path)
+
+        self.index = index
+        self._save_index()
+
+    def find(self, instrument_class, serial, date=None):
+        '''
+        Return the key of the most recent calibration of an instrument, on or
+        before the date (YYYYMMDD) if set, or None if there is no calibration.
+        '''
+        dates = []
+        for name in self.index:
+            key = tuple(name.split('/'))
+            if key[:2] == (instrument_class, serial) and (date is None or key[2] <= date):
+                dates.append(key[2])
+
+        if not dates:
+            return None
+
+        return instrument_class, serial, max(dates)
+
+    def _coeffs_dir(self, key):
+        return os.path.join(self.path, 'coeffs', *key)
+
+    def has_coeffs(self, key):
+        '''
+        Return True if the coefficients for the calibration have been stored.
+        '''
+        return os.path.isdir(self._coeffs_dir(key))
+
+    def save(self, key, coeffs):
+        '''
+        Save a dictionary of coefficients (numbers, strings or arrays of them)
+        for a calibration, with each coefficient stored as a .npy file.
+        '''
+        path = self._coeffs_dir(key)
+        tmpdir = '%s.%d.tmp' % (path, os.getpid())
+        if os.path.exists(tmpdir):
+            shutil.rmtree(tmpdir)
+        os.makedirs(tmpdir)
+        for name, value in coeffs.items():
+            np.save(os.path.join(tmpdir, name + '.npy'), np.asarray(value), allow_pickle=False)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmpdir, path)
+        _CACHE.pop(path, None)
+
+        self._entry(key)['coeffs'] = os.path.relpath(path, self.path)
+        self._save_index()
+
+    def load(self, key):
+        '''
+        Return the dictionary of coefficients for a calibration. Arrays are
+        returned as read-only memory mapped arrays, and single values as
+        python numbers or strings. The coefficients are held in memory for
+        later calls, up to CACHE_SIZE calibrations.
+        '''
+        path = self._coeffs_dir(key)
+        if path in _CACHE:
+            coeffs = _CACHE.pop(path)
+        else:
+            coeffs = {}
+            for name in os.listdir(path):
+                if name.endswith('.npy'):
+                    value = np.load(os.path.join(path, name), mmap_mode='r')
+                    coeffs[name[:-4]] = value.item() if value.ndim == 0 else value
+
+        # mark the calibration as most recently used, dropping the least
+        # recently used once the cache is full
+        _CACHE[path] = coeffs
+        while len(_CACHE) > CACHE_SIZE:
+            _CACHE.popitem(last=False)
+
+        return dict(coeffs)
+
+    def get(self, key, reader):
+        '''
+        Return the coefficients for a calibration, calling reader (which
+        returns the dictionary of coefficients read from the calibration
+        files) and saving the results if they have not been stored yet.
+        '''
+        if not self.has_coeffs(key):
+            self.save(key, reader())
+
+        return self.load(key)
@@ -3,6 +3,8 @@
 import argparse
 import cPickle as pickle
 
+from cgsn_parsers.process.calibrations import parse_name
+
 
 class Coefficients(object):
     '''
@@ -36,13 +38,35 @@ class Coefficients(object):
         with open(self.coeff_file, 'wb') as f:
             pickle.dump(self.coeffs, f)
 
+    def load_store(self, store, csv_url, read):
+        '''
+        Obtain the calibration data for this instrument from a calibration
+        store (see cgsn_parsers.process.calibrations), keyed on the name of the
+        CI hosted CSV file. If the coefficients are not in the store yet, read
+        is called with the path to the CSV file in the store's local mirror
+        (downloading it if needed) to set the coefficients, which are then
+        saved to the store.
+        '''
+        key = parse_name(csv_url)
+        if key is None:
+            raise Exception('Unable to determine the calibration from the file name %s' % csv_url)
+
+        def reader():
+            read(store.fetch(csv_url))
+            return self.coeffs
+
+        self.coeffs = store.get(key, reader)
+
 def inputs():
     '''
     Sets the main input arguments for the processor. At the least, the input
     and output files need to be specified. Optionally, you can specify the
     sources of the factory calibration data (either a stored serialized object,
     or a link (either file path for factory provided data file(s) or a URL to
-    OOI CI maintained CSV files). File names should always include pathnames.
+    OOI CI maintained CSV files). If a calibration store directory is set, the
+    CSV files are read from its local mirror and the coefficients saved there
+    (see cgsn_parsers.process.calibrations). File names should always include
+    pathnames.
     Finally a simple integer switch is provided for cases where the processor
     needs to function differently depending on some set of basic conditions.
     '''
@@ -60,6 +84,7 @@ def inputs():
     parser.add_argument("-c", "--coeff_file", dest="coeff_file", type=str, required=False)
     parser.add_argument("-d", "--devfile", dest="devfile", type=str, required=False)
     parser.add_argument("-u", "--csvurl", dest="csvurl", type=str, required=False)
+    parser.add_argument("-S", "--store", dest="store", type=str, required=False)
     parser.add_argument("-s", "--switch", dest="switch", type=int, default=0)
 
     # parse the input arguements and create a parser object
@@ -13,14 +13,32 @@ import os
 import pandas as pd
 import re
 import requests
-import scipy.interpolate as sci
 
 from munch import Munch
 
+from cgsn_parsers.process.calibrations import CalibrationStore
 from cgsn_parsers.process.common import Coefficients, inputs
 from ion_functions.data.opt_functions import opt_internal_temp, opt_external_temp
 from ion_functions.data.opt_functions import opt_pressure, opt_pd_calc, opt_tempsal_corr
 
+# Temperature and salinity correction coefficients, and scatter correction
+# interpolation weights, for the wavelength sets seen so far (see
+# tempsal_coeffs and scatter_weights), reused for every file processed with
+# the same calibration.
+_TEMPSAL_CACHE = {}
+_SCATTER_CACHE = {}
+
+
+def _read_text(source):
+    '''
+    Returns the contents of a file, given either a URL or a local path.
+    '''
+    if os.path.isfile(source):
+        with open(source, 'rb') as f:
+            return f.read()
+
+    return requests.get(source).content
+
 
 class Calibrations(Coefficients):
     def __init__(self, coeff_file, dev_file=None, hdr_url=None, tca_url=None, tcc_url=None):
@@ -66,32 +84,20 @@ class Calibrations(Coefficients):
         # array of the temperatures for the bins
         coeffs['temp_bins'] = np.array(data[9].split()[:-3]).astype(np.float)
     
-        ### assign values from the array portion of the file
-        awvl = []
-        cwvl = []
-        aoff = []
-        coff = []
-        ta_array = []
-        tc_array = []
-        for line in data[10:-1]:
-            line = line.split()
-            cwvl.append(np.float(re.sub('C', '', line[0])))
-            awvl.append(np.float(re.sub('A', '', line[1])))
-            coff.append(np.float(line[3]))
-            aoff.append(np.float(line[4]))
-            tc_array.append(np.array(line[5:5+nbin]).astype(np.float))
-            ta_array.append(np.array(line[nbin+5:-12]).astype(np.float))
-            
-        # beam attenuation and absorption channel wavelengths
-        coeffs['c_wavelengths'] = np.array(cwvl)
-        coeffs['a_wavelengths'] = np.array(awvl)
+        ### assign values from the array portion of the file, one row per
+        ### wavelength, converting all of the values for each column at once
+        rows = [line.split() for line in data[10:-1]]
+        # beam attenuation and absorption channel wavelengths (stripping the
+        # C and A prefixes)
+        coeffs['c_wavelengths'] = np.array([row[0].replace('C', '') for row in rows], dtype=np.float)
+        coeffs['a_wavelengths'] = np.array([row[1].replace('A', '') for row in rows], dtype=np.float)
         # beam attenuation and absorption channel clear water offsets
-        coeffs['c_offsets'] = np.array(coff)
-        coeffs['a_offsets'] = np.array(aoff)
+        coeffs['c_offsets'] = np.array([row[3] for row in rows], dtype=np.float)
+        coeffs['a_offsets'] = np.array([row[4] for row in rows], dtype=np.float)
         # temperature compensation values as f(wavelength, temperature) for the
         # beam attenuation and absorption channels
-        coeffs['tc_array'] = np.array(tc_array)
-        coeffs['ta_array'] = np.array(ta_array)
+        coeffs['tc_array'] = np.array([row[5:5+nbin] for row in rows], dtype=np.float)
+        coeffs['ta_array'] = np.array([row[nbin+5:-12] for row in rows], dtype=np.float)
         
         # save the resulting dictionary
         self.coeffs = coeffs
@@ -99,9 +105,10 @@ class Calibrations(Coefficients):
     def read_devurls(self, hdr_url, tca_url, tcc_url):
         '''
         Reads the values from an ac-s device file already parsed and stored on
-        Github as a set of 3 CSV files. Note, the formatting of those files 
-        puts some constraints on this process. If someone has a cleaner method,
-        I'm all in favor...
+        Github as a set of 3 CSV files (either the URLs, or the paths to local
+        copies of the files). Note, the formatting of those files puts some
+        constraints on this process. If someone has a cleaner method, I'm all
+        in favor...
         '''
         # create the device file dictionary and assign values
         coeffs = {}
@@ -131,23 +138,53 @@ class Calibrations(Coefficients):
 
         # temperature compensation values as f(wavelength, temperature) for the
         # beam attenuation and absorption channels
-        ta_array = []
-        tc_array = []
-
-        tcc = requests.get(tcc_url)
-        for line in tcc.content.splitlines():
-            tc_array.append(np.array(line.split(',')).astype(np.float))
+        tcc = _read_text(tcc_url)
+        coeffs['tc_array'] = np.array([line.split(',') for line in tcc.splitlines()], dtype=np.float)
 
-        tca = requests.get(tca_url)
-        for line in tca.content.splitlines():
-            ta_array.append(np.array(line.split(',')).astype(np.float))
-
-        coeffs['tc_array'] = np.array(tc_array)
-        coeffs['ta_array'] = np.array(ta_array)
+        tca = _read_text(tca_url)
+        coeffs['ta_array'] = np.array([line.split(',') for line in tca.splitlines()], dtype=np.float)
         
         # save the resulting dictionary
         self.coeffs = coeffs
     
+def opt_pd_batch(ref, sig, offset, tintrn, tbins, tarray):
+    '''
+    Calculates the uncorrected absorption or beam attenuation coefficients for
+    a set of packets at once, giving the same results as calling opt_pd_calc
+    for each packet in turn. The reference and signal counts are arrays of
+    (packets, wavelengths), with the internal temperature for each packet.
+
+    The coefficients are the sum of a term set by the clear water offsets and
+    the temperature compensation, which depends only on the internal
+    temperature, and a term proportional to the log of the signal over the
+    reference counts. Both are taken from opt_pd_calc for each unique internal
+    temperature (using reference and signal counts with a known ratio), so the
+    temperature compensation tables are interpolated once per temperature
+    rather than once per packet, and then applied to all of the packets.
+    Packets with zero (or negative) counts are passed to opt_pd_calc directly,
+    so the infinite or NaN values returned for them are the same.
+    '''
+    ref = np.atleast_2d(np.asarray(ref, dtype=np.float64))
+    sig = np.atleast_2d(np.asarray(sig, dtype=np.float64))
+    tintrn = np.asarray(tintrn, dtype=np.float64)
+    temps, index = np.unique(tintrn, return_inverse=True)
+
+    ones = np.ones(ref.shape[1])
+    base = np.zeros((len(temps), ref.shape[1]))
+    slope = np.zeros((len(temps), ref.shape[1]))
+    for i, t in enumerate(temps):
+        base[i], _ = opt_pd_calc(ones, ones, offset, t, tbins, tarray)
+        slope[i] = opt_pd_calc(ones, np.e * ones, offset, t, tbins, tarray)[0] - base[i]
+
+    bad = np.flatnonzero(np.any((ref <= 0) | (sig <= 0), axis=1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = base[index] + slope[index] * np.log(sig / ref)
+
+    for i in bad:
+        values[i], _ = opt_pd_calc(ref[i], sig[i], offset, tintrn[i], tbins, tarray)
+
+    return values
+
 def apply_dev(optaa, coeffs):
     '''
     Processes the raw data contained in the optaa dictionary and applies the 
@@ -176,21 +213,11 @@ def apply_dev(optaa, coeffs):
     c_ref = np.array(optaa.c_reference_raw)
     c_sig = np.array(optaa.c_signal_raw)
     
-    # size up inputs
-    npackets = a_ref.shape[0]
-    nwavelengths = a_ref.shape[1]
-    # initialize the output arrays
-    apd = np.zeros([npackets, nwavelengths])
-    cpd = np.zeros([npackets, nwavelengths])
-    
-    for ii in range(npackets):
-        # calculate the uncorrected optical absorption coefficient [m^-1]
-        apd[ii, :], _ = opt_pd_calc(a_ref[ii, :], a_sig[ii, :], coeffs['a_offsets'], 
-            temp[ii], coeffs['temp_bins'], coeffs['ta_array'])
-        # calculate the uncorrected optical attenuation coefficient [m^-1]
-        cpd[ii, :], _ = opt_pd_calc(c_ref[ii, :], c_sig[ii, :], coeffs['c_offsets'], 
-            temp[ii], coeffs['temp_bins'], coeffs['tc_array'])
-    
+    # calculate the uncorrected optical absorption and attenuation
+    # coefficients [m^-1] for all of the packets at once
+    apd = opt_pd_batch(a_ref, a_sig, coeffs['a_offsets'], temp, coeffs['temp_bins'], coeffs['ta_array'])
+    cpd = opt_pd_batch(c_ref, c_sig, coeffs['c_offsets'], temp, coeffs['temp_bins'], coeffs['tc_array'])
+
     # save the results back to the dictionary and add the beam attenuation and
     # absorbance wavelengths to the data.
     optaa.apd = apd.tolist()
@@ -240,28 +267,65 @@ def apply_tscorr(optaa, coeffs, Temp=None, Salinity=None):
     if Salinity.size != np.size(optaa.time):
         raise Exception("Mismatch: Salinity array != number of OPTAA measurements")
 
-    # setup and size the inputs
-    apd = np.array(optaa.apd)
-    cpd = np.array(optaa.cpd)
-    npackets = apd.shape[0]
-    nwavelengths = apd.shape[1]
-
-    # initialize the output arrays
-    apd_ts = np.zeros([npackets, nwavelengths])
-    cpd_ts = np.zeros([npackets, nwavelengths])
-
-    # apply the temperature and salinity corrections
-    for ii in range(npackets):
-        apd_ts[ii, :] = opt_tempsal_corr('a', apd[ii, :], coeffs['a_wavelengths'], 
-            coeffs['temp_calibration'], Temp[ii], Salinity[ii])
-        cpd_ts[ii, :] = opt_tempsal_corr('c', cpd[ii, :], coeffs['c_wavelengths'], 
-            coeffs['temp_calibration'], Temp[ii], Salinity[ii])
-    
+    # apply the temperature and salinity corrections to all the packets at
+    # once, using the coefficients for the wavelengths of each channel
+    Temp = Temp.reshape(-1, 1) - coeffs['temp_calibration']
+    Salinity = Salinity.reshape(-1, 1)
+    apd_ts = np.array(optaa.apd, dtype=np.float64)
+    cpd_ts = np.array(optaa.cpd, dtype=np.float64)
+    for channel, values in [('a', apd_ts), ('c', cpd_ts)]:
+        offset, psi_t, psi_s = tempsal_coeffs(channel, coeffs[channel + '_wavelengths'],
+                                              coeffs['temp_calibration'])
+        values += offset + psi_t * Temp + psi_s * Salinity
+
     # save the results
     optaa.apd_ts = apd_ts.tolist()
     optaa.cpd_ts = cpd_ts.tolist()
     return optaa
 
+def tempsal_coeffs(channel, wavelengths, tcal):
+    '''
+    Returns the temperature and salinity correction coefficients for the a or
+    c channel at a set of wavelengths, such that the corrected values are
+
+        pd + offset + psi_t * (T - tcal) + psi_s * S
+
+    matching opt_tempsal_corr (which is linear in the temperature and
+    salinity). The coefficients are taken from opt_tempsal_corr once for each
+    channel, wavelength set and calibration temperature, and cached.
+    '''
+    wavelengths = np.asarray(wavelengths, dtype=np.float64)
+    key = (channel, wavelengths.tostring(), tcal)
+    if key not in _TEMPSAL_CACHE:
+        zeros = np.zeros(len(wavelengths))
+        offset = opt_tempsal_corr(channel, zeros, wavelengths, tcal, tcal, 0.)
+        psi_t = opt_tempsal_corr(channel, zeros, wavelengths, tcal, tcal + 1., 0.) - offset
+        psi_s = opt_tempsal_corr(channel, zeros, wavelengths, tcal, tcal, 1.) - offset
+        _TEMPSAL_CACHE[key] = (offset, psi_t, psi_s)
+
+    return _TEMPSAL_CACHE[key]
+
+def scatter_weights(wavelengths, reference_wavelength):
+    '''
+    Returns the indices of the two wavelengths either side of the reference
+    wavelength and their weights, for linear interpolation of the absorption
+    at the reference wavelength. The weights are cached for each wavelength
+    set.
+    '''
+    wavelengths = np.asarray(wavelengths, dtype=np.float64)
+    key = (wavelengths.tostring(), reference_wavelength)
+    if key not in _SCATTER_CACHE:
+        order = np.argsort(wavelengths, kind='mergesort')
+        ordered = wavelengths[order]
+        if not ordered[0] <= reference_wavelength <= ordered[-1]:
+            raise ValueError('The reference wavelength is outside the range of the wavelengths.')
+
+        i = min(max(np.searchsorted(ordered, reference_wavelength), 1), len(ordered) - 1)
+        weight = (reference_wavelength - ordered[i - 1]) / (ordered[i] - ordered[i - 1])
+        _SCATTER_CACHE[key] = (order[i - 1], order[i], 1. - weight, weight)
+
+    return _SCATTER_CACHE[key]
+
 def apply_scatcorr(optaa, method=1):
     """
     Correct the absorbance data for scattering using Method 1 (the default),
@@ -272,9 +336,9 @@ def apply_scatcorr(optaa, method=1):
     if method != 1:
         raise Exception('Only scatter method = 1 is coded for the time being.')
 
-    a_interpolant = sci.interp1d(np.array(optaa.a_wavelengths), np.array(optaa.apd))
-
-    scatter = a_interpolant(reference_wavelength)
+    lower, upper, w0, w1 = scatter_weights(optaa.a_wavelengths, reference_wavelength)
+    apd = np.array(optaa.apd)
+    scatter = w0 * apd[:, lower] + w1 * apd[:, upper]
     apd_ts_s = np.array(optaa.apd_ts) - scatter[:, np.newaxis]
 
     # save the results
@@ -291,7 +355,15 @@ def main():
     dev = Calibrations(coeff_file)  # initialize calibration class
     
     # check for the source of calibration coeffs and load accordingly
-    if os.path.isfile(coeff_file):
+    if args.store and args.csvurl:
+        # load from the local calibration store, reading the CI hosted CSV
+        # files via the store's mirror if the coefficients are not there yet
+        store = CalibrationStore(args.store)
+        tca_url = re.sub('.csv', '__CC_taarray.ext', args.csvurl)
+        tcc_url = re.sub('.csv', '__CC_tcarray.ext', args.csvurl)
+        dev.load_store(store, args.csvurl,
+                       lambda hdr: dev.read_devurls(hdr, store.fetch(tca_url), store.fetch(tcc_url)))
+    elif os.path.isfile(coeff_file):
         # we always want to use this file if it exists
         dev.load_coeffs()
     elif args.devfile:
@@ -16,7 +16,8 @@ from datetime import datetime, timedelta
 from munch import Munch
 from pytz import timezone
 
-from cgsn_parsers.parsers.common import dcl_to_epoch
+from cgsn_parsers.parsers.common import dcl_to_epoch_array
+from cgsn_parsers.process.calibrations import CalibrationStore
 from cgsn_parsers.process.common import Coefficients, inputs
 from ion_functions.data.co2_functions import pco2_blank, pco2_pco2wat
 from ion_functions.data.ph_functions import ph_thermistor, ph_battery
@@ -98,7 +99,11 @@ def main():
         
     # check for the source of calibration coeffs and load accordingly
     dev = Calibrations(coeff_file)  # initialize calibration class
-    if os.path.isfile(coeff_file):
+    if args.store and args.csvurl:
+        # load from the local calibration store, reading the CI hosted CSV
+        # file via the store's mirror if the coefficients are not there yet
+        dev.load_store(CalibrationStore(args.store), args.csvurl, dev.read_csv)
+    elif os.path.isfile(coeff_file):
         # we always want to use this file if it exists
         dev.load_coeffs()
     elif args.csvurl:
@@ -132,22 +137,22 @@ def main():
     # compare the instrument clock to the GPS based DCL time stamp
     # --> PCO2W uses the OSX date format of seconds since 1904-01-01
     mac = datetime.strptime("01-01-1904", "%m-%d-%Y")
+
+    # we use the sample collection time as the time record for the sample.
+    # the record_time, however, is when the sample was processed. so the
+    # true offset needs to include the difference between the collection
+    # and processing times
+    collect = dcl_to_epoch_array(pco2w.collect_date_time)
+    process = dcl_to_epoch_array(pco2w.process_date_time)
+    diff = process - collect
+    diff[np.isnan(diff)] = 300
+
     offset = []
     for i in range(len(pco2w.time)):
         rec = mac + timedelta(seconds=pco2w.record_time[i])
         rec.replace(tzinfo=timezone('UTC'))
         dcl = datetime.utcfromtimestamp(pco2w.time[i])
-        
-        # we use the sample collection time as the time record for the sample.
-        # the record_time, however, is when the sample was processed. so the
-        # true offset needs to include the difference between the collection
-        # and processing times
-        collect = dcl_to_epoch(pco2w.collect_date_time[i])
-        process = dcl_to_epoch(pco2w.process_date_time[i])
-        diff = process - collect
-        if np.isnan(diff):
-            diff = 300
-        offset.append((rec - dcl).total_seconds() - diff)
+        offset.append((rec - dcl).total_seconds() - diff[i])
 
     pco2w.time_offset = offset
 
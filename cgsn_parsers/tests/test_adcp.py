@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@package cgsn_parsers.tests.test_adcp
+@file cgsn_parsers/tests/test_adcp.py
+@author Christopher Wingard
+@brief Unit tests for parsing the ADCP PD0 data
+"""
+import json
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+from binascii import hexlify, unhexlify
+from nose.plugins.attrib import attr
+from os import path
+from struct import unpack
+
+from cgsn_parsers.benchmarks.generators import records
+from cgsn_parsers.parsers.metrics import Metrics
+from cgsn_parsers.parsers.parse_adcp import Parser, expand_fixed
+
+# DCL ASCIIHEX records and the JSON output of the original, record by record,
+# version of the parser (which unpacked each of the PD0 fields in turn)
+TESTDATA = path.join(path.dirname(__file__), 'adcp', '20170101.adcps.log')
+BASELINE = path.join(path.dirname(__file__), 'adcp', '20170101.adcps.json')
+
+# Fields corrected since the original version of the parser, with the values
+# expected for the test data from the PD0 format specification (fixed leader
+# system configuration 0xCA, coordinate transform 0x17, time per ping 00:01.50;
+# variable leader MPT 00:59.99 and error status word 2 of 0x55)
+CORRECTED = {
+    'fixed': {
+        'sysconfig_sensor_config': 0,
+        'coord_transform_type': 2,
+        'coord_transform_beams': 1,
+        'time_per_ping_seconds': 1.5
+    },
+    'variable': {
+        'mpt_seconds': 59.99,
+        'unknown_wakeup_occurred': 0
+    }
+}
+
+
+def _ensembles(ncells, count, seed):
+    '''
+    Return a list of synthetic ASCIIHEX ensembles with the set number of depth
+    cells, skipping the DCL status messages.
+    '''
+    adcp = records('adcp', seed, ncells=ncells)
+    return [line for line in (next(adcp) for i in range(count + count // 50)) if '[' not in line]
+
+
+@attr('parse')
+class TestParsingUnit(unittest.TestCase):
+    '''
+    The ensembles are decoded in groups sharing the same layout. Confirm the
+    results are returned in the original order when the number of depth cells
+    changes part way through a file, and that all of the depth cells are kept.
+    The fixed leader data is saved once for each configuration.
+    '''
+    def setUp(self):
+        # 10 ensembles with 30 depth cells, 5 with 20, then 5 more with 30
+        self.lines = _ensembles(30, 10, 1) + _ensembles(20, 5, 2) + _ensembles(30, 5, 3)
+
+    def test_parse_adcp(self):
+        '''
+        Test parsing of the ADCP data, checking the velocities, the ensemble
+        numbers and the fixed leader flags against the raw ensembles.
+        '''
+        adcp = Parser('20170101.adcps.log')
+        adcp.raw = ''.join(self.lines)
+        adcp.parse_data()
+        parsed = adcp.data.toDict()
+
+        self.assertEqual(len(parsed['time']), 20)
+        self.assertEqual(parsed['fixed_index'], [0] * 10 + [1] * 5 + [0] * 5)
+        self.assertEqual(parsed['fixed']['num_cells'], [30, 20])
+        self.assertEqual(parsed['fixed']['time'], [parsed['time'][0], parsed['time'][10]])
+        self.assertEqual(parsed['fixed']['sysconfig_sensor_config'], [0, 0])
+        self.assertEqual(parsed['fixed']['coord_transform_type'], [2, 2])
+        self.assertEqual(parsed['fixed']['coord_transform_beams'], [1, 1])
+        self.assertEqual(parsed['fixed']['time_per_ping_seconds'], [1.5, 1.5])
+        self.assertEqual(parsed['variable']['ensemble_number'], range(1, 11) + range(1, 6) + range(1, 6))
+
+        fixed = expand_fixed(parsed)
+        self.assertEqual(fixed['num_cells'].tolist(), [30] * 10 + [20] * 5 + [30] * 5)
+        self.assertEqual(fixed['serial_number'].tolist(), [12345] * 20)
+        np.testing.assert_array_equal(expand_fixed(adcp.data)['num_cells'], fixed['num_cells'])
+        self.assertEqual(parsed['variable']['real_time_clock1'][0], [17, 1, 1, 0, 0, 0, 0])
+
+        for i, line in enumerate(self.lines):
+            ensemble = unhexlify(line[24:].strip())
+            ncells = fixed['num_cells'][i]
+            offset = unpack('<H', ensemble[10:12])[0] + 2
+            velocity = np.array(unpack('<%dh' % (4 * ncells), ensemble[offset:offset + 8 * ncells]))
+            velocity = velocity.reshape(ncells, 4)
+            self.assertEqual(parsed['velocity']['eastward'][i], velocity[:, 0].tolist())
+            self.assertEqual(parsed['velocity']['error'][i], velocity[:, 3].tolist())
+
+    def test_baseline(self):
+        '''
+        Test the ASCIIHEX and binary PD0 ensembles decode to the same values as
+        the original parser, apart from the fields corrected since, and the
+        last depth cell, which the original parser dropped.
+        '''
+        with open(BASELINE, 'r') as f:
+            baseline = json.load(f)
+
+        adcp = Parser(TESTDATA)
+        adcp.load_ascii()
+        adcp.parse_data()
+        parsed = json.loads(adcp.data.toJSON())
+        self.assertEqual(parsed['time'], baseline['time'])
+
+        with open(TESTDATA, 'r') as f:
+            ensembles = [unhexlify(line[24:].strip()) for line in f if '[' not in line]
+        pd0 = Parser('20170101.000.pd0')
+        pd0.raw = ''.join(ensembles)
+        pd0.parse_data()
+
+        for data in [parsed, json.loads(pd0.data.toJSON())]:
+            data['fixed'] = dict((name, values.tolist()) for name, values in expand_fixed(data).items())
+            for section in ['header', 'fixed', 'variable', 'velocity', 'correlation', 'echo', 'percent']:
+                self.assertEqual(sorted(baseline[section].keys()), sorted(set(data[section].keys()) - {'time'}))
+                for name, expected in baseline[section].items():
+                    values = data[section][name]
+                    if name in CORRECTED.get(section, {}):
+                        self.assertNotEqual(values, expected)
+                        self.assertEqual(values, [CORRECTED[section][name]] * len(expected))
+                    elif section in ['velocity', 'correlation', 'echo', 'percent']:
+                        self.assertEqual([cells[:-1] for cells in values], expected)
+                        self.assertEqual([len(cells) for cells in values], [12] * len(expected))
+                    else:
+                        self.assertEqual(values, expected)
+
+    def test_parse_batches(self):
+        '''
+        Test the configurations are numbered across the batches when the file
+        is parsed in blocks, as in append mode.
+        '''
+        tmpdir = tempfile.mkdtemp()
+        try:
+            infile = os.path.join(tmpdir, '20170101.adcps.log')
+            with open(infile, 'wb') as f:
+                f.write(''.join(self.lines))
+
+            adcp = Parser(infile)
+            adcp.load_ascii()
+            adcp.parse_data()
+            expected = adcp.data.toDict()
+
+            adcp = Parser(infile)
+            data = adcp._parameter_names.create_dict()
+            for batch in adcp.iter_batches(batch_size=2000):
+                data.extend(batch)
+            self.assertEqual(data.toDict(), expected)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_parse_binary(self):
+        '''
+        Test parsing of binary PD0 data, with junk between some of the
+        ensembles and a corrupted ensemble, gives the same results as parsing
+        the ASCIIHEX records (apart from the times, taken from the real time
+        clock rather than the DCL timestamps).
+        '''
+        adcp = Parser('20170101.adcps.log')
+        adcp.raw = ''.join(self.lines)
+        adcp.parse_data()
+        expected = adcp.data.toDict()
+
+        ensembles = [unhexlify(line[24:].strip()) for line in self.lines]
+        bad = bytearray(ensembles[7])
+        bad[100] ^= 0xff
+        raw = ('\x00\x7f\x7f\x12junk'.join(ensembles[:7]) + str(bad) + '\x7f\x7f' +
+               ''.join(ensembles[7:]) + ensembles[0][:50])
+
+        adcp = Parser('20170101.000.pd0')
+        adcp.metrics = Metrics()
+        adcp.raw = raw
+        adcp.parse_data()
+        parsed = adcp.data.toDict()
+
+        # the corrupted ensemble and the partial ensemble at the end
+        self.assertEqual(adcp.metrics.counters['rejected_checksum'], 2)
+        for name in ['header', 'fixed_index', 'variable', 'velocity', 'echo']:
+            self.assertEqual(parsed[name], expected[name])
+        self.assertEqual(parsed['fixed']['num_cells'], [30, 20])
+        self.assertEqual(parsed['time'][0], 1483228800.0)
+        self.assertEqual(parsed['fixed']['time'], [parsed['time'][0], parsed['time'][10]])
+
+    def test_checksum(self):
+        '''
+        Test an ensemble with a bad checksum is dropped and counted.
+        '''
+        ensemble = bytearray(unhexlify(self.lines[3][24:].strip()))
+        ensemble[100] ^= 0xff
+        self.lines[3] = self.lines[3][:24] + hexlify(ensemble).upper() + '\r\n'
+
+        adcp = Parser('20170101.adcps.log')
+        adcp.metrics = Metrics()
+        adcp.raw = ''.join(self.lines)
+        adcp.parse_data()
+        parsed = adcp.data.toDict()
+
+        self.assertEqual(adcp.metrics.counters['rejected_checksum'], 1)
+        self.assertEqual(len(parsed['time']), 19)
+        self.assertEqual(parsed['variable']['ensemble_number'][:5], [1, 2, 3, 5, 6])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@package cgsn_parsers.tests.test_batch
+@file cgsn_parsers/tests/test_batch.py
+@author Christopher Wingard
+@brief Unit tests for the multi-core batch driver
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from nose.plugins.attrib import attr
+from os import path
+
+from cgsn_parsers.batch import find_files, list_files, run
+from cgsn_parsers.parsers.parse_ctdbp import Parser
+
+TESTDATA = path.join(path.dirname(__file__), 'ctdbp')
+
+
+@attr('parse')
+class TestBatchUnit(unittest.TestCase):
+    '''
+    Build a small deployment directory with the CTDBP test data and confirm
+    the batch driver finds the files, sets the switches and output paths used
+    by the harvester scripts, and writes the same JSON as the parser.
+    '''
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.raw = path.join(self.root, 'raw')
+        self.parsed = path.join(self.root, 'proc')
+        base = path.join(self.raw, 'ce07shsm', 'D00004', 'cg_data')
+        for logger, inst, filename in [('dcl27', 'ctdbp1', '20161219.ctdbp1.log'),
+                                       ('dcl37', 'ctdbp2', '20161219.ctdbp2.log'),
+                                       ('dcl17', 'ctdbp3', '20161110.ctdbp3.log')]:
+            os.makedirs(path.join(base, logger, inst))
+            shutil.copy(path.join(TESTDATA, filename), path.join(base, logger, inst, filename))
+
+        # empty files and unknown instrument directories are skipped
+        os.makedirs(path.join(base, 'dcl27', 'syslog'))
+        open(path.join(base, 'dcl27', 'syslog', '20161219.syslog.log'), 'w').close()
+        open(path.join(base, 'dcl27', 'ctdbp1', '20161220.ctdbp1.log'), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_find_files(self):
+        '''
+        Test discovery of the log files and the date range selection.
+        '''
+        jobs = find_files(self.raw, self.parsed, 'ce07shsm', 'D00004')
+        self.assertEqual(len(jobs), 3)
+        self.assertEqual([job[0] for job in jobs], sorted([job[0] for job in jobs], reverse=True))
+
+        outputs = dict((path.basename(job[2]), (job[3], job[4])) for job in jobs)
+        proc = path.join(self.parsed, 'ce07shsm', 'D00004')
+        self.assertEqual(outputs['20161219.ctdbp1.log'], (path.join(proc, 'nsif/ctdbp/20161219.ctdbp1.json'), 1))
+        self.assertEqual(outputs['20161219.ctdbp2.log'], (path.join(proc, 'mfn/ctdbp/20161219.ctdbp2.json'), 2))
+        self.assertEqual(outputs['20161110.ctdbp3.log'], (path.join(proc, 'buoy/ctdbp/20161110.ctdbp3.json'), 3))
+
+        jobs = find_files(self.raw, self.parsed, 'ce07shsm', 'D00004', '20161201', '20161231')
+        self.assertEqual(len(jobs), 2)
+
+    def test_run(self):
+        '''
+        Test parsing the files with a pool of workers.
+        '''
+        jobs = find_files(self.raw, self.parsed, 'ce07shsm', 'D00004')
+        failed = run(jobs, workers=2, metrics=True)
+        self.assertEqual(failed, [])
+
+        for size, parser, infile, outfile, switch in jobs:
+            ctdbp = Parser(infile, switch)
+            ctdbp.load_ascii()
+            ctdbp.parse_data()
+            with open(outfile, 'r') as f:
+                self.assertEqual(f.read(), ctdbp.data.toJSON())
+
+            # the metrics for each file are saved next to the output file
+            with open(outfile[:-5] + '.metrics.json', 'r') as f:
+                metrics = json.load(f)
+            self.assertEqual(metrics['infile'], path.basename(infile))
+            self.assertEqual(metrics['counters']['matched'], len(ctdbp.data.time))
+
+    def test_list_files(self):
+        '''
+        Test creating the jobs for a list of files, detecting the parsers.
+        '''
+        files = [job[2] for job in find_files(self.raw, self.parsed, 'ce07shsm', 'D00004')]
+        files.append(path.join(self.raw, 'ce07shsm', 'D00004', 'cg_data', 'dcl27', 'ctdbp1',
+                               '20161220.ctdbp1.log'))
+        syslog = path.join(self.raw, 'ce07shsm', 'D00004', 'cg_data', 'dcl27', 'syslog',
+                           '20161219.syslog.log')
+        with open(syslog, 'w') as f:
+            f.write('2016/12/19 00:00:00.000 syslog message\n')
+        files.append(syslog)
+
+        jobs, unknown = list_files(files, self.parsed)
+        self.assertEqual(unknown, [syslog])
+        self.assertEqual(len(jobs), 3)
+        for size, parser, infile, outfile, switch in jobs:
+            self.assertEqual(parser, 'ctdbp')
+            self.assertEqual(switch, int(infile[-5]))
+            self.assertEqual(outfile, path.join(self.parsed, 'ctdbp', path.basename(infile)[:-4] + '.json'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@package cgsn_parsers.tests.test_benchmarks
+@file cgsn_parsers/tests/test_benchmarks.py
+@author Christopher Wingard
+@brief Unit tests for the synthetic data generators and benchmarks
+"""
+import shutil
+import tempfile
+import unittest
+
+from nose.plugins.attrib import attr
+from os import path
+
+from cgsn_parsers.benchmarks.generators import FILENAMES, SWITCHES, generate
+from cgsn_parsers.benchmarks.run import run_benchmarks
+from cgsn_parsers.parsers.common import _count_rows
+from cgsn_parsers.parsers.registry import create_parser, detect
+
+
+def _rows(data):
+    rows = set()
+    for value in _count_rows(data).values():
+        if isinstance(value, dict):
+            rows.update(value.values())
+        else:
+            rows.add(value)
+    return rows
+
+
+@attr('parse')
+class TestBenchmarksUnit(unittest.TestCase):
+    '''
+    Confirm the synthetic data files are found and parsed by the parsers.
+    '''
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_generators(self):
+        '''
+        Test the synthetic files for each parser are reproducible, detected by
+        the registry and parsed with all columns filled.
+        '''
+        for name in sorted(FILENAMES.keys()):
+            infile = generate(name, self.tmpdir, 32 * 1024)
+            self.assertGreaterEqual(path.getsize(infile), 32 * 1024)
+            self.assertEqual(detect(infile)[0], name)
+            with open(infile, 'rb') as f:
+                data = f.read()
+            self.assertEqual(open(generate(name, self.tmpdir, 32 * 1024), 'rb').read(), data)
+
+            parser = create_parser(infile, name, SWITCHES.get(name))
+            parser.load_mmap()
+            parser.parse_data()
+            rows = _rows(parser.data)
+            self.assertGreater(min(rows), 0, name)
+            if name not in ['adcp', 'vel3d', 'velpt']:
+                # a single record type, with every column filled for each record
+                self.assertEqual(len(rows), 1, name)
+
+    def test_run_benchmarks(self):
+        '''
+        Test the benchmark results for a parser.
+        '''
+        results = run_benchmarks(['ctdbp'], 64 * 1024, repeat=1, workdir=self.tmpdir)
+        result = results['results']['ctdbp']
+
+        parser = create_parser(generate('ctdbp', self.tmpdir, 64 * 1024), 'ctdbp', SWITCHES['ctdbp'])
+        parser.load_mmap()
+        parser.parse_data()
+        self.assertEqual(result['records'], len(parser.data.time))
+        self.assertEqual(result['bytes'], path.getsize(parser.infile))
+        self.assertGreater(result['records_per_second'], 0)
+        self.assertGreater(result['mb_per_second'], 0)
+        self.assertGreater(result['peak_rss'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
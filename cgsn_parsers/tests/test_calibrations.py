@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@package cgsn_parsers.tests.test_calibrations
+@file cgsn_parsers/tests/test_calibrations.py
+@author Christopher Wingard
+@brief Unit tests for the local calibration store
+"""
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+from nose.plugins.attrib import attr
+
+from cgsn_parsers.process import calibrations
+from cgsn_parsers.process.calibrations import CalibrationStore, parse_name
+
+
+@attr('process')
+class TestCalibrationStoreUnit(unittest.TestCase):
+    '''
+    Confirm coefficients saved to the store are returned unchanged, that each
+    calibration is only read from the calibration files (or disk) once, and
+    that the calibrations in the local mirror are indexed.
+    '''
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = CalibrationStore(os.path.join(self.tmpdir, 'store'))
+        self.key = ('CGINS-OPTAAJ', '00138', '20150410')
+        self.coeffs = {
+            'serial_number': 138,
+            'temp_calibration': 20.5,
+            'pressure_coeff': [0, 0],
+            'a_wavelengths': np.linspace(400., 750., 83),
+            'ta_array': np.random.RandomState(0).rand(83, 35)
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse_name(self):
+        '''
+        Test the keys taken from the asset management calibration file names.
+        '''
+        url = calibrations.ASSET_MANAGEMENT_URL + '/OPTAAJ/CGINS-OPTAAJ-00138__20150410.csv'
+        self.assertEqual(parse_name(url), self.key)
+        self.assertEqual(parse_name('CGINS-OPTAAJ-00138__20150410__CC_taarray.ext'), self.key)
+        self.assertEqual(parse_name('CGINS-OPTAAJ-00138.csv'), None)
+
+    def test_save_load(self):
+        '''
+        Test the coefficients are read once, and returned from the store (as
+        memory mapped arrays) and then from memory on later calls.
+        '''
+        calls = []
+
+        def reader():
+            calls.append(1)
+            return self.coeffs
+
+        coeffs = self.store.get(self.key, reader)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(coeffs.keys()), sorted(self.coeffs.keys()))
+        self.assertEqual(coeffs['serial_number'], 138)
+        self.assertEqual(coeffs['temp_calibration'], 20.5)
+        self.assertTrue(isinstance(coeffs['ta_array'], np.memmap))
+        np.testing.assert_array_equal(coeffs['ta_array'], self.coeffs['ta_array'])
+
+        # a new store (e.g. in the next processor run) loads the saved values,
+        # sharing the arrays already held in memory
+        store = CalibrationStore(self.store.path)
+        again = store.get(self.key, reader)
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(again['ta_array'] is coeffs['ta_array'])
+        self.assertEqual(store.index['CGINS-OPTAAJ/00138/20150410']['coeffs'],
+                         os.path.join('coeffs', 'CGINS-OPTAAJ', '00138', '20150410'))
+
+    def test_mirror(self):
+        '''
+        Test calibration files copied into the mirror are indexed, and the most
+        recent calibration before a date is found.
+        '''
+        checkout = os.path.join(self.tmpdir, 'asset-management', 'OPTAAJ')
+        os.makedirs(checkout)
+        names = []
+        for date in ['20140703', '20150410']:
+            names.append(os.path.join(checkout, 'CGINS-OPTAAJ-00138__%s.csv' % date))
+            with open(names[-1], 'w') as f:
+                f.write('serial,name,value\n')
+
+        paths = self.store.mirror(names)
+        self.assertEqual(paths, [self.store.mirror_path(name) for name in names])
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+        self.assertEqual(self.store.find('CGINS-OPTAAJ', '00138', '20150101'),
+                         ('CGINS-OPTAAJ', '00138', '20140703'))
+        self.assertEqual(self.store.find('CGINS-OPTAAJ', '00138'), self.key)
+        self.assertEqual(self.store.find('CGINS-OPTAAJ', '00139'), None)
+
+        # the mirrored files are used in place of the URLs
+        url = calibrations.ASSET_MANAGEMENT_URL + '/OPTAAJ/CGINS-OPTAAJ-00138__20150410.csv'
+        self.assertEqual(self.store.fetch(url), paths[1])
+
+        index = self.store.index
+        self.store.reindex()
+        self.assertEqual(self.store.index, index)
+
+
+if __name__ == '__main__':
+    unittest.main()
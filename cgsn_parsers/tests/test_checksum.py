@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@package cgsn_parsers.tests.test_checksum
+@file cgsn_parsers/tests/test_checksum.py
+@author Christopher Wingard
+@brief Unit tests for the packet checksums
+"""
+import numpy as np
+import random
+import unittest
+
+from nose.plugins.attrib import attr
+from struct import pack, unpack
+
+from cgsn_parsers.parsers import checksum
+
+
+@attr('parse')
+class TestChecksumUnit(unittest.TestCase):
+    '''
+    Confirm the checksums computed for all the packets at once match those
+    computed one packet at a time, for packets starting at both odd and even
+    offsets and running past the end of the buffer.
+    '''
+    def setUp(self):
+        rnd = random.Random(0)
+        self.buf = ''.join(chr(rnd.randint(0, 255)) for i in range(4096))
+        self.starts = [rnd.randint(0, 4000) for i in range(200)]
+        self.lengths = [2 * rnd.randint(0, 60) for i in range(200)]
+
+    def test_sums(self):
+        '''
+        Test the byte and word sums against sums computed in python.
+        '''
+        sums = checksum.byte_sums(self.buf, self.starts, self.lengths)
+        words = checksum.word_sums(self.buf, self.starts, self.lengths, checksum.NORTEK_BASE)
+        for i, (start, length) in enumerate(zip(self.starts, self.lengths)):
+            packet = self.buf[start:start + length]
+            self.assertEqual(sums[i], sum(bytearray(packet)) & 65535)
+            total = checksum.NORTEK_BASE + sum(unpack('<%dH' % (length // 2), packet))
+            self.assertEqual(words[i], total % 65536)
+
+    def test_check_sums(self):
+        '''
+        Test the validity masks for packets with good and bad checksums.
+        '''
+        packets = []
+        for i in range(10):
+            data = self.buf[i * 40:i * 40 + 40]
+            packets.append(data + pack('>H', sum(bytearray(data)) & 65535))
+        buf = bytearray('\x00' + ''.join(packets))
+        buf[1 + 3 * 42 + 5] ^= 0x01
+        starts = np.arange(10) * 42 + 1
+        valid = checksum.check_byte_sums(str(buf[:-1]), starts, 40, '>')
+        self.assertEqual(valid.tolist(), [True] * 3 + [False] + [True] * 5 + [False])
+
+        record = self.buf[:26]
+        total = checksum.NORTEK_BASE + sum(unpack('<13H', record))
+        buf = record + pack('<H', total % 65536)
+        self.assertTrue(checksum.check_word_sums(buf, [0], 26).all())
+        self.assertFalse(checksum.check_word_sums(buf, [0], 26, base=0).any())
+        self.assertEqual(checksum.check_word_sums('', [], 26).size, 0)
+
+    def test_gather_packets(self):
+        '''
+        Test the packets copied out of the buffer match those found by slicing.
+        '''
+        buf = checksum.as_bytes(self.buf)
+        packets = checksum.gather_packets(self.buf, self.starts, 96)
+        self.assertEqual(packets.shape, (len(self.starts), 96))
+        for i, start in enumerate(self.starts):
+            self.assertEqual(packets[i].tobytes(), self.buf[start:start + 96])
+
+        # the copy does not share memory with the buffer
+        packets[0, 0] ^= 0x01
+        self.assertNotEqual(packets[0, 0], buf[self.starts[0]])
+
+        self.assertEqual(checksum.gather_packets(self.buf, [], 96).shape, (0, 96))
+        self.assertEqual(checksum.gather_packets(self.buf, [4000], 96).shape, (1, 96))
+        self.assertRaises(ValueError, checksum.gather_packets, self.buf, [4001], 96)
+        self.assertRaises(ValueError, checksum.gather_packets, self.buf, [-1], 96)
+
+
+if __name__ == '__main__':
+    unittest.main()
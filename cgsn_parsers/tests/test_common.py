@@ -0,0 +1,431 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@package cgsn_parsers.tests.test_common
+@file cgsn_parsers/tests/test_common.py
+@author Christopher Wingard
+@brief Unit tests for the common parser utilities
+"""
+import gzip
+import numpy as np
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from argparse import Namespace
+from nose.plugins.attrib import attr
+from os import path
+
+from munch import Munch as Bunch
+from StringIO import StringIO
+
+from cgsn_parsers.parsers import common
+
+from cgsn_parsers.parsers import cache
+from cgsn_parsers.parsers.cache import ParseCache
+from cgsn_parsers.parsers.common import ColumnBuffer, ColumnStore, run_parser, write_json
+from cgsn_parsers.parsers.common import dcl_to_epoch, dcl_to_epoch_array, dcl_offsets_to_epoch
+from cgsn_parsers.parsers.netcdf import Dataset, write_netcdf
+from cgsn_parsers.parsers.parse_ctdbp import CTDBP2, Parser
+
+TESTDATA_CTDBP = path.join(path.dirname(__file__), 'ctdbp/20161219.ctdbp2.log')
+
+
+@attr('parse')
+class TestTimestampUnit(unittest.TestCase):
+    '''
+    Confirm the vectorized conversions of the DCL date and time strings into
+    epoch timestamps match the record-by-record conversion, including the
+    incorrectly formatted cases where the seconds are set to 60.000.
+    '''
+    def setUp(self):
+        self.time_strings = [
+            '2016/12/19 00:00:05.084',
+            '2016/12/19 00:00:22.905',
+            '2016/12/19 23:59:59.999',
+            '2016/12/20 00:00:00.000',
+            '2016/12/31 12:14:60.417',
+            '2016/12/31 23:59:60.000',
+            '2017/01/01 00:00:00.001'
+        ]
+        self.expected = np.array([dcl_to_epoch(t) for t in self.time_strings])
+
+    def test_dcl_to_epoch_array(self):
+        '''
+        Test conversion of a list of DCL date and time strings.
+        '''
+        epts = dcl_to_epoch_array(self.time_strings)
+        np.testing.assert_array_equal(epts, self.expected)
+        self.assertEqual(dcl_to_epoch_array([]).size, 0)
+
+    def test_invalid(self):
+        '''
+        Test incorrectly formatted or out of range date and time strings raise
+        a ValueError, as they do with dcl_to_epoch.
+        '''
+        for time_string in ['2016/12/19 25:00:05.084', '2016/12/19 00:61:05.084', '2016/12/19 00:00:61.084',
+                            '2016/12/19 0a:00:05.123', '2016/12/19 00:00:05', '2016-12-19 00:00:05.084',
+                            '2016/02/30 00:00:05.084', '2016/13/19 00:00:05.084']:
+            self.assertRaises(ValueError, dcl_to_epoch, time_string)
+            self.assertRaises(ValueError, dcl_to_epoch_array, self.time_strings + [time_string])
+
+        # longer strings are rejected rather than truncated
+        self.assertRaises(ValueError, dcl_to_epoch_array, self.time_strings + ['2016/12/19 00:00:05.1234'])
+
+    def test_dcl_offsets_to_epoch(self):
+        '''
+        Test conversion of DCL date and time strings found at offsets within a
+        buffer of raw data.
+        '''
+        lines = [t + ' #  9.6259,  3.13279,    7.185\r\n' for t in self.time_strings]
+        buf = ''.join(lines)
+        offsets = np.cumsum([0] + [len(line) for line in lines[:-1]])
+        epts = dcl_offsets_to_epoch(buf, offsets)
+        np.testing.assert_array_equal(epts, self.expected)
+
+        # offsets that would run past either end of the buffer are rejected
+        truncated = buf[:offsets[-1] + 10]
+        self.assertRaises(ValueError, dcl_offsets_to_epoch, truncated, offsets)
+        self.assertRaises(ValueError, dcl_offsets_to_epoch, buf, [-1])
+
+
+@attr('parse')
+class TestColumnStoreUnit(unittest.TestCase):
+    '''
+    Confirm the typed column buffers grow as records are added, hold
+    per-record vectors as 2D arrays, and serialize to the same JSON as a Bunch
+    of lists.
+    '''
+    def test_column_buffer(self):
+        '''
+        Test appending and extending scalar and vector columns.
+        '''
+        scalar = ColumnBuffer('u2', capacity=4)
+        for i in range(10):
+            scalar.append(i)
+        scalar.extend(range(10, 20))
+        self.assertEqual(len(scalar), 20)
+        self.assertEqual(scalar[-1], 19)
+        np.testing.assert_array_equal(scalar, np.arange(20))
+
+        vector = ColumnBuffer('i2', capacity=2)
+        for i in range(5):
+            vector.append([i, -i, 2 * i])
+        vector.extend([[5, -5, 10]])
+        final = vector.finalize()
+        self.assertEqual(final.shape, (6, 3))
+        self.assertEqual(final.dtype, np.int16)
+        np.testing.assert_array_equal(final[:, 2], np.arange(6) * 2)
+
+        # records that differ in shape fall back to a list
+        vector.append([1, 2])
+        self.assertEqual(len(vector), 7)
+        self.assertEqual(vector.tolist()[-2:], [[5, -5, 10], [1, 2]])
+
+    def test_column_store(self):
+        '''
+        Test the JSON and dictionary outputs of the store against a Bunch.
+        '''
+        names = ['time', 'counts', 'spectra', 'label']
+        store = ColumnStore()
+        store.add_columns(names, {'time': 'f8', 'counts': 'u1', 'spectra': 'f4'})
+        bunch = Bunch()
+        for name in names:
+            bunch[name] = []
+
+        for data in (store, bunch):
+            for i in range(3):
+                data.time.append(1483228800.0 + i / 10.)
+                data.counts.append(i)
+                data.spectra.append([0.5 * i, 0.25, -1.0])
+                data.label.append('record %d' % i)
+
+        self.assertIsInstance(store.time, ColumnBuffer)
+        self.assertIsInstance(store.label, list)
+        self.assertEqual(store.toJSON(), bunch.toJSON())
+        self.assertEqual(store.toDict(), bunch.toDict())
+
+        store.finalize()
+        self.assertIsInstance(store.spectra, np.ndarray)
+        self.assertEqual(store.spectra.shape, (3, 3))
+        self.assertEqual(store.toJSON(), bunch.toJSON())
+
+    def test_write_json(self):
+        '''
+        Test streaming the store to a file, in chunks smaller than a record,
+        gives the same output as the toJSON method.
+        '''
+        store = ColumnStore()
+        store.add_columns(['time', 'spectra', 'ragged', 'label', 'empty'],
+                          {'time': 'f8', 'spectra': 'u2', 'ragged': 'i4'})
+        store.nested = ColumnStore()
+        store.nested.add_columns(['time', 'counts'], {'time': 'f8'})
+        for i in range(7):
+            store.time.append(1483228800.0 + i / 10.)
+            store.spectra.append([i, 2 * i, 3 * i])
+            store.ragged.append(range(i % 3))
+            store.label.append('record %d' % i)
+            store.nested.time.append(i * 0.1)
+            store.nested.counts.append(i)
+
+        chunk = common.JSON_CHUNK
+        try:
+            for size in [1, 2, 5, 1000]:
+                common.JSON_CHUNK = size
+                f = StringIO()
+                write_json(store, f)
+                self.assertEqual(f.getvalue(), store.toJSON())
+        finally:
+            common.JSON_CHUNK = chunk
+
+
+@attr('parse')
+class TestParseCacheUnit(unittest.TestCase):
+    '''
+    Confirm the parse cache returns the results for unchanged files without
+    parsing them again, and parses files that have changed.
+    '''
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.infile = path.join(self.tmpdir, '20161219.ctdbp2.log')
+        self.outfile = path.join(self.tmpdir, '20161219.ctdbp2.json')
+        self.options = Namespace(cache=path.join(self.tmpdir, 'cache'), switch=2)
+        shutil.copy(TESTDATA_CTDBP, self.infile)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _parse(self, parsed=True):
+        '''
+        Run the parser, confirming the data was or was not parsed.
+        '''
+        ctdbp = Parser(self.infile, 2)
+        calls = []
+        parse_data = ctdbp.parse_data
+        ctdbp.parse_data = lambda: calls.append(parse_data())
+        run_parser(ctdbp, self.outfile, self.options)
+        self.assertEqual(len(calls), int(parsed))
+
+        with open(self.outfile, 'r') as f:
+            return f.read()
+
+    def test_parse_cache(self):
+        '''
+        Test cache hits and misses for the same and changed data files.
+        '''
+        first = self._parse(True)
+        os.remove(self.outfile)
+        self.assertEqual(self._parse(False), first)
+
+        # a different switch value is a different entry
+        self.options.switch = 1
+        self._parse(True)
+        self.options.switch = 2
+
+        # changing the contents of the file forces a new parse
+        with open(self.infile, 'ab') as f:
+            f.write('2016/12/19 23:00:00.000 # 10.1877,  3.66669,   88.598,  188.850, 19 Dec 2016 23:00:00\r\n')
+        self.assertNotEqual(self._parse(True), first)
+
+    def test_parse_cache_version(self):
+        '''
+        Test a change to any of the modules in the parsers package (not just the
+        parser itself) changes the parser version.
+        '''
+        package = path.join(self.tmpdir, 'parsers')
+        os.mkdir(package)
+        for name in ['parse_ctdbp.py', 'checksum.py']:
+            with open(path.join(package, name), 'w') as f:
+                f.write('# %s\n' % name)
+
+        first = cache._source_hash(package)
+        with open(path.join(package, 'checksum.py'), 'a') as f:
+            f.write('CRC = 0\n')
+        del cache._VERSIONS[package]
+        self.assertNotEqual(cache._source_hash(package), first)
+
+    def test_parse_cache_evict(self):
+        '''
+        Test the least recently used entries are removed when the cache is
+        too large.
+        '''
+        self._parse(True)
+        ParseCache(self.options.cache, max_size=0).evict()
+        self.assertEqual(os.listdir(path.join(self.options.cache, 'data')), [])
+        self._parse(True)
+
+
+@attr('parse')
+class TestScanUnit(unittest.TestCase):
+    '''
+    Confirm the signature prefilter finds the same records as matching the
+    regex against each line.
+    '''
+    def test_scan_signature(self):
+        regex = re.compile(common.DCL_TIMESTAMP + r'\s+GPS\s(\d+)' + common.NEWLINE, re.DOTALL)
+        buf = (b'2016/12/19 00:00:05.084 GPS 1\r\n'
+               b'2016/12/19 00:00:06.084 [gps:DLOGP1]:Instrument Started [Power On]\n'
+               b'GPS 2 2016/12/19 00:00:07.084 GPS 3\n'
+               b'2016/12/19 00:00:08.084 GPS bad\n'
+               b'2016/12/19 00:00:09.084    GPS 4\n'
+               b'2016/12/19 00:00:10.084 GPS 5')
+        expected = [regex.match(line) for line in StringIO(buf).readlines()]
+        expected = [m.groups() for m in expected if m]
+        self.assertEqual([m.groups() for m in common.scan_buffer(regex, buf)], expected)
+
+        results = list(common.scan_signature(regex, buf, b'GPS'))
+        self.assertEqual([m.groups() for m in results if m], expected)
+        self.assertEqual(len(results), 5)   # the lines tried, the status line is skipped
+
+
+@attr('parse')
+class TestFieldsUnit(unittest.TestCase):
+    '''
+    Confirm the records converted in bulk by parse_fields are the same as
+    those found by matching the regex against each line.
+    '''
+    def test_parse_fields(self):
+        '''
+        Test the CTDBP records, including lines left for the regex (a logger ID,
+        values or timestamps that fail the checks, and a last line missing its
+        line ending), from a string and from a list of lines.
+        '''
+        with open(TESTDATA_CTDBP, 'rb') as f:
+            raw = f.read()
+        raw += (b'2016/12/19 23:35:25.195 [ctdbp2:DLOGP3]: 10.1877,  3.66669,   88.598,  188.850, '
+                b'19 Dec 2016 23:35:24\r\n'
+                b'2016/12/19 23:36:25.195  .1877,  3.66669,   88.598,  188.850, 19 Dec 2016 23:36:24\r\n'
+                b'2016/12/19 23:37:25.195  nan,  3.66669,   88.598,  188.850, 19 Dec 2016 23:37:24\r\n'
+                b'2016/12/19T23:38:25.195  10.1877,  3.66669,   88.598,  188.850, 19 Dec 2016 23:38:24\r\n'
+                b'2016/12/19 23:39:25.195  10.1877,  3.66669,   88.598,  188.850, 19 Dec 2016 23:39:24')
+
+        # the records found by the regex, line by line
+        expected = Parser(TESTDATA_CTDBP, 2)
+        regex = re.compile(CTDBP2, re.DOTALL)
+        for line in StringIO(raw).readlines():
+            match = regex.match(line)
+            if match:
+                expected._build_parsed_values(match)
+
+        for data in [raw, StringIO(raw).readlines()]:
+            parser = Parser(TESTDATA_CTDBP, 2)
+            parser.raw = data
+            parser.parse_data()
+            for name in expected.data.keys():
+                if name != 'time':
+                    self.assertEqual(list(parser.data[name]), list(expected.data[name]), name)
+            self.assertEqual(parser.data.dcl_date_time_string[-2], '2016/12/19 23:35:25.195')
+            self.assertEqual(parser.data.dcl_date_time_string[-1], '2016/12/19 23:39:25.195')
+
+    def test_columns(self):
+        '''
+        Test the column converters accept the same values as the regex
+        patterns, with the missing METBK values set to NaN.
+        '''
+        self.assertEqual(common.float_column([' 1.5', '-2.25', '1.0e-3']), [1.5, -2.25, 0.001])
+        for value in ['.5', '5', 'nan', 'inf', '1.5 ']:
+            self.assertRaises(ValueError, common.float_column, ['1.5', value])
+        self.assertEqual(common.int_column(['1', '-20']), [1, -20])
+        self.assertRaises(ValueError, common.int_column, ['1', '2.0'])
+
+        values = common.fltnan_column(['1.5', 'NaN', 'Na', 'N'])
+        self.assertEqual(values[0], 1.5)
+        self.assertTrue(np.isnan(values[1:]).all())
+        self.assertRaises(ValueError, common.fltnan_column, ['1.5', 'nan'])
+
+        convert = common.format_column('99 AAA 9999 99:99:99')
+        self.assertEqual(convert(['19 Dec 2016 00:35:24']), ['19 Dec 2016 00:35:24'])
+        for value in ['19 Dec 2016 00:35:2x', '19 Dec 2016 00:35:245', '19 De  2016 00:35:24']:
+            self.assertRaises(ValueError, convert, ['19 Dec 2016 00:35:24', value])
+
+
+@attr('parse')
+class TestWriteUnit(unittest.TestCase):
+    '''
+    Confirm the output files written by run_parser.
+    '''
+    def test_write_gzip(self):
+        '''
+        Test writing the output to a gzip compressed JSON file.
+        '''
+        tmpdir = tempfile.mkdtemp()
+        try:
+            outfile = path.join(tmpdir, '20161219.ctdbp2.json.gz')
+            ctdbp = Parser(TESTDATA_CTDBP, 2)
+            run_parser(ctdbp, outfile)
+            with gzip.open(outfile, 'rb') as f:
+                self.assertEqual(f.read(), ctdbp.data.toJSON())
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+@attr('parse')
+@unittest.skipIf(Dataset is None, 'requires the netCDF4 package')
+class TestNetCDFUnit(unittest.TestCase):
+    '''
+    Confirm the parsed data written to a NetCDF file matches the JSON output.
+    '''
+    def test_write_netcdf(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            outfile = path.join(tmpdir, '20161219.ctdbp2.nc')
+            ctdbp = Parser(TESTDATA_CTDBP, 2)
+            run_parser(ctdbp, outfile, Namespace(format='netcdf'))
+            parsed = ctdbp.data.toDict()
+
+            nc = Dataset(outfile)
+            try:
+                self.assertEqual(nc.dimensions['time'].size, len(parsed['time']))
+                self.assertEqual(nc.variables['time'].units, 'seconds since 1970-01-01 00:00:00 0:00')
+                for name in ['time', 'temperature', 'conductivity', 'pressure', 'oxygen_concentration']:
+                    np.testing.assert_array_equal(nc.variables[name][:], parsed[name])
+                self.assertEqual(list(nc.variables['ctd_date_time_string'][:]), parsed['ctd_date_time_string'])
+            finally:
+                nc.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_write_columns(self):
+        '''
+        Test strings are saved as compressed character arrays, vectors that
+        differ in length are padded, and columns without a value for every
+        record get their own record dimension.
+        '''
+        data = Bunch(time=[1.0, 2.0, 3.0], date_time_string=['2016/12/19 00:00:05.084', '', 'short'],
+                     profiles_freq1=[[1, 2, 3], [4], []], number_bins=[3, 1, 0],
+                     header=Bunch(time=[1.0, 3.0], beam_distances=[[1, 2], [3, 4], [5, 6]]))
+        tmpdir = tempfile.mkdtemp()
+        try:
+            outfile = path.join(tmpdir, 'columns.nc')
+            write_netcdf(data, outfile)
+
+            nc = Dataset(outfile)
+            try:
+                strings = nc.variables['date_time_string']
+                self.assertEqual(strings.dimensions, ('time', 'strlen23'))
+                self.assertTrue(strings.filters()['zlib'])
+                self.assertEqual(list(strings[:]), data.date_time_string)
+
+                profiles = nc.variables['profiles_freq1']
+                self.assertEqual(profiles.dimensions, ('time', 'bins_freq1'))
+                self.assertTrue(profiles.filters()['zlib'])
+                values = profiles[:]
+                np.testing.assert_array_equal(values[0], [1, 2, 3])
+                np.testing.assert_array_equal(values.mask, [[False] * 3, [False, True, True], [True] * 3])
+                np.testing.assert_array_equal(nc.variables['profiles_freq1_length'][:], data.number_bins)
+
+                header = nc.groups['header']
+                self.assertEqual(header.dimensions['time'].size, 2)
+                distances = header.variables['beam_distances']
+                self.assertEqual(distances.dimensions[0], 'beam_distances_records')
+                np.testing.assert_array_equal(distances[:], data.header.beam_distances)
+            finally:
+                nc.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
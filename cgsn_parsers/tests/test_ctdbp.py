@@ -7,11 +7,15 @@
 @brief Unit tests for parsing the 3 different types of CTDBP data
 """
 import numpy as np
+import shutil
+import tempfile
 import unittest
 
+from argparse import Namespace
 from nose.plugins.attrib import attr
 from os import path
 
+from cgsn_parsers.parsers.common import run_parser
 from cgsn_parsers.parsers.parse_ctdbp import Parser
 
 
@@ -175,6 +179,66 @@ class TestParsingUnit(unittest.TestCase):
         np.testing.assert_array_equal(parsed['raw_chlorophyll'], self.type3_expected[:, 4])
         np.testing.assert_array_equal(parsed['raw_cdom'], self.type3_expected[:, 5])
 
+    def test_parse_ctdbp_mmap(self):
+        '''
+        Test parsing the memory mapped file buffer returns the same results
+        as parsing the lines read in via readlines.
+        '''
+        self.ctdbp_type1.load_ascii()
+        self.ctdbp_type1.parse_data()
+
+        ctdbp = Parser(TESTDATA_CTDBP_TYPE1, 1)
+        ctdbp.load_mmap()
+        ctdbp.parse_data()
+
+        self.assertEqual(ctdbp.data.toJSON(), self.ctdbp_type1.data.toJSON())
+
+    def test_parse_ctdbp_batches(self):
+        '''
+        Test parsing the file in batches, with lines split across the
+        batches, returns the same results as parsing the whole file.
+        '''
+        self.ctdbp_type1.load_ascii()
+        self.ctdbp_type1.parse_data()
+
+        ctdbp = Parser(TESTDATA_CTDBP_TYPE1, 1)
+        batches = list(ctdbp.iter_batches(4096))
+        self.assertTrue(len(batches) > 1)
+
+        parsed = batches[0]
+        for batch in batches[1:]:
+            parsed.extend(batch)
+
+        self.assertEqual(parsed.toJSON(), self.ctdbp_type1.data.toJSON())
+
+    def test_parse_ctdbp_append(self):
+        '''
+        Test parsing a growing file in append mode, with the file ending part
+        way through a line between runs, returns the same results as parsing
+        the whole file.
+        '''
+        with open(TESTDATA_CTDBP_TYPE1, 'rb') as f:
+            raw = f.read()
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            infile = path.join(tmpdir, '20161219.ctdbp1.log')
+            outfile = path.join(tmpdir, '20161219.ctdbp1.json')
+            for stop in [len(raw) // 3 + 17, 2 * len(raw) // 3, len(raw)]:
+                with open(infile, 'wb') as f:
+                    f.write(raw[:stop])
+
+                run_parser(Parser(infile, 1), outfile, Namespace(append=True))
+                self.assertTrue(path.exists(outfile + '.ckpt'))
+
+                ctdbp = Parser(infile, 1)
+                ctdbp.load_ascii()
+                ctdbp.parse_data()
+                with open(outfile, 'r') as f:
+                    self.assertEqual(f.read(), ctdbp.data.toJSON())
+        finally:
+            shutil.rmtree(tmpdir)
+
 
 if __name__ == '__main__':
     unittest.main()
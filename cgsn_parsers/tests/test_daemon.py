@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@package cgsn_parsers.tests.test_daemon
+@file cgsn_parsers/tests/test_daemon.py
+@author Christopher Wingard
+@brief Unit tests for the parser daemon and client
+"""
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from nose.plugins.attrib import attr
+from os import path
+
+from cgsn_parsers.daemon import make_server, submit
+from cgsn_parsers.parsers.parse_ctdbp import Parser
+
+TESTDATA = path.join(path.dirname(__file__), 'ctdbp', '20161219.ctdbp1.log')
+
+
+@attr('parse')
+class TestDaemonUnit(unittest.TestCase):
+    '''
+    Start the daemon in a background thread and submit jobs to it.
+    '''
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.socket = path.join(self.root, 'parsers.sock')
+        self.server, failed = make_server(self.socket, workers=1)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.root)
+
+    def test_submit(self):
+        '''
+        Test parsing a file via the daemon gives the same results as the parser.
+        '''
+        outfile = path.join(self.root, 'ctdbp', '20161219.ctdbp1.json')
+        result = submit({'parser': 'ctdbp', 'infile': TESTDATA, 'outfile': outfile, 'switch': 1},
+                        self.socket)
+        self.assertEqual(result['status'], 'ok')
+        self.assertIsNone(result['error'])
+        self.assertGreaterEqual(result['total'], result['elapsed'])
+
+        ctdbp = Parser(TESTDATA, 1)
+        ctdbp.load_ascii()
+        ctdbp.parse_data()
+        with open(outfile, 'r') as f:
+            self.assertEqual(f.read(), ctdbp.data.toJSON())
+
+    def test_detect_switch(self):
+        '''
+        Test the switch is detected from the file when the request names the
+        parser but not the switch.
+        '''
+        outfile = path.join(self.root, 'ctdbp', '20161219.ctdbp1.json')
+        result = submit({'parser': 'ctdbp', 'infile': TESTDATA, 'outfile': outfile}, self.socket)
+        self.assertEqual(result['status'], 'ok')
+        self.assertIsNone(result['error'])
+
+        ctdbp = Parser(TESTDATA, 1)
+        ctdbp.load_ascii()
+        ctdbp.parse_data()
+        with open(outfile, 'r') as f:
+            self.assertEqual(f.read(), ctdbp.data.toJSON())
+
+    def test_errors(self):
+        '''
+        Test errors are reported back to the client, without stopping the daemon.
+        '''
+        outfile = path.join(self.root, 'missing.json')
+        result = submit({'parser': 'nonesuch', 'infile': TESTDATA, 'outfile': outfile}, self.socket)
+        self.assertEqual(result['status'], 'error')
+        self.assertIn('Unknown parser', result['error'])
+
+        result = submit({'parser': 'ctdbp', 'infile': path.join(self.root, 'missing.log'),
+                         'outfile': outfile}, self.socket)
+        self.assertEqual(result['status'], 'error')
+        self.assertIn('IOError', result['error'])
+        self.assertFalse(path.exists(outfile))
+
+    def test_running(self):
+        '''
+        Test a second daemon refuses to take over the socket of a running
+        daemon, and that a stale socket is replaced without being removed
+        later by the daemon it replaced.
+        '''
+        self.assertRaises(IOError, make_server, self.socket, 1)
+        self.assertTrue(path.exists(self.socket))
+
+        # leave a stale socket behind, with nothing listening on it
+        stale = path.join(self.root, 'stale.sock')
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(stale)
+        sock.close()
+
+        server, failed = make_server(stale, workers=1)
+        inode = os.stat(stale).st_ino
+
+        # replace the socket, as a newer daemon would, before closing the server
+        # (keeping a link to the old one, so its inode is not reused)
+        os.link(stale, path.join(self.root, 'old.sock'))
+        os.remove(stale)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(stale)
+        server.server_close()
+        sock.close()
+        self.assertTrue(path.exists(stale))
+        self.assertNotEqual(os.stat(stale).st_ino, inode)
+
+        # the server that bound the socket removes it when it closes
+        server, failed = make_server(stale, workers=1)
+        server.server_close()
+        self.assertFalse(path.exists(stale))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@package cgsn_parsers.tests.test_metrics
+@file cgsn_parsers/tests/test_metrics.py
+@author Christopher Wingard
+@brief Unit tests for the parser counters and timings
+"""
+import json
+import shutil
+import tempfile
+import unittest
+
+from argparse import Namespace
+from nose.plugins.attrib import attr
+from os import path
+
+from cgsn_parsers.parsers.common import run_parser
+from cgsn_parsers.parsers.metrics import PHASES, Metrics
+from cgsn_parsers.parsers.parse_ctdbp import Parser as Ctdbp
+from cgsn_parsers.parsers.parse_gps import Parser as Gps
+from cgsn_parsers.parsers.parse_optaa import Parser as Optaa
+
+TESTDATA_CTDBP = path.join(path.dirname(__file__), 'ctdbp/20161219.ctdbp2.log')
+TESTDATA_OPTAA = path.join(path.dirname(__file__), 'optaa/20150809_075841.optaa_cspp.log')
+
+
+@attr('parse')
+class TestMetricsUnit(unittest.TestCase):
+    '''
+    Confirm the lines and packets scanned, matched and rejected are counted,
+    and the results saved as JSON and Prometheus textfiles.
+    '''
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_run_parser(self):
+        '''
+        Test the metrics files written by run_parser for the CTDBP test data.
+        '''
+        outfile = path.join(self.tmpdir, 'ctdbp.json')
+        jsonfile = path.join(self.tmpdir, 'ctdbp.metrics.json')
+        promfile = path.join(self.tmpdir, 'ctdbp.prom')
+        parser = Ctdbp(TESTDATA_CTDBP, 2)
+        run_parser(parser, outfile, Namespace(switch=2, metrics=[jsonfile, promfile]))
+
+        with open(TESTDATA_CTDBP, 'rb') as f:
+            lines = f.readlines()
+
+        with open(jsonfile, 'r') as f:
+            metrics = json.load(f)
+        self.assertEqual(metrics['parser'], 'ctdbp')
+        self.assertEqual(metrics['counters']['bytes'], path.getsize(TESTDATA_CTDBP))
+        self.assertEqual(metrics['counters']['scanned'], len(lines))
+        self.assertEqual(metrics['counters']['matched'], len(parser.data.time))
+        self.assertEqual(metrics['counters']['rejected_regex'], len(lines) - len(parser.data.time))
+        self.assertEqual(sorted(metrics['timings'].keys()), sorted(PHASES))
+
+        with open(promfile, 'r') as f:
+            text = f.read()
+        self.assertEqual(metrics['infile'], '20161219.ctdbp2.log')
+        self.assertIn('# TYPE cgsn_parser_matched gauge', text)
+        self.assertIn('cgsn_parser_matched{parser="ctdbp"} %d' % len(parser.data.time), text)
+        self.assertIn('cgsn_parser_rejected{parser="ctdbp",reason="regex"} %d'
+                      % (len(lines) - len(parser.data.time)), text)
+        self.assertNotIn('infile', text)
+        self.assertNotIn('_total', text)
+
+        # without the metrics option, the counters are not collected
+        parser = Ctdbp(TESTDATA_CTDBP, 2)
+        run_parser(parser, outfile, Namespace(switch=2))
+        self.assertFalse(parser.metrics.enabled)
+
+    def test_prefilter(self):
+        '''
+        Test the lines skipped by the signature prefilter are counted.
+        '''
+        infile = path.join(self.tmpdir, '20170101.gps.log')
+        with open(infile, 'wb') as f:
+            f.write(b'2017/01/01 00:00:00.000 [gps:DLOGP1]:Instrument Started [Power On]\r\n'
+                    b'2017/01/01 00:01:00.000 GPS 44.63895 -124.30386 0.32 155.20 1 9 0.9 3.2 '
+                    b'010117 000100 4438.3370 N 12418.2316 W\r\n'
+                    b'2017/01/01 00:02:00.000 GPS garbled\r\n')
+
+        parser = Gps(infile)
+        parser.metrics = Metrics()
+        parser.load_mmap()
+        parser.parse_data()
+
+        self.assertEqual(len(parser.data.time), 1)
+        self.assertEqual(parser.metrics.counters['scanned'], 3)
+        self.assertEqual(parser.metrics.counters['matched'], 1)
+        self.assertEqual(parser.metrics.counters['rejected_prefilter'], 1)
+        self.assertEqual(parser.metrics.counters['rejected_regex'], 1)
+
+    def test_checksum(self):
+        '''
+        Test an OPTAA packet with a bad checksum is counted as rejected.
+        '''
+        with open(TESTDATA_OPTAA, 'rb') as f:
+            raw = f.read()
+
+        parser = Optaa(TESTDATA_OPTAA)
+        parser.metrics = Metrics()
+        parser.raw = raw
+        parser.parse_data()
+        good = len(parser.data.time)
+
+        # corrupt a byte in the middle of the first packet
+        start = raw.index(b'\xff\x00\xff\x00')
+        raw = raw[:start + 100] + chr(ord(raw[start + 100]) ^ 0xff) + raw[start + 101:]
+        parser = Optaa(TESTDATA_OPTAA)
+        parser.metrics = Metrics()
+        parser.raw = raw
+        parser.parse_data()
+
+        self.assertEqual(len(parser.data.time), good - 1)
+        self.assertEqual(parser.metrics.counters['matched'], good)
+        self.assertEqual(parser.metrics.counters['rejected_checksum'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
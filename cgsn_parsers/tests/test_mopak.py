@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@package cgsn_parsers.tests.test_mopak
+@file cgsn_parsers/tests/test_mopak.py
+@author Christopher Wingard
+@brief Unit tests for parsing the MOPAK data
+"""
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+from nose.plugins.attrib import attr
+from struct import unpack
+
+from cgsn_parsers.benchmarks.generators import records
+from cgsn_parsers.parsers.metrics import Metrics
+from cgsn_parsers.parsers.parse_mopak import Parser
+
+
+@attr('parse')
+class TestParsingUnit(unittest.TestCase):
+    '''
+    The MOPAK packets are found and decoded for the whole file at once. Confirm
+    the values match those in the packets, and that corrupted packets are
+    dropped without losing the packets around them.
+    '''
+    def setUp(self):
+        packets = records('mopak')
+        self.packets = [next(packets) for i in range(200)]
+        self.values = np.array([unpack('>B9fIH', packet)[1:11] for packet in self.packets])
+        self.tmpdir = tempfile.mkdtemp()
+        self.infile = os.path.join(self.tmpdir, '20170101_000000.mopak.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _parse(self, raw):
+        with open(self.infile, 'wb') as f:
+            f.write(raw)
+
+        mopak = Parser(self.infile)
+        mopak.metrics = Metrics()
+        mopak.load_binary()
+        mopak.parse_data()
+        return mopak
+
+    def test_parse_mopak(self):
+        '''
+        Test parsing of the MOPAK data, checking the values against those
+        unpacked from the packets.
+        '''
+        mopak = self._parse(''.join(self.packets))
+        data = mopak.data
+        names = ['acceleration_x', 'acceleration_y', 'acceleration_z', 'angular_rate_x', 'angular_rate_y',
+                 'angular_rate_z', 'magnetometer_x', 'magnetometer_y', 'magnetometer_z']
+        for i, name in enumerate(names):
+            np.testing.assert_array_equal(data[name].tolist(), self.values[:, i].astype(np.float32))
+
+        np.testing.assert_array_equal(data.timer.tolist(), self.values[:, 9] / 62500.)
+        self.assertEqual(mopak.metrics.counters['matched'], 200)
+        self.assertEqual(mopak.metrics.counters['rejected_checksum'], 0)
+
+    def test_corrupted(self):
+        '''
+        Test a corrupted packet is rejected, and the packets following it are
+        found, including one starting within the bytes of the corrupted packet
+        (a packet cut short).
+        '''
+        packets = list(self.packets[:10])
+        packets[3] = packets[3][:20]                    # packet cut short
+        bad = bytearray(packets[6])
+        bad[10] ^= 0x01
+        packets[6] = str(bad)                           # bad checksum
+        packets.insert(8, '\xcb\x00\xcb')               # junk with sync bytes
+        mopak = self._parse(''.join(packets))
+
+        expected = [i for i in range(10) if i not in (3, 6)]
+        np.testing.assert_array_equal(mopak.data.timer.tolist(), self.values[expected, 9] / 62500.)
+        self.assertEqual(mopak.metrics.counters['rejected_checksum'], 4)
+
+    def test_parse_batches(self):
+        '''
+        Test parsing the file in batches, with packets split across the
+        batches, returns the same results as parsing the whole file.
+        '''
+        mopak = self._parse(''.join(self.packets))
+        expected = mopak.data.toDict()
+
+        mopak = Parser(self.infile)
+        data = mopak._parameter_names.create_dict()
+        for batch in mopak.iter_batches(batch_size=1000):
+            data.extend(batch)
+        self.assertEqual(data.toDict(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
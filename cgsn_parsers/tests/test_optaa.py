@@ -8,13 +8,23 @@
 """
 import numpy as np
 import json
+import shutil
+import tempfile
 import unittest
 
 from munch import Munch
 from nose.plugins.attrib import attr
 from os import path
 
-from cgsn_parsers.parsers.parse_optaa import Parser
+from cgsn_parsers.parsers.checksum import as_bytes
+from cgsn_parsers.parsers.metrics import Metrics
+from cgsn_parsers.parsers.parse_optaa import Parser, find_markers
+from cgsn_parsers.process.calibrations import CalibrationStore
+
+try:
+    from cgsn_parsers.process import proc_optaa
+except ImportError:
+    proc_optaa = None   # the processing requires the ion_functions package
 
 # data sources for testing the parser
 RAWDATA = path.join(path.dirname(__file__), 'optaa/20150809_075841.optaa_cspp.log')
@@ -26,6 +36,11 @@ DEVFILE = path.join(path.dirname(__file__), 'optaa/acs138_cspp_20140703.dev')
 COEFF_FILE = path.join(path.dirname(__file__), 'optaa/CGINS-OPTAAJ-00138_20150410.pkl')
 CSV_URL = 'https://github.com/ooi-integration/asset-management/raw/master/calibration/OPTAAJ/CGINS-OPTAAJ-00138__20150410.csv'
 
+# local copies of the CI hosted CSV files
+HDR_FILE = path.join(path.dirname(__file__), 'optaa/CGINS-OPTAAJ-00138__20150410.csv')
+TCA_FILE = path.join(path.dirname(__file__), 'optaa/CGINS-OPTAAJ-00138__20150410__CC_taarray.ext')
+TCC_FILE = path.join(path.dirname(__file__), 'optaa/CGINS-OPTAAJ-00138__20150410__CC_tcarray.ext')
+
 @attr('parse')
 class TestParsingUnit(unittest.TestCase):
     '''
@@ -67,6 +82,45 @@ class TestParsingUnit(unittest.TestCase):
         np.testing.assert_array_equal(num_wvlngths, self.expected[:, 5])
         np.testing.assert_array_equal(c_reference, self.expected[:, 7:7+ncols])
 
+    def test_parse_optaa_batches(self):
+        '''
+        Test parsing the OPTAA data file in batches, with packets split across
+        the batches, returns the same results as parsing the whole file.
+        '''
+        optaa = Parser(RAWDATA)
+        batches = list(optaa.iter_batches(5000))
+        self.assertTrue(len(batches) > 1)
+
+        parsed = batches[0]
+        for batch in batches[1:]:
+            parsed.extend(batch)
+
+        self.assertEqual(parsed.toJSON(), self.optaa.data.toJSON())
+
+    def test_parse_optaa_packets(self):
+        '''
+        Test the optical data are returned as (packets, wavelengths) arrays,
+        and that packets with a bad checksum or record length are dropped.
+        '''
+        data = self.optaa.data
+        shape = (len(data.time), self.optaa.nwave)
+        for name in ['c_reference_raw', 'a_reference_raw', 'c_signal_raw', 'a_signal_raw']:
+            self.assertEqual(np.asarray(data[name]).shape, shape)
+
+        with open(RAWDATA, 'rb') as f:
+            raw = bytearray(f.read())
+        starts = find_markers(as_bytes(str(raw)))
+        raw[starts[1] + 40] ^= 0x01     # optical data of the second packet
+        raw[starts[2] + 5] ^= 0x01      # record length of the third packet
+
+        optaa = Parser(RAWDATA)
+        optaa.metrics = Metrics()
+        optaa.raw = str(raw)
+        optaa.parse_data()
+        self.assertEqual(optaa.data.time.tolist(), [data.time[0]] + data.time.tolist()[3:])
+        self.assertEqual(optaa.metrics.counters['rejected_checksum'], 1)
+        self.assertEqual(optaa.metrics.counters['rejected_size'], 1)
+
 
 @attr('process')
 class TestProcessingUnit(unittest.TestCase):
@@ -85,41 +139,207 @@ class TestProcessingUnit(unittest.TestCase):
         with open(PARSED, 'rb') as f:
             self.optaa = Munch(json.load(f))
             
+    def assertCoeffsEqual(self, coeffs, expected):
+        '''
+        Check a set of calibration coefficients against the expected values.
+        '''
+        for name in ['serial_number', 'num_wavelengths', 'num_temp_bins', 'temp_calibration']:
+            self.assertEqual(coeffs[name], expected[name])
+        for name in ['a_wavelengths', 'c_wavelengths', 'a_offsets', 'c_offsets', 'temp_bins', 'ta_array',
+                     'tc_array', 'pressure_coeff']:
+            np.testing.assert_array_equal(coeffs[name], expected[name])
+
+    @unittest.skipIf(proc_optaa is None, 'requires the ion_functions package')
     def test_process_load_dev(self):
         '''
         Load a factory device file and parse
         '''
-        assert False
-        
+        dev = proc_optaa.Calibrations(COEFF_FILE)
+        dev.read_devfile(DEVFILE)
+        coeffs = dev.coeffs
+
+        self.assertEqual(coeffs['serial_number'], 138)
+        self.assertEqual(coeffs['temp_calibration'], 17.7)
+        self.assertEqual(coeffs['pathlength'], 0.25)
+        self.assertEqual(coeffs['num_wavelengths'], 85)
+        self.assertEqual(coeffs['num_temp_bins'], 35)
+        np.testing.assert_array_equal(coeffs['pressure_coeff'], [0, 0])
+        np.testing.assert_array_equal(coeffs['c_wavelengths'][:3], [401.0, 404.6, 408.4])
+        np.testing.assert_array_equal(coeffs['a_wavelengths'][:3], [400.9, 404.8, 408.7])
+        np.testing.assert_array_equal(coeffs['c_offsets'][:2], [0.89321, 0.931383])
+        np.testing.assert_array_equal(coeffs['a_offsets'][:2], [-0.470053, -0.206561])
+        np.testing.assert_array_equal(coeffs['temp_bins'][:3], [3.684966, 4.280077, 5.44602])
+        np.testing.assert_array_equal(coeffs['tc_array'][0, :3], [-0.041288, -0.036139, -0.02593])
+        np.testing.assert_array_equal(coeffs['ta_array'][0, :3], [-0.025781, -0.029597, -0.033319])
+        self.assertEqual(coeffs['tc_array'].shape, (85, 35))
+        self.assertEqual(coeffs['ta_array'].shape, (85, 35))
+
+    @unittest.skipIf(proc_optaa is None, 'requires the ion_functions package')
     def test_process_load_csv(self):
         '''
-        Load calibration coefficients from GitHub
+        Load calibration coefficients from local copies of the CSV files
+        hosted on GitHub
         '''
-        assert False
+        dev = proc_optaa.Calibrations(COEFF_FILE)
+        dev.read_devfile(DEVFILE)
+        expected = dev.coeffs
+
+        dev.read_devurls(HDR_FILE, TCA_FILE, TCC_FILE)
+        self.assertCoeffsEqual(dev.coeffs, expected)
 
+    @unittest.skipIf(proc_optaa is None, 'requires the ion_functions package')
     def test_process_load_pickle(self):
         '''
         Load the locally stored serialized calibrations object
         '''
-        assert False
+        dev = proc_optaa.Calibrations(COEFF_FILE)
+        dev.read_devfile(DEVFILE)
+        expected = dev.coeffs
 
+        dev = proc_optaa.Calibrations(COEFF_FILE)
+        dev.load_coeffs()
+        self.assertCoeffsEqual(dev.coeffs, expected)
+
+    @unittest.skipIf(proc_optaa is None, 'requires the ion_functions package')
+    def test_process_load_store(self):
+        '''
+        Load the calibration coefficients via a local calibration store,
+        reading the CSV files the first time and the saved coefficients after
+        '''
+        dev = proc_optaa.Calibrations(COEFF_FILE)
+        dev.load_coeffs()
+        expected = dev.coeffs
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            store = CalibrationStore(tmpdir)
+            dev = proc_optaa.Calibrations(COEFF_FILE)
+            dev.load_store(store, HDR_FILE, lambda hdr: dev.read_devurls(hdr, TCA_FILE, TCC_FILE))
+            self.assertCoeffsEqual(dev.coeffs, expected)
+
+            # a new store (e.g. in the next processor run) loads the saved
+            # coefficients, without reading the CSV files
+            def fail(hdr):
+                raise AssertionError('the CSV files should not be read again')
+
+            dev = proc_optaa.Calibrations(COEFF_FILE)
+            dev.load_store(CalibrationStore(tmpdir), HDR_FILE, fail)
+            self.assertCoeffsEqual(dev.coeffs, expected)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    @unittest.skipIf(proc_optaa is None, 'requires the ion_functions package')
     def test_process_apply_dev(self):
         '''
-        Apply the calibration data to the parsed data
+        Apply the calibration data to the parsed data, checking the results
+        for all of the packets at once against opt_pd_calc for each packet in
+        turn, including packets with zero reference or signal counts.
         '''
-        assert False
+        dev = proc_optaa.Calibrations(COEFF_FILE)
+        dev.read_devfile(DEVFILE)
+        coeffs = dev.coeffs
+
+        self.optaa.a_reference_raw[1][5] = 0
+        self.optaa.c_signal_raw[2][7] = 0
+        self.optaa.a_reference_raw[3][9] = self.optaa.a_signal_raw[3][9] = 0
+        optaa = proc_optaa.apply_dev(Munch(self.optaa), coeffs)
+
+        # the internal temperatures include both repeated and distinct values
+        temp = np.array(optaa.internal_temp)
+        self.assertTrue(1 < len(np.unique(temp)) < len(temp))
+
+        a_ref = np.array(self.optaa.a_reference_raw)
+        a_sig = np.array(self.optaa.a_signal_raw)
+        c_ref = np.array(self.optaa.c_reference_raw)
+        c_sig = np.array(self.optaa.c_signal_raw)
+        apd = np.array(optaa.apd)
+        cpd = np.array(optaa.cpd)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for ii in range(len(temp)):
+                expected, _ = proc_optaa.opt_pd_calc(a_ref[ii, :], a_sig[ii, :], coeffs['a_offsets'], temp[ii],
+                                                     coeffs['temp_bins'], coeffs['ta_array'])
+                np.testing.assert_allclose(apd[ii, :], expected, rtol=1e-10, atol=1e-12)
+                expected, _ = proc_optaa.opt_pd_calc(c_ref[ii, :], c_sig[ii, :], coeffs['c_offsets'], temp[ii],
+                                                     coeffs['temp_bins'], coeffs['tc_array'])
+                np.testing.assert_allclose(cpd[ii, :], expected, rtol=1e-10, atol=1e-12)
 
+        self.assertFalse(np.isfinite(apd[1, 5]))
+        self.assertFalse(np.isfinite(cpd[2, 7]))
+        self.assertFalse(np.isfinite(apd[3, 9]))
+
+    @unittest.skipIf(proc_optaa is None, 'requires the ion_functions package')
     def test_process_apply_tscorr(self):
         '''
-        Apply the temperature and salinity corrections to the data
+        Apply the temperature and salinity corrections to the data, checking
+        the results for all of the packets at once against opt_tempsal_corr for
+        each packet in turn.
         '''
-        assert False
+        dev = proc_optaa.Calibrations(COEFF_FILE)
+        dev.read_devfile(DEVFILE)
+        coeffs = dev.coeffs
+
+        rnd = np.random.RandomState(0)
+        npackets = len(self.optaa.time)
+        nwave = len(coeffs['a_wavelengths'])
+        self.optaa.apd = rnd.uniform(0, 1, (npackets, nwave)).tolist()
+        self.optaa.cpd = rnd.uniform(0, 2, (npackets, nwave)).tolist()
+        temp = rnd.uniform(5, 25, npackets)
+        salinity = rnd.uniform(30, 35, npackets)
+        optaa = proc_optaa.apply_tscorr(Munch(self.optaa), coeffs, temp, salinity)
+
+        apd = np.array(self.optaa.apd)
+        cpd = np.array(self.optaa.cpd)
+        for ii in range(npackets):
+            expected = proc_optaa.opt_tempsal_corr('a', apd[ii, :], coeffs['a_wavelengths'],
+                                                   coeffs['temp_calibration'], temp[ii], salinity[ii])
+            np.testing.assert_allclose(optaa.apd_ts[ii], expected, rtol=1e-10, atol=1e-12)
+            expected = proc_optaa.opt_tempsal_corr('c', cpd[ii, :], coeffs['c_wavelengths'],
+                                                   coeffs['temp_calibration'], temp[ii], salinity[ii])
+            np.testing.assert_allclose(optaa.cpd_ts[ii], expected, rtol=1e-10, atol=1e-12)
 
+    @unittest.skipIf(proc_optaa is None, 'requires the ion_functions package')
+    def test_process_scatter_weights(self):
+        '''
+        Test the interpolation weights for the scatter correction against
+        np.interp, for sorted and unsorted wavelengths, at and between the
+        wavelengths and at either end of the range.
+        '''
+        rnd = np.random.RandomState(0)
+        wavelengths = np.linspace(400.3, 749.7, 83)
+        values = rnd.uniform(0, 1, 83)
+        order = rnd.permutation(83)
+        for wvlngth, apd in [(wavelengths, values), (wavelengths[order], values[order])]:
+            for reference in [715., wavelengths[0], wavelengths[-1], wavelengths[40], 500.]:
+                lower, upper, w0, w1 = proc_optaa.scatter_weights(wvlngth, reference)
+                self.assertAlmostEqual(w0 * apd[lower] + w1 * apd[upper],
+                                       np.interp(reference, wavelengths, values), places=12)
+
+            for reference in [wavelengths[0] - 0.1, wavelengths[-1] + 0.1]:
+                self.assertRaises(ValueError, proc_optaa.scatter_weights, wvlngth, reference)
+
+    @unittest.skipIf(proc_optaa is None, 'requires the ion_functions package')
     def test_process_apply_scatcorr(self):
         '''
-        Apply the scatter correction to the data
+        Apply the scatter correction to the data, checking the absorption at
+        715 nm is linearly interpolated for each packet.
         '''
-        assert False
+        dev = proc_optaa.Calibrations(COEFF_FILE)
+        dev.read_devfile(DEVFILE)
+        wavelengths = dev.coeffs['a_wavelengths']
+
+        rnd = np.random.RandomState(0)
+        npackets = len(self.optaa.time)
+        apd = rnd.uniform(0, 1, (npackets, len(wavelengths)))
+        apd_ts = rnd.uniform(0, 1, (npackets, len(wavelengths)))
+        optaa = Munch(time=self.optaa.time, a_wavelengths=wavelengths.tolist(), apd=apd.tolist(),
+                      apd_ts=apd_ts.tolist())
+        optaa = proc_optaa.apply_scatcorr(optaa)
+
+        order = np.argsort(wavelengths)
+        for ii in range(npackets):
+            scatter = np.interp(715., wavelengths[order], apd[ii, order])
+            np.testing.assert_allclose(optaa.apd_ts_s[ii], apd_ts[ii, :] - scatter, rtol=1e-12)
+        self.assertRaises(Exception, proc_optaa.apply_scatcorr, optaa, 2)
 
 if __name__ == '__main__':       
     unittest.main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@package cgsn_parsers.tests.test_registry
+@file cgsn_parsers/tests/test_registry.py
+@author Christopher Wingard
+@brief Unit tests for the parser registry
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from nose.plugins.attrib import attr
+from os import path
+
+from cgsn_parsers.benchmarks.generators import records
+from cgsn_parsers.parsers import create_parser, detect
+from cgsn_parsers.parsers.registry import SWITCHES, match_name
+from cgsn_parsers.parsers.parse_ctdbp import Parser
+
+TESTDATA = path.join(path.dirname(__file__), 'ctdbp')
+
+
+@attr('parse')
+class TestRegistryUnit(unittest.TestCase):
+    '''
+    Test selecting the parser and switch from the log file name and contents.
+    '''
+    def test_match_name(self):
+        '''
+        Test the parser names for the harvested log files.
+        '''
+        self.assertEqual(match_name('/raw/dcl35/adcps/20161219.adcps.log'), 'adcp')
+        self.assertEqual(match_name('/raw/dcl11/hyd1/20161219.hyd1.log'), 'hydgn')
+        self.assertEqual(match_name('/raw/dcl11/mopak/20161219_000000.mopak.log'), 'mopak')
+        self.assertEqual(match_name('20150809_075841.optaa_cspp.log'), 'optaa')
+        self.assertEqual(match_name('/raw/cg_data/superv/20161219.superv.log'), 'superv_cpm')
+        self.assertEqual(match_name('/raw/cg_data/cpm2/superv/20161219.superv.log'), 'superv_cpm')
+        self.assertEqual(match_name('/raw/cg_data/dcl27/superv/20161219.superv.log'), 'superv_dcl')
+        self.assertIsNone(match_name('/raw/cg_data/dcl27/syslog/20161219.syslog.log'))
+        self.assertRaises(ValueError, detect, '/raw/cg_data/dcl27/syslog/20161219.syslog.log')
+
+    def test_detect_ctdbp(self):
+        '''
+        Test detecting the CTDBP type from the file contents, independent of the
+        file name, falling back to the harvester default for an empty file.
+        '''
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for filename, ctd_type in [('20161219.ctdbp1.log', 1),
+                                       ('20161219.ctdbp2.log', 2),
+                                       ('20161110.ctdbp3.log', 3)]:
+                infile = path.join(tmpdir, '20161219.ctdbp.log')
+                shutil.copy(path.join(TESTDATA, filename), infile)
+                self.assertEqual(detect(infile), ('ctdbp', ctd_type))
+
+                ctdbp = create_parser(infile)
+                self.assertIsInstance(ctdbp, Parser)
+                self.assertEqual(ctdbp.ctd_type, ctd_type)
+                os.remove(infile)
+
+            infile = path.join(tmpdir, '20161220.ctdbp1.log')
+            open(infile, 'w').close()
+            self.assertEqual(detect(infile), ('ctdbp', 2))
+            self.assertEqual(create_parser(infile, 'ctdbp', 1).ctd_type, 1)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def _write(self, tmpdir, filename, lines):
+        infile = path.join(tmpdir, filename)
+        with open(infile, 'wb') as f:
+            f.write(''.join(lines))
+        return infile
+
+    def test_detect_nutnr(self):
+        '''
+        Test detecting the full and condensed NUTNR frames, falling back to the
+        harvester default for a file without any frames.
+        '''
+        tmpdir = tempfile.mkdtemp()
+        try:
+            nutnr = records('nutnr')
+            full = [next(nutnr) for i in range(100)]
+            infile = self._write(tmpdir, '20170101.nutnr.log', full)
+            self.assertEqual(detect(infile), ('nutnr', 1))
+            self.assertEqual(create_parser(infile).spectra, 1)
+
+            # the condensed frames end after the RMS error
+            condensed = [','.join(line.split(',')[:8]) + '\r\n' if 'SATN' in line else line for line in full]
+            infile = self._write(tmpdir, '20170101.nutnr.log', condensed)
+            self.assertEqual(detect(infile), ('nutnr', 0))
+
+            infile = self._write(tmpdir, '20170102.nutnr.log', [line for line in full if 'SATN' not in line])
+            self.assertEqual(detect(infile), ('nutnr', SWITCHES['nutnr']))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_detect_vel3d(self):
+        '''
+        Test detecting the VEL3D sampling rate from the number of velocity
+        packets per second, falling back to the harvester default for a file
+        too short to count them.
+        '''
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for rate in [1, 2, 4, 8, 16, 32, 64]:
+                vel3d = records('vel3d', rate=rate)
+                infile = self._write(tmpdir, '20170101_000000.vel3d.log',
+                                     [next(vel3d) for i in range(60 * (rate + 1) + 1)])
+                self.assertEqual(detect(infile), ('vel3d', rate))
+
+            # the header, a single system packet and its velocity packets
+            vel3d = records('vel3d', rate=2)
+            infile = self._write(tmpdir, '20170101_010000.vel3d.log', [next(vel3d) for i in range(4)])
+            self.assertEqual(detect(infile), ('vel3d', SWITCHES['vel3d']))
+            self.assertEqual(create_parser(infile).sample_rate, SWITCHES['vel3d'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
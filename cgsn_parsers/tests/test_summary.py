@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@package cgsn_parsers.tests.test_summary
+@file cgsn_parsers/tests/test_summary.py
+@author Christopher Wingard
+@brief Unit tests for the interval statistics of the parsed data
+"""
+import json
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+from argparse import Namespace
+from nose.plugins.attrib import attr
+
+from cgsn_parsers.benchmarks.generators import generate
+from cgsn_parsers.parsers.common import run_parser
+from cgsn_parsers.parsers.parse_fdchp import Parser as Fdchp
+from cgsn_parsers.parsers.parse_mopak import Parser
+from cgsn_parsers.parsers.summary import IntervalStats, summary_filename
+
+
+@attr('parse')
+class TestSummaryUnit(unittest.TestCase):
+    '''
+    Confirm the statistics accumulated over many blocks of data match those
+    calculated from all of the data at once, and that run_parser saves them
+    next to or instead of the parsed data.
+    '''
+    def setUp(self):
+        rnd = np.random.RandomState(0)
+        self.data = {
+            'time': 1483228800. + np.sort(rnd.uniform(0, 600, 5000)),
+            'x': rnd.normal(1e4, 1., 5000),
+            'y': rnd.uniform(-5, 5, 5000)
+        }
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_interval_stats(self):
+        '''
+        Test the statistics against NumPy, adding the data in one block and in
+        blocks out of time order.
+        '''
+        whole = IntervalStats(['x', 'y'], 60.).update(self.data).result()
+        stats = IntervalStats(['x', 'y'], 60.)
+        for block in [slice(3000, 5000), slice(0, 1), slice(1, 1), slice(1, 3000)]:
+            stats.update(dict((name, values[block]) for name, values in self.data.items()))
+        parts = stats.result()
+
+        bins = np.floor(self.data['time'] / 60.)
+        self.assertEqual(whole.time.tolist(), (np.unique(bins) * 60.).tolist())
+        for summary in [whole, parts]:
+            self.assertEqual(summary.count.tolist(), np.bincount((bins - bins[0]).astype(int)).tolist())
+            for i, b in enumerate(np.unique(bins)):
+                for name in ['x', 'y']:
+                    values = self.data[name][bins == b]
+                    self.assertAlmostEqual(summary.mean[name][i], values.mean(), places=9)
+                    self.assertAlmostEqual(summary.std[name][i], values.std(), places=9)
+                    self.assertEqual(summary.min[name][i], values.min())
+                    self.assertEqual(summary.max[name][i], values.max())
+
+    def test_run_parser(self):
+        '''
+        Test the MOPAK summary saved next to the parsed data matches the one
+        saved in place of it, reduced batch by batch.
+        '''
+        infile = generate('mopak', self.tmpdir, 200000)
+        outfile = os.path.join(self.tmpdir, 'mopak.json')
+        run_parser(Parser(infile), outfile, Namespace(summary=10.))
+        self.assertEqual(summary_filename(outfile), os.path.join(self.tmpdir, 'mopak.summary.json'))
+        with open(summary_filename(outfile), 'r') as f:
+            summary = json.load(f)
+        with open(outfile, 'r') as f:
+            data = json.load(f)
+
+        self.assertEqual(sum(summary['count']), len(data['time']))
+        self.assertEqual(sorted(summary['mean'].keys()), sorted(Parser._summary))
+        self.assertEqual(summary['max']['acceleration_x'][0],
+                         max(v for t, v in zip(data['time'], data['acceleration_x']) if t < summary['time'][1]))
+
+        onlyfile = os.path.join(self.tmpdir, 'mopak.only.json')
+        mopak = Parser(infile)
+        mopak.iter_batches = lambda: Parser.iter_batches(mopak, batch_size=10000)
+        run_parser(mopak, onlyfile, Namespace(summary=10., summary_only=True))
+        with open(onlyfile, 'r') as f:
+            only = json.load(f)
+
+        self.assertEqual(only['count'], summary['count'])
+        self.assertEqual(only['max'], summary['max'])
+        np.testing.assert_allclose(only['std']['angular_rate_z'], summary['std']['angular_rate_z'], rtol=1e-12)
+
+        # only the FDCHP accelerations and rates are summarized, not the angles
+        infile = generate('fdchp', self.tmpdir, 100000)
+        run_parser(Fdchp(infile), onlyfile, Namespace(summary=3600., summary_only=True))
+        with open(onlyfile, 'r') as f:
+            only = json.load(f)
+        self.assertEqual(sorted(only['mean'].keys()), sorted(['acceleration_x', 'acceleration_y', 'acceleration_z',
+                                                              'rate_x', 'rate_y', 'rate_z']))
+
+
+if __name__ == '__main__':
+    unittest.main()
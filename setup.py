@@ -28,5 +28,8 @@ setup(name='cgsn_parsers',
         'argparse >= 1.3.0',
         'gsw >= 3.0.3'
     ],
+    extras_require = {
+        'netcdf': ['netCDF4 >= 1.2.4']
+    },
     include_package_data = True,
     zip_safe = False)